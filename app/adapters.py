@@ -0,0 +1,141 @@
+"""
+Adaptadores de esquema aprendidos: cada campo recuerda hasta qué alias de su lista usa el
+upstream (p.ej. MS2 responde `precio` o `price`) y en cada lectura prueba solo ese prefijo,
+con `dict.get` directos y las claves anidadas agrupadas por padre. Si ningún alias del prefijo
+trae valor se recorre la lista completa (como `pick()`) y el prefijo crece hasta el alias que
+aparezca: un cambio de esquema se re-detecta solo y un MS que mezcla esquemas converge sin
+re-aprender en cada respuesta. El resultado es siempre el mismo que daría `pick()`.
+"""
+from typing import Any, Callable, Optional, Union
+
+Alias = Union[str, tuple[str, str]]  # "precio" | ("categoria", "id") para campos anidados
+Step = tuple[str, Optional[tuple[str, ...]]]  # (clave, None) | (padre, claves internas)
+
+
+def _lookup(d: dict, alias: Alias):
+    if alias.__class__ is str:
+        return d.get(alias)
+    inner = d.get(alias[0])
+    return inner.get(alias[1]) if isinstance(inner, dict) else None
+
+
+def _to_int(v: Any) -> int:
+    return v if v.__class__ is int else int(v)
+
+
+def _plan(aliases: tuple[Alias, ...]) -> tuple[Step, ...]:
+    """Alias en orden, con los anidados consecutivos del mismo padre en un solo paso."""
+    steps: list[Step] = []
+    for alias in aliases:
+        if alias.__class__ is str:
+            steps.append((alias, None))
+        elif steps and steps[-1][1] is not None and steps[-1][0] == alias[0]:
+            steps[-1] = (alias[0], steps[-1][1] + (alias[1],))
+        else:
+            steps.append((alias[0], (alias[1],)))
+    return tuple(steps)
+
+
+class Field:
+    """Un campo y sus alias en orden de preferencia; `field(d, default)` lee el valor."""
+
+    __slots__ = ("name", "aliases", "read", "as_int", "_plan", "_seen", "_learned", "probes",
+                 "shape_changes")
+
+    def __init__(self, name: str, aliases: tuple[Alias, ...]):
+        self.name = name
+        self.aliases = aliases
+        self._plan: tuple[Step, ...] = ()  # prefijo de alias que se prueba en cada lectura
+        self._seen = 0                     # largo del prefijo (en alias)
+        self._learned: Optional[Alias] = None
+        self.probes = 0
+        self.shape_changes = 0
+        # clausuras en vez de métodos: el acceso por campo es el camino caliente
+        self.read = self._reader()
+        self.as_int = self._int_reader(self.read)
+
+    def __call__(self, d: dict, default: Any = None) -> Any:
+        return self.read(d, default)
+
+    def _reader(self) -> Callable[..., Any]:
+        field = self
+
+        def read(d: dict, default: Any = None) -> Any:
+            for key, inner_keys in field._plan:
+                v = d.get(key)
+                if v is None:
+                    continue
+                if inner_keys is None:
+                    return v
+                if isinstance(v, dict):
+                    for k in inner_keys:
+                        inner = v.get(k)
+                        if inner is not None:
+                            return inner
+            return field._probe(d, default)
+
+        return read
+
+    def _int_reader(self, read: Callable[..., Any]) -> Callable[[dict], Optional[int]]:
+        field = self
+
+        def as_int(d: dict) -> Optional[int]:
+            v = read(d)
+            if v is None or v.__class__ is int:
+                return v
+            try:
+                return int(v)
+            except (TypeError, ValueError):
+                # p.ej. `categoria_id` no numérico: se prueba el resto de alias (anidado incluido)
+                return field._probe(d, None, _to_int)
+
+        return as_int
+
+    def _probe(self, d: dict, default: Any, convert=None) -> Any:
+        self.probes += 1
+        for i, alias in enumerate(self.aliases):
+            v = _lookup(d, alias)
+            if v is None:
+                continue
+            if convert is None:
+                self._learn(i)
+                return v
+            try:
+                # sin aprender: el prefijo ya cubre el primer alias presente
+                return convert(v)
+            except (TypeError, ValueError):
+                continue
+        return default
+
+    def _learn(self, i: int) -> None:
+        if self._learned is not None:
+            self.shape_changes += 1
+        self._learned = self.aliases[i]
+        if i >= self._seen:
+            self._seen = i + 1
+            self._plan = _plan(self.aliases[:self._seen])
+
+    @property
+    def learned(self) -> Optional[str]:
+        alias = self._learned
+        if alias is None or alias.__class__ is str:
+            return alias
+        return ".".join(alias)
+
+
+class SchemaAdapter:
+    """Conjunto de campos de un endpoint (p.ej. producto de MS2): `PRODUCT.precio(d)`."""
+
+    def __init__(self, name: str, **fields: tuple[Alias, ...]):
+        self.name = name
+        self.fields = {f: Field(f, aliases) for f, aliases in fields.items()}
+        for f, field in self.fields.items():
+            setattr(self, f, field.read)
+            field.read.as_int = field.as_int
+
+    def stats(self) -> dict:
+        return {
+            "learned": {f: field.learned for f, field in self.fields.items()},
+            "probes": sum(field.probes for field in self.fields.values()),
+            "shape_changes": sum(field.shape_changes for field in self.fields.values()),
+        }
@@ -0,0 +1,236 @@
+"""
+Control de admisión para `/orq/*`.
+
+Cada ruta (plantilla, p.ej. `/orq/orders/{order_id}/details`) tiene un límite de requests en
+proceso y una cola FIFO acotada. Un request espera en la cola como mucho `queue_timeout`; con la
+cola llena o el tiempo de cola agotado se responde 503 + Retry-After al instante, en vez de
+aceptar trabajo que igual terminaría en timeout (y que ocupa memoria y conexiones a los MS).
+En modo adaptativo el límite se ajusta tipo AIMD: +1 por intervalo mientras la latencia
+observada de los MS está bajo el objetivo y el límite se usa, × `decrease` si la supera o hubo errores.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+
+from app import timing
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str):
+        super().__init__(f"admisión rechazada: {reason}")
+        self.reason = reason
+
+
+class AdmissionLimiter:
+    def __init__(self, name: str, limit: int, queue_size: int, queue_timeout: float,
+                 adaptive: bool = False, min_limit: int = 1, max_limit: Optional[int] = None,
+                 signal: Optional[Callable[[], Optional[float]]] = None, target: float = 0.25,
+                 adjust_interval: float = 1.0, decrease: float = 0.7):
+        self.name = name
+        self.limit = float(max(1, limit))
+        self.queue_size = max(0, int(queue_size))
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive and signal is not None
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit or limit))
+        self._signal = signal
+        self.target = target
+        self.adjust_interval = adjust_interval
+        self.decrease = decrease
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._errors = 0
+        self._adjusted_at = time.monotonic()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.increases = 0
+        self.decreases = 0
+
+    async def acquire(self) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            self.rejected_full += 1
+            raise Overloaded("queue_full")
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(fut, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                self._release_slot()  # el cupo llegó en el mismo tick que el timeout
+            else:
+                self._forget(fut)
+            self.rejected_timeout += 1
+            raise Overloaded("queue_timeout")
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release_slot()  # el cupo llegó justo cuando cancelaron al request
+            else:
+                self._forget(fut)
+            raise
+        self.admitted += 1
+
+    def release(self, ok: bool = True) -> None:
+        if not ok:
+            self._errors += 1
+        if self.adaptive:
+            self._adjust()  # antes de liberar: el request que termina también cuenta como uso del límite
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        # el cupo pasa directo al siguiente de la cola (FIFO): nadie se cuela desde afuera
+        while self._waiters and self.in_flight < int(self.limit):
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_flight += 1
+                fut.set_result(None)
+
+    def _forget(self, fut: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(fut)
+        except ValueError:
+            pass
+
+    def _adjust(self) -> None:
+        now = time.monotonic()
+        if now - self._adjusted_at < self.adjust_interval:
+            return
+        self._adjusted_at = now
+        latency = self._signal()
+        errors, self._errors = self._errors, 0
+        if errors or (latency is not None and latency > self.target):
+            self.limit = max(float(self.min_limit), self.limit * self.decrease)
+            self.decreases += 1
+        elif self.in_flight + len(self._waiters) >= int(self.limit) and self.limit < self.max_limit:
+            # solo crece si el límite actual se está usando
+            self.limit = min(float(self.max_limit), self.limit + 1)
+            self.increases += 1
+            self._wake()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued_now": self.waiting,
+            "queue_size": self.queue_size,
+            "queue_timeout_ms": round(self.queue_timeout * 1000, 1),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_queue_timeout": self.rejected_timeout,
+            "adaptive": self.adaptive,
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI: admite o rechaza (503) los requests cuyo path empieza con `prefix`.
+    El resto (`/health`, `/metrics`, `/admin/*`) no pasa por aquí. El cupo se libera al
+    terminar de enviar la respuesta (incluye los streams NDJSON).
+    """
+
+    def __init__(self, app, controller: "AdmissionController", prefix: str = "/orq/"):
+        self.app = app
+        self.controller = controller
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+        limiter = self.controller.limiter_for(scope)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Orquestador saturado, reintenta más tarde", "reason": e.reason},
+                headers={"Retry-After": str(self.controller.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        timing.record("queue", time.perf_counter() - t0)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # 5xx (MS caído, deadline agotado) cuenta como señal de congestión para el modo adaptativo
+            limiter.release(ok=status < 500)
+
+
+class AdmissionController:
+    """Un `AdmissionLimiter` por plantilla de ruta, creado al primer request."""
+
+    def __init__(self, router, limit: int, queue_size: int, queue_timeout: float, retry_after: int = 1,
+                 route_limits: Optional[dict[str, int]] = None, **adaptive):
+        self.router = router
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = max(1, int(retry_after))
+        self.route_limits = route_limits or {}
+        self.adaptive = adaptive
+        self.limiters: dict[str, AdmissionLimiter] = {}
+        self._routes: Optional[list] = None
+
+    def limiter_for(self, scope) -> Optional[AdmissionLimiter]:
+        if self._routes is None:
+            # las rutas se registran después de crear el controller: se filtran en el primer request
+            self._routes = [r for r in self.router.routes if getattr(r, "path", "").startswith("/orq/")]
+        for route in self._routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                path = route.path
+                limiter = self.limiters.get(path)
+                if limiter is None:
+                    limit = self.route_limits.get(path, self.limit)
+                    if limit <= 0:
+                        return None  # ruta sin límite
+                    limiter = self.limiters[path] = AdmissionLimiter(
+                        path, limit, self.queue_size, self.queue_timeout, max_limit=limit, **self.adaptive)
+                return limiter
+        return None  # 404/405: que responda el router
+
+    def stats(self) -> dict:
+        return {path: limiter.stats() for path, limiter in self.limiters.items()}
+
+
+def parse_route_limits(raw: str) -> dict[str, int]:
+    """`"/orq/cart/price-quote=100,/orq/cart/price-quote/batch=4"` -> {ruta: límite}."""
+    limits = {}
+    for part in raw.split(","):
+        path, sep, value = part.strip().rpartition("=")
+        if sep and path:
+            limits[path.strip()] = int(value)
+    return limits
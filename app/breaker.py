@@ -0,0 +1,117 @@
+import time
+from collections import deque
+from typing import Optional
+
+
+class CircuitOpenError(Exception):
+    """El circuito del microservicio está abierto: se falla rápido sin llamarlo."""
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"circuito abierto para {name}")
+        self.name = name
+        self.retry_after = max(0.0, retry_after)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por microservicio (closed -> open -> half_open -> closed).
+    - closed: ventana deslizante de las últimas `window` llamadas; abre si, con al menos
+      `min_calls`, la tasa de error (excepción o 5xx) supera `error_rate` o la de llamadas
+      lentas (> `slow_call` s) supera `slow_rate`.
+    - open: toda llamada falla con CircuitOpenError durante `open_seconds`.
+    - half_open: deja pasar hasta `half_open_calls` llamadas de prueba; si todas van bien
+      cierra, si alguna falla vuelve a abrir.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, window: int = 50, min_calls: int = 20, error_rate: float = 0.5,
+                 slow_call: float = 2.0, slow_rate: float = 0.8, open_seconds: float = 10.0,
+                 half_open_calls: int = 3):
+        self.name = name
+        self.window = max(1, int(window))
+        self.min_calls = max(1, min(int(min_calls), self.window))
+        self.error_rate = float(error_rate)
+        self.slow_call = float(slow_call)
+        self.slow_rate = float(slow_rate)
+        self.open_seconds = float(open_seconds)
+        self.half_open_calls = max(1, int(half_open_calls))
+        self.state = self.CLOSED
+        self._outcomes: deque[tuple[bool, bool]] = deque()  # (falló, lenta)
+        self._failures = 0
+        self._slow = 0
+        self._opened_at = 0.0
+        self._trials = 0        # llamadas de prueba en vuelo (half_open)
+        self._trial_ok = 0
+        self.opened_count = 0
+        self.rejected = 0
+
+    def acquire(self) -> None:
+        """Antes de cada llamada: lanza CircuitOpenError si no se permite."""
+        if self.state == self.OPEN:
+            remaining = self._opened_at + self.open_seconds - time.monotonic()
+            if remaining > 0:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, remaining)
+            self.state = self.HALF_OPEN
+            self._trials = 0
+            self._trial_ok = 0
+        if self.state == self.HALF_OPEN:
+            if self._trials >= self.half_open_calls:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, 0.0)
+            self._trials += 1
+
+    def release(self) -> None:
+        """Después de cada llamada permitida (éxito, error o cancelación)."""
+        if self.state == self.HALF_OPEN and self._trials > 0:
+            self._trials -= 1
+
+    def record(self, ok: bool, latency: float) -> None:
+        if self.state == self.HALF_OPEN:
+            if not ok:
+                self._open()
+                return
+            self._trial_ok += 1
+            if self._trial_ok >= self.half_open_calls:
+                self._close()
+            return
+        if self.state == self.OPEN:
+            return
+        failed, slow = not ok, latency > self.slow_call
+        self._outcomes.append((failed, slow))
+        self._failures += failed
+        self._slow += slow
+        if len(self._outcomes) > self.window:
+            old_failed, old_slow = self._outcomes.popleft()
+            self._failures -= old_failed
+            self._slow -= old_slow
+        n = len(self._outcomes)
+        if n >= self.min_calls and (self._failures / n > self.error_rate or self._slow / n > self.slow_rate):
+            self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.opened_count += 1
+
+    def _close(self) -> None:
+        self.state = self.CLOSED
+        self._outcomes.clear()
+        self._failures = self._slow = 0
+
+    def retry_after(self) -> Optional[float]:
+        if self.state != self.OPEN:
+            return None
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def stats(self) -> dict:
+        n = len(self._outcomes)
+        return {
+            "state": self.state,
+            "window_calls": n,
+            "error_rate": round(self._failures / n, 4) if n else None,
+            "slow_rate": round(self._slow / n, 4) if n else None,
+            "retry_after": self.retry_after(),
+            "opened_count": self.opened_count,
+            "rejected": self.rejected,
+        }
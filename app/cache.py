@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from app import deadline, timing
+
+# Centinela para distinguir "no está en cache" de un negativo cacheado (None)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Cache en memoria, acotada (LRU) y con TTL, pensada para lookups a microservicios.
+    - Entradas positivas: frescas durante `ttl`; luego se sirven "stale" hasta `ttl + stale_ttl`
+      mientras se refrescan en segundo plano (stale-while-revalidate).
+    - Entradas negativas (valor None, p.ej. 404): se guardan `negative_ttl` y no se sirven stale.
+    - `ttl <= 0` desactiva la cache (siempre se llama al loader).
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: float,
+                 stale_ttl: float = 0.0, negative_ttl: float = 0.0):
+        self.name = name
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.stale_ttl = max(0.0, float(stale_ttl))
+        self.negative_ttl = max(0.0, float(negative_ttl))
+        # key -> (value, fresh_until, stale_until)
+        self._data: "OrderedDict[Hashable, tuple[Any, float, float]]" = OrderedDict()
+        self._refreshing: dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Lectura sin loader: devuelve el valor (fresco o stale) o `default`. No cuenta métricas."""
+        entry = self._data.get(key)
+        if entry is None or time.monotonic() >= entry[2]:
+            return default
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if value is None:
+            if self.negative_ttl <= 0:
+                self._data.pop(key, None)
+                return
+            fresh_until = stale_until = now + self.negative_ttl
+        else:
+            fresh_until = now + self.ttl
+            stale_until = fresh_until + self.stale_ttl
+        self._data[key] = (value, fresh_until, stale_until)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[Hashable], Awaitable[Any]]) -> Any:
+        """
+        Devuelve el valor cacheado o lo carga con `loader(key)`.
+        Si el loader lanza excepción no se cachea nada y la excepción se propaga.
+        """
+        if not self.enabled:
+            self.misses += 1
+            return await loader(key)
+
+        entry = self._data.get(key)
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            now = time.monotonic()
+            if now < fresh_until:
+                self._data.move_to_end(key)
+                if value is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return value
+            if now < stale_until:
+                self._data.move_to_end(key)
+                self.stale_hits += 1
+                self._schedule_refresh(key, loader)
+                return value
+            del self._data[key]
+
+        self.misses += 1
+        value = await loader(key)
+        self.set(key, value)
+        return value
+
+    def _schedule_refresh(self, key: Hashable, loader: Callable[[Hashable], Awaitable[Any]]) -> None:
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(key, loader), context=timing.detached(deadline.detached()))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _t, k=key: self._refreshing.pop(k, None))
+
+    async def _refresh(self, key: Hashable, loader: Callable[[Hashable], Awaitable[Any]]) -> None:
+        self.refreshes += 1
+        try:
+            value = await loader(key)
+        except Exception:
+            # seguimos sirviendo el valor stale hasta que expire
+            self.refresh_errors += 1
+            return
+        self.set(key, value)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.negative_hits + self.misses
+        served = self.hits + self.stale_hits + self.negative_hits
+        return {
+            "name": self.name,
+            "enabled": self.enabled,
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "negative_ttl": self.negative_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "hit_ratio": round(served / lookups, 4) if lookups else None,
+        }
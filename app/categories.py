@@ -0,0 +1,120 @@
+import asyncio
+import time
+from typing import Any, Callable, Optional
+
+from app.codec import response_json
+from app.upstream import Upstream
+
+
+class CategoryIndex:
+    """
+    Mapa id_categoria -> nombre de MS2 (/categorias), cargado al arrancar y
+    refrescado en segundo plano cada `interval` segundos.
+    - Usa GET condicional (If-None-Match / If-Modified-Since) si MS2 envía ETag/Last-Modified.
+    - El mapa se reemplaza entero (swap atómico de referencia): los handlers solo hacen dict lookup.
+    """
+
+    def __init__(self, upstream: Upstream, path: str, interval: float, parse: Callable[[Any], dict],
+                 retry_interval: float = 10.0):
+        self.upstream = upstream
+        self.path = path
+        self.interval = max(1.0, float(interval))
+        self.retry_interval = min(self.interval, max(1.0, float(retry_interval)))
+        self._parse = parse
+        self._map: dict[int, Optional[str]] = {}
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.loaded_at: Optional[float] = None
+        self.refreshes = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def get(self, cat_id: Optional[int]) -> Optional[str]:
+        return self._map.get(cat_id)
+
+    def __contains__(self, cat_id) -> bool:
+        return cat_id in self._map
+
+    @property
+    def mapping(self) -> dict[int, Optional[str]]:
+        """Mapa actual (no modificar: se reemplaza entero en cada refresco)."""
+        return self._map
+
+    def load(self, mapping: dict[int, Optional[str]]) -> None:
+        """Reemplaza el mapa con uno obtenido por otra vía (p.ej. el snapshot de otro worker)."""
+        self._map = mapping
+        self.loaded_at = time.time()
+
+    async def refresh(self, force: bool = False) -> bool:
+        """Descarga /categorias (condicional salvo `force`). Devuelve True si el mapa cambió."""
+        async with self._lock:
+            headers = {}
+            if not force:
+                if self._etag:
+                    headers["If-None-Match"] = self._etag
+                if self._last_modified:
+                    headers["If-Modified-Since"] = self._last_modified
+            self.refreshes += 1
+            try:
+                r = await self.upstream.get(self.path, headers=headers)
+                if r.status_code == 304:
+                    self.not_modified += 1
+                    self.loaded_at = time.time()
+                    return False
+                if r.status_code != 200:
+                    raise RuntimeError(f"status {r.status_code}")
+                new_map = self._parse(response_json(r))
+            except Exception as e:
+                self.errors += 1
+                self.last_error = repr(e)
+                raise
+            self._map = new_map
+            self._etag = r.headers.get("ETag")
+            self._last_modified = r.headers.get("Last-Modified")
+            self.loaded_at = time.time()
+            self.last_error = None
+            return True
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            # si aún no se pudo cargar (MS2 caído al arrancar) reintentamos antes
+            await asyncio.sleep(self.interval if self.loaded else self.retry_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                # best-effort: seguimos sirviendo el último mapa bueno
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "url": self.upstream.url(self.path),
+            "size": len(self._map),
+            "interval": self.interval,
+            "loaded_at": self.loaded_at,
+            "etag": self._etag,
+            "last_modified": self._last_modified,
+            "refreshes": self.refreshes,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,61 @@
+"""
+JSON del orquestador: orjson si está instalado (fallback a json de la stdlib).
+- `response_json(r)` decodifica el body de un upstream una sola vez y lo memoriza en la
+  respuesta (singleflight y los lookups del batch comparten la misma httpx.Response).
+- `FastJSONResponse` serializa directo a bytes: devolverla desde un endpoint evita el
+  `jsonable_encoder` de FastAPI (los resultados ya son dict/list/str/números).
+"""
+import json
+from typing import Any
+
+import httpx
+from starlette.responses import Response
+
+from app import timing
+
+try:
+    import orjson
+    HAVE_ORJSON = True
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+    HAVE_ORJSON = False
+
+_DECODED = "_orq_json"
+
+
+def loads(data: bytes | str) -> Any:
+    if HAVE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    if HAVE_ORJSON:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass  # p.ej. enteros de más de 64 bits: los resuelve la stdlib
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def response_json(r: httpx.Response) -> Any:
+    """Como `r.json()`, pero parsea una sola vez aunque la respuesta se lea desde varios sitios."""
+    try:
+        return getattr(r, _DECODED)
+    except AttributeError:
+        pass
+    with timing.stage("json_parse"):
+        try:
+            value = loads(r.content)
+        except ValueError:
+            value = r.json()  # otro encoding: que httpx lo detecte (o lance el mismo error)
+    setattr(r, _DECODED, value)
+    return value
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        with timing.stage("serialize"):
+            return dumps(content)
@@ -0,0 +1,101 @@
+"""
+GET condicional contra los MS y ETags propios.
+
+`Revalidator` recuerda, por path, los validadores (ETag / Last-Modified) que mandó el MS junto
+con el valor ya parseado: la siguiente consulta va con If-None-Match / If-Modified-Since y un 304
+devuelve el valor guardado sin bajar ni parsear el body. Si el MS no manda validadores no se
+guarda nada (la versión sale de un hash del body).
+`strong_etag` / `etag_matches` construyen y comparan los ETag que el orquestador devuelve.
+"""
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable, NamedTuple, Optional
+
+import httpx
+
+from app.codec import dumps
+from app.upstream import Upstream
+
+
+class _Validated(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    value: Any
+    version: str
+
+
+class Revalidator:
+    def __init__(self, upstream: Upstream, max_entries: int = 10000, enabled: bool = True):
+        self.upstream = upstream
+        self.max_entries = max(1, int(max_entries))
+        self.enabled = enabled
+        self._entries: OrderedDict[str, _Validated] = OrderedDict()
+        self.not_modified = 0
+        self.modified = 0
+        self.no_validators = 0
+
+    async def get(self, path: str, parse: Callable[[httpx.Response], Any]) -> tuple[int, Any, Optional[str]]:
+        """
+        (status, valor, versión). Con 200 (o 304 sobre lo guardado) el valor es `parse(r)` y la
+        versión el ETag del MS o un hash del body; con otro status, (status, None, None).
+        """
+        entry = self._entries.get(path) if self.enabled else None
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        r = await self.upstream.get(path, headers=headers) if headers else await self.upstream.get(path)
+        if r.status_code == 304 and entry is not None:
+            self.not_modified += 1
+            self._entries.move_to_end(path)
+            return 200, entry.value, entry.version
+        if r.status_code != 200:
+            self._entries.pop(path, None)
+            return r.status_code, None, None
+
+        value = parse(r)
+        etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+        version = etag or hashlib.blake2b(r.content, digest_size=16).hexdigest()
+        if self.enabled and (etag or last_modified):
+            self.modified += 1
+            self._entries[path] = _Validated(etag, last_modified, value, version)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self.no_validators += 1
+            self._entries.pop(path, None)
+        return 200, value, version
+
+    def invalidate(self, path: str) -> None:
+        self._entries.pop(path, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "upstream": self.upstream.name,
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "not_modified": self.not_modified,
+            "modified": self.modified,
+            "no_validators": self.no_validators,
+        }
+
+
+def strong_etag(parts: Any) -> str:
+    """ETag fuerte a partir de todo lo que determina el body (debe ser serializable a JSON)."""
+    return '"' + hashlib.blake2b(dumps(parts), digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match usa comparación débil: se ignora el prefijo W/."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
@@ -0,0 +1,81 @@
+"""
+Deadline de extremo a extremo por request.
+
+`scope(seconds)` fija el instante límite en un contextvar (las tareas creadas dentro lo heredan)
+y corta el bloque entero al vencer. `Upstream` lee `remaining()` para que cada llamada use solo
+el presupuesto que queda (timeout de httpx recortado + header propagado al MS).
+El trabajo compartido entre requests (lotes del loader, refrescos de cache) corre en `detached()`:
+sin deadline propio; cada request que lo espera sigue acotado por el suyo.
+"""
+import asyncio
+import contextvars
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("orq_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Se agotó el presupuesto de tiempo del request."""
+    def __init__(self, budget: Optional[float] = None):
+        super().__init__("deadline del request agotado")
+        self.budget = budget
+
+
+def remaining() -> Optional[float]:
+    """Segundos que quedan (puede ser <= 0) o None si el request no tiene deadline."""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def parse_header(value: Optional[str]) -> Optional[float]:
+    """Header del cliente en milisegundos -> segundos (None si falta o no es válido)."""
+    if not value:
+        return None
+    try:
+        ms = float(value)
+    except ValueError:
+        return None
+    return ms / 1000 if ms > 0 else None
+
+
+def budget(default: float, header_value: Optional[str] = None) -> Optional[float]:
+    """El cliente puede acortar el deadline por defecto, no alargarlo. None/0 = sin deadline."""
+    requested = parse_header(header_value)
+    if default <= 0:
+        return requested
+    return min(default, requested) if requested is not None else default
+
+
+@asynccontextmanager
+async def scope(seconds: Optional[float]):
+    if seconds is None:
+        yield
+        return
+    at = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None and outer < at:
+        at = outer  # un scope anidado nunca extiende el del request
+    token = _deadline.set(at)
+    try:
+        async with asyncio.timeout(at - time.monotonic()) as cm:
+            yield
+    except TimeoutError:
+        if cm.expired():
+            raise DeadlineExceeded(seconds) from None
+        raise
+    finally:
+        _deadline.reset(token)
+
+
+def detached() -> contextvars.Context:
+    """Contexto sin deadline para tareas compartidas entre requests."""
+    ctx = contextvars.copy_context()
+    ctx.run(_deadline.set, None)
+    return ctx
@@ -0,0 +1,233 @@
+"""
+Historial de pedidos en MS3.
+
+MS3 no tiene una ruta/payload fijo para el historial: la combinación que funciona (o el veredicto
+"no soportado") se descubre una vez por base URL y se recuerda `ttl` segundos. Solo se vuelve a
+descubrir si la ruta aprendida deja de existir (405, o 404 de la ruta y no del pedido); un
+re-descubrimiento nunca termina en "no soportado".
+`enqueue` saca la escritura del camino crítico: cola acotada, workers en segundo plano y
+reintentos con backoff exponencial.
+"""
+import asyncio
+import time
+from typing import NamedTuple, Optional
+
+from app.upstream import Upstream
+
+PATHS = ("/historial", "/pedidos/{order_id}/historial", "/historial/{order_id}")
+ID_KEYS = ("id_pedido", "idPedido", "pedido_id", None)  # None: la ruta ya lleva el id
+OK = (200, 201)
+# la ruta aprendida ya no acepta POST; un 404 solo cuenta si el GET confirma que la ruta no existe
+# (400/422 suelen ser validación del payload de ese pedido: no justifican re-descubrir)
+STALE_ROUTE = (405,)
+
+
+class HistoryRoute(NamedTuple):
+    path: Optional[str]  # plantilla de PATHS; None = MS3 no tiene historial
+    id_key: Optional[str]
+    expires_at: float
+
+
+def _payload(id_key: Optional[str], order_id: str, estado: str, comentarios: str) -> dict:
+    body = {id_key: order_id} if id_key else {}
+    body.update(estado=estado, comentarios=comentarios)
+    return body
+
+
+class HistoryWriter:
+    def __init__(self, upstream: Upstream, ttl: float, unsupported_ttl: float, queue_size: int = 1000,
+                 workers: int = 4, retries: int = 3, retry_backoff: float = 0.5):
+        self.upstream = upstream
+        self.ttl = ttl
+        self.unsupported_ttl = unsupported_ttl
+        self.retries = max(0, int(retries))
+        self.retry_backoff = retry_backoff
+        self.workers = max(1, int(workers))
+        self._routes: dict[str, HistoryRoute] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, int(queue_size)))
+        self._tasks: list[asyncio.Task] = []
+        self.discoveries = 0
+        self.discovery_calls = 0
+        self.rediscoveries = 0
+        self.written = 0
+        self.skipped_unsupported = 0
+        self.enqueued = 0
+        self.dropped = 0
+        self.retried = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+
+    # --- escritura directa ---
+    async def write(self, order_id: str, estado: str, comentarios: str) -> tuple[bool, str]:
+        """
+        (ok, msg). ok=True si se escribió o si MS3 no tiene historial; ok=False si MS3 sí lo tiene
+        (o no respondió) y la escritura falló.
+        """
+        base = self.upstream.base_url
+        route = self._route(base)
+        if route is None:
+            async with self._lock(base):
+                route = self._route(base)  # otro request pudo descubrirla mientras esperábamos
+                if route is None:
+                    return await self._discover(base, order_id, estado, comentarios)
+        if route.path is None:
+            self.skipped_unsupported += 1
+            return True, "historial no soportado en MS3 (cacheado)"
+
+        status, body = await self._post(route.path, route.id_key, order_id, estado, comentarios)
+        if status in OK:
+            self.written += 1
+            return True, f"historial ok via {self.upstream.url(route.path.format(order_id=order_id))}"
+        if status in STALE_ROUTE or (status == 404 and not await self._exists(route.path, order_id)):
+            async with self._lock(base):
+                if self._routes.get(base) is route:
+                    self._routes.pop(base, None)
+                    self.rediscoveries += 1
+                    return await self._discover(base, order_id, estado, comentarios, rediscovery=True)
+            return await self.write(order_id, estado, comentarios)  # otro request ya re-descubrió
+        return False, f"fallo historial MS3 (status {status or 'EXC'}, body={body})"
+
+    def _route(self, base: str) -> Optional[HistoryRoute]:
+        route = self._routes.get(base)
+        if route is not None and time.monotonic() >= route.expires_at:
+            self._routes.pop(base, None)
+            return None
+        return route
+
+    def _lock(self, base: str) -> asyncio.Lock:
+        lock = self._locks.get(base)
+        if lock is None:
+            lock = self._locks[base] = asyncio.Lock()
+        return lock
+
+    async def _post(self, path: str, id_key: Optional[str], order_id: str, estado: str,
+                    comentarios: str) -> tuple[Optional[int], object]:
+        try:
+            r = await self.upstream.post(path.format(order_id=order_id),
+                                         json=_payload(id_key, order_id, estado, comentarios))
+        except Exception as e:
+            return None, repr(e)
+        try:
+            body = r.json()
+        except Exception:
+            body = r.text
+        return r.status_code, body
+
+    async def _exists(self, path: str, order_id: str) -> bool:
+        """GET (solo lectura) a la ruta: cualquier cosa distinta de 404 (405 incluido) dice que existe."""
+        try:
+            r = await self.upstream.get(path.format(order_id=order_id))
+        except Exception:
+            return True  # sin respuesta no se puede afirmar que la ruta no exista
+        return r.status_code != 404
+
+    async def _rank_paths(self, order_id: str) -> list[tuple[str, bool]]:
+        """
+        (ruta, existe) con un GET a cada ruta candidata, en paralelo: las que existen se prueban
+        primero. Los POST del descubrimiento van en serie: no son idempotentes y dos rutas válidas
+        escribirían el historial dos veces.
+        """
+        hints = await asyncio.gather(*(self._exists(p, order_id) for p in PATHS))
+        return sorted(zip(PATHS, hints), key=lambda ph: not ph[1])
+
+    async def _discover(self, base: str, order_id: str, estado: str, comentarios: str,
+                        rediscovery: bool = False) -> tuple[bool, str]:
+        self.discoveries += 1
+        last_status, last_body = None, None
+        only_404 = True
+        ranked = await self._rank_paths(order_id)
+        for path, _ in ranked:
+            # todas las formas de payload en cada ruta: un 404 puede venir del payload
+            # (MS3 no encuentra el pedido bajo `pedido_id` pero sí bajo `id_pedido`)
+            for id_key in ID_KEYS:
+                status, body = await self._post(path, id_key, order_id, estado, comentarios)
+                self.discovery_calls += 1
+                last_status, last_body = status, body
+                if status in OK:
+                    self._routes[base] = HistoryRoute(path, id_key, time.monotonic() + self.ttl)
+                    self.written += 1
+                    return True, f"historial ok via {self.upstream.url(path.format(order_id=order_id))}"
+                if status != 404:
+                    only_404 = False  # la ruta existe (payload rechazado) o MS3 no respondió
+        # "no soportado" solo si todo dio 404 y ningún GET encontró la ruta; nunca si antes funcionaba
+        if only_404 and not rediscovery and not any(exists for _, exists in ranked):
+            self._routes[base] = HistoryRoute(None, None, time.monotonic() + self.unsupported_ttl)
+            return True, "historial no soportado en MS3 (404 en todas las rutas)"
+        # fallo real o transitorio: no se cachea, el próximo intento vuelve a descubrir
+        return False, f"fallo historial MS3 (último status {last_status or 'EXC'}, body={last_body})"
+
+    # --- modo asíncrono (fire-and-forget) ---
+    def enqueue(self, order_id: str, estado: str, comentarios: str) -> bool:
+        """Encola la escritura; False si la cola está llena (se descarta y se cuenta en `dropped`)."""
+        return self._put((order_id, estado, comentarios, 0))
+
+    def _put(self, item: tuple) -> bool:
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            order_id, estado, comentarios, attempt = await self._queue.get()
+            try:
+                try:
+                    ok, msg = await self.write(order_id, estado, comentarios)
+                except Exception as e:
+                    ok, msg = False, repr(e)
+                if not ok:
+                    self.last_error = msg
+                    if attempt < self.retries:
+                        # reintento diferido sin ocupar el worker
+                        self.retried += 1
+                        delay = self.retry_backoff * 2 ** attempt
+                        asyncio.get_running_loop().call_later(
+                            delay, self._put, (order_id, estado, comentarios, attempt + 1))
+                    else:
+                        self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 2.0) -> None:
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                pass  # lo pendiente se pierde al apagar
+            for t in self._tasks:
+                t.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = []
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "routes": {
+                base: {
+                    "path": r.path,
+                    "id_key": r.id_key,
+                    "supported": r.path is not None,
+                    "expires_in": round(r.expires_at - now, 1),
+                }
+                for base, r in self._routes.items()
+            },
+            "discoveries": self.discoveries,
+            "discovery_calls": self.discovery_calls,
+            "rediscoveries": self.rediscoveries,
+            "written": self.written,
+            "skipped_unsupported": self.skipped_unsupported,
+            "queue": {"size": self._queue.qsize(), "max": self._queue.maxsize, "workers": len(self._tasks)},
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "retried": self.retried,
+            "failed": self.failed,
+            "last_error": self.last_error,
+        }
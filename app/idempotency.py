@@ -0,0 +1,267 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+
+class IdempotencyConflict(Exception):
+    """La misma Idempotency-Key llegó con un body distinto."""
+
+
+class IdempotencyPending(Exception):
+    """Otro worker sigue procesando la key y no terminó dentro de `wait_timeout`."""
+
+
+class IdempotencyStore:
+    """
+    Resultados por Idempotency-Key (bytes ya serializados), en memoria del proceso.
+    - TTL por entrada y cota por cantidad (`max_entries`) y tamaño (`max_bytes`), con expulsión LRU.
+    - Si llega una key que está en vuelo, se espera el resultado de la primera en vez de
+      repetir el trabajo. Los errores no se guardan (se comparten con quien esperaba y la
+      key queda libre para reintentar).
+    - Cada key guarda la huella del body: reutilizarla con otro body lanza IdempotencyConflict.
+    """
+
+    backend = "memory"
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int, wait_timeout: float = 10.0):
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self.wait_timeout = float(wait_timeout)
+        # key -> (fingerprint, body, expires_at)
+        self._data: "OrderedDict[str, tuple[str, bytes, float]]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: dict[str, tuple[str, asyncio.Future]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.conflicts = 0
+        self.evictions = 0
+
+    async def run(self, key: str, fingerprint: str, fn: Callable[[], Awaitable[bytes]]) -> tuple[bytes, bool]:
+        """Devuelve (body, replayed). `fn` solo se ejecuta si la key no tiene resultado ni está en vuelo."""
+        while True:
+            hit = await self._get(key)
+            if hit is not None:
+                return self._replay(hit, fingerprint), True
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            if inflight[0] != fingerprint:
+                self.conflicts += 1
+                raise IdempotencyConflict(key)
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight[1]), True
+            except asyncio.CancelledError:
+                if not inflight[1].cancelled():
+                    raise  # cancelaron a este request
+                # el request que la procesaba se canceló (cliente desconectado): reintentar
+
+        self.misses += 1
+        fut = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(_consume)
+        self._inflight[key] = (fingerprint, fut)
+        try:
+            if not await self._claim(key, fingerprint):
+                body = self._replay(await self._wait_other(key), fingerprint)
+                fut.set_result(body)
+                return body, True
+            try:
+                body = await fn()
+            except BaseException:
+                await self._release(key)
+                raise
+            await self._set(key, fingerprint, body)
+            fut.set_result(body)
+            return body, False
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            if not fut.done():
+                fut.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def _replay(self, hit: tuple[str, bytes], fingerprint: str) -> bytes:
+        stored_fp, body = hit
+        if stored_fp != fingerprint:
+            self.conflicts += 1
+            raise IdempotencyConflict()  # misma key, otro body
+        self.hits += 1
+        return body
+
+    # --- almacenamiento (memoria); SQLiteIdempotencyStore lo reemplaza ---
+    async def _get(self, key: str) -> Optional[tuple[str, bytes]]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[2]:
+            self._drop(key)
+            return None
+        self._data.move_to_end(key)
+        return entry[0], entry[1]
+
+    async def _set(self, key: str, fingerprint: str, body: bytes) -> None:
+        if key in self._data:
+            self._drop(key)
+        self._data[key] = (fingerprint, body, time.monotonic() + self.ttl)
+        self._bytes += _size(key, fingerprint, body)
+        while len(self._data) > self.max_entries or (self._bytes > self.max_bytes and len(self._data) > 1):
+            self._drop(next(iter(self._data)))
+            self.evictions += 1
+
+    async def _claim(self, key: str, fingerprint: str) -> bool:
+        return True  # en memoria basta con `_inflight`
+
+    async def _release(self, key: str) -> None:
+        pass
+
+    async def _wait_other(self, key: str) -> tuple[str, bytes]:
+        raise IdempotencyPending(key)
+
+    def _drop(self, key: str) -> None:
+        fingerprint, body, _ = self._data.pop(key)
+        self._bytes -= _size(key, fingerprint, body)
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "in_flight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "conflicts": self.conflicts,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteIdempotencyStore(IdempotencyStore):
+    """
+    Misma semántica, persistida en un archivo SQLite compartido por los workers del nodo.
+    Una key en vuelo en otro worker se marca `pending` (con vencimiento `wait_timeout`, por si
+    ese worker muere) y aquí se espera sondeando hasta que termine.
+    """
+
+    backend = "sqlite"
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path: str, ttl: float, max_entries: int, max_bytes: int, wait_timeout: float = 10.0):
+        super().__init__(ttl, max_entries, max_bytes, wait_timeout)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency ("
+            " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, status TEXT NOT NULL,"
+            " body BLOB, size INTEGER NOT NULL DEFAULT 0, expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idempotency_lru ON idempotency (last_used)")
+
+    def _sql(self, fn):
+        with self._lock:
+            return fn(self._db)
+
+    async def _get(self, key: str) -> Optional[tuple[str, bytes]]:
+        def q(db):
+            now = time.time()
+            row = db.execute(
+                "SELECT fingerprint, body FROM idempotency WHERE key = ? AND status = 'done' AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is not None:
+                db.execute("UPDATE idempotency SET last_used = ? WHERE key = ?", (now, key))
+            return row
+        return await asyncio.to_thread(self._sql, q)
+
+    async def _claim(self, key: str, fingerprint: str) -> bool:
+        def q(db):
+            now = time.time()
+            db.execute("DELETE FROM idempotency WHERE key = ? AND expires_at <= ?", (key, now))
+            cur = db.execute(
+                "INSERT OR IGNORE INTO idempotency (key, fingerprint, status, expires_at, last_used)"
+                " VALUES (?, ?, 'pending', ?, ?)",
+                (key, fingerprint, now + self.wait_timeout, now),
+            )
+            return cur.rowcount == 1
+        return await asyncio.to_thread(self._sql, q)
+
+    async def _wait_other(self, key: str) -> tuple[str, bytes]:
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            row = await asyncio.to_thread(self._sql, lambda db: db.execute(
+                "SELECT fingerprint, status, body FROM idempotency WHERE key = ?", (key,)).fetchone())
+            if row is None:
+                break  # el otro worker falló y liberó la key
+            if row[1] == "done":
+                self.coalesced += 1
+                return row[0], row[2]
+            await asyncio.sleep(self.POLL_INTERVAL)
+        raise IdempotencyPending(key)
+
+    async def _release(self, key: str) -> None:
+        await asyncio.to_thread(self._sql, lambda db: db.execute(
+            "DELETE FROM idempotency WHERE key = ? AND status = 'pending'", (key,)))
+
+    async def _set(self, key: str, fingerprint: str, body: bytes) -> None:
+        def q(db):
+            now = time.time()
+            db.execute(
+                "INSERT OR REPLACE INTO idempotency (key, fingerprint, status, body, size, expires_at, last_used)"
+                " VALUES (?, ?, 'done', ?, ?, ?, ?)",
+                (key, fingerprint, body, _size(key, fingerprint, body), now + self.ttl, now),
+            )
+            db.execute("DELETE FROM idempotency WHERE expires_at <= ?", (now,))
+            count, total = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM idempotency WHERE status = 'done'").fetchone()
+            if count <= self.max_entries and total <= self.max_bytes:
+                return 0
+            evicted = 0
+            for old_key, size in db.execute(
+                    "SELECT key, size FROM idempotency WHERE status = 'done' AND key != ? ORDER BY last_used",
+                    (key,)).fetchall():
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM idempotency WHERE key = ?", (old_key,))
+                count, total, evicted = count - 1, total - size, evicted + 1
+            return evicted
+        self.evictions += await asyncio.to_thread(self._sql, q)
+
+    def close(self) -> None:
+        self._sql(lambda db: db.close())
+
+    def stats(self) -> dict:
+        count, total = self._sql(lambda db: db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM idempotency WHERE status = 'done'").fetchone())
+        return {**super().stats(), "entries": count, "bytes": total, "path": self.path}
+
+
+def _size(key: str, fingerprint: str, body: bytes) -> int:
+    return len(key) + len(fingerprint) + len(body)
+
+
+def _consume(fut: asyncio.Future) -> None:
+    # nadie más esperaba: evitar "exception was never retrieved"
+    if not fut.cancelled():
+        fut.exception()
+
+
+def build_store(sqlite_path: str, ttl: float, max_entries: int, max_bytes: int,
+                wait_timeout: float) -> IdempotencyStore:
+    if sqlite_path:
+        return SQLiteIdempotencyStore(sqlite_path, ttl, max_entries, max_bytes, wait_timeout)
+    return IdempotencyStore(ttl, max_entries, max_bytes, wait_timeout)
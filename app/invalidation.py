@@ -0,0 +1,94 @@
+"""
+Invalidaciones compartidas entre los workers del nodo (multi-worker).
+
+El worker que recibe el webhook agrega una línea JSON a un archivo de solo-append
+(`{"ids": [...]}` o `{"all": true}`); cada worker lee lo nuevo desde su offset, como mucho
+cada `check_interval` segundos, y lo aplica a sus caches locales. Al superar `max_bytes`
+el archivo se rota (`os.replace` por uno vacío): quien note el cambio de inodo invalida todo.
+"""
+import json
+import os
+import time
+from typing import Callable, Optional
+
+
+class InvalidationLog:
+    def __init__(self, path: str, apply: Callable[[Optional[list[int]]], None],
+                 check_interval: float = 0.5, max_bytes: int = 1024 * 1024):
+        self.path = path
+        self._apply = apply
+        self.check_interval = check_interval
+        self.max_bytes = max_bytes
+        self._checked_at = 0.0
+        self._inode: Optional[int] = None
+        self._offset = 0
+        try:
+            st = os.stat(path)
+            self._inode, self._offset = st.st_ino, st.st_size  # lo anterior al arranque no aplica
+        except FileNotFoundError:
+            pass
+        self.published = 0
+        self.applied = 0
+        self.resets = 0
+        self.last_error: Optional[str] = None
+
+    def publish(self, ids: Optional[list[int]]) -> None:
+        """Difunde la invalidación de `ids` (None = todos) al resto de workers."""
+        line = json.dumps({"all": True} if ids is None else {"ids": ids}) + "\n"
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())  # una sola escritura O_APPEND: no se intercala con otros workers
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        self.published += 1
+        if size > self.max_bytes:
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            open(tmp, "wb").close()
+            os.replace(tmp, self.path)
+
+    def poll(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            self._read_new()
+        except Exception as e:
+            self.last_error = repr(e)
+
+    def _read_new(self) -> None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if self._inode is not None and (st.st_ino != self._inode or st.st_size < self._offset):
+            # rotado o truncado: pudimos perder eventos
+            self._offset = 0
+            self.resets += 1
+            self._apply(None)
+        self._inode = st.st_ino
+        if st.st_size <= self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+        complete = data[:data.rfind(b"\n") + 1]  # una línea a medio escribir se lee en el próximo ciclo
+        self._offset += len(complete)
+        for line in complete.splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            self._apply(None if event.get("all") else [int(i) for i in event.get("ids") or ()])
+            self.applied += 1
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "offset": self._offset,
+            "published": self.published,
+            "applied": self.applied,
+            "resets": self.resets,
+            "last_error": self.last_error,
+        }
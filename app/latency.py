@@ -0,0 +1,28 @@
+from collections import deque
+from typing import Optional
+
+
+class LatencyWindow:
+    """Últimas `size` latencias (s) con percentiles aproximados (se recalculan cada `every` muestras)."""
+
+    def __init__(self, size: int = 200, every: int = 20):
+        self._samples: deque[float] = deque(maxlen=max(1, size))
+        self._every = max(1, every)
+        self._since_sort = 0
+        self._sorted: list[float] = []
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._since_sort += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        if self._since_sort >= self._every or len(self._sorted) != len(self._samples):
+            self._sorted = sorted(self._samples)
+            self._since_sort = 0
+        idx = min(len(self._sorted) - 1, max(0, int(round(q * (len(self._sorted) - 1)))))
+        return self._sorted[idx]
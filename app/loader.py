@@ -0,0 +1,147 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from app import deadline, timing
+from app.codec import response_json
+from app.upstream import Upstream
+
+
+class ProductBatchLoader:
+    """
+    Micro-batching estilo DataLoader para productos de MS2.
+    Junta los ids pedidos por todos los handlers concurrentes durante `window` segundos
+    (o hasta `max_batch` ids) y los resuelve con una sola llamada bulk
+    `GET {path}?{param}=1,2,3`; luego reparte cada resultado a su llamador.
+    - Si MS2 no soporta el filtro (status != 200 o devuelve ids no pedidos), se detecta
+      una vez y desde entonces se usa `fallback(id)` (fetch por id).
+    - Un id ausente en la respuesta bulk se confirma con `fallback(id)`: solo ese 404 cuenta
+      como inexistente (None) y se cachea como negativo.
+    """
+
+    def __init__(self, upstream: Upstream, path: str, param: str, window: float, max_batch: int,
+                 parse: Callable[[Any], dict], fallback: Callable[[int], Awaitable[Optional[dict]]]):
+        self.upstream = upstream
+        self.path = path
+        self.param = param
+        self.window = max(0.0, float(window))
+        self.max_batch = max(1, int(max_batch))
+        self._parse = parse
+        self._fallback = fallback
+        self._pending: dict[int, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+        self.bulk_supported: Optional[bool] = None  # None = aún no detectado
+        self.batches = 0
+        self.ids_requested = 0
+        self.bulk_calls = 0
+        self.fallback_calls = 0
+        self.largest_batch = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def load(self, prod_id: int) -> Optional[dict]:
+        fut = self._pending.get(prod_id)
+        if fut is None:
+            loop = asyncio.get_running_loop()
+            fut = loop.create_future()
+            self._pending[prod_id] = fut
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+        t0 = time.perf_counter()
+        try:
+            # shield: si un llamador se cancela no se cancela el resultado para los demás
+            return await asyncio.shield(fut)
+        finally:
+            timing.record(self.upstream.name, time.perf_counter() - t0)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        # el lote mezcla ids de varios requests: no hereda el deadline ni los tiempos de quien lo disparó
+        task = asyncio.get_running_loop().create_task(
+            self._dispatch(batch), context=timing.detached(deadline.detached()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: dict[int, asyncio.Future]) -> None:
+        ids = list(batch)
+        self.batches += 1
+        self.ids_requested += len(ids)
+        self.largest_batch = max(self.largest_batch, len(ids))
+        try:
+            found = await self._bulk(ids) if self.bulk_supported is not False else None
+            if found is not None:
+                for pid, fut in batch.items():
+                    if pid in found and not fut.done():
+                        fut.set_result(found[pid])
+                # ausente en el bulk no prueba que no exista (p.ej. MS2 pagina o filtra): se confirma por id
+                ids = [pid for pid in ids if pid not in found]
+            if not ids:
+                return
+            self.fallback_calls += len(ids)
+            results = await asyncio.gather(*(self._fallback(pid) for pid in ids), return_exceptions=True)
+            for pid, res in zip(ids, results):
+                fut = batch[pid]
+                if fut.done():
+                    continue
+                if isinstance(res, BaseException):
+                    fut.set_exception(res)
+                else:
+                    fut.set_result(res)
+        except Exception as e:
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(e)
+        finally:
+            # p.ej. cancelación al apagar: no dejar llamadores colgados
+            for fut in batch.values():
+                if not fut.done():
+                    fut.cancel()
+
+    async def _bulk(self, ids: list[int]) -> Optional[dict]:
+        """Llamada bulk; None si hay que resolver este lote por id."""
+        self.bulk_calls += 1
+        try:
+            r = await self.upstream.get(self.path, params={self.param: ",".join(map(str, ids))})
+        except Exception:
+            return None  # error de red: este lote va por id, sin concluir nada sobre el soporte
+        if r.status_code >= 500:
+            return None
+        if r.status_code != 200:
+            self.bulk_supported = False
+            return None
+        try:
+            found = self._parse(response_json(r))
+        except Exception:
+            self.bulk_supported = False
+            return None
+        wanted = set(ids)
+        if any(pid not in wanted for pid in found):
+            # MS2 ignoró el filtro y devolvió el listado completo: no hay bulk lookup
+            self.bulk_supported = False
+            return None
+        self.bulk_supported = True
+        return found
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "window_ms": round(self.window * 1000, 3),
+            "max_batch": self.max_batch,
+            "bulk_supported": self.bulk_supported,
+            "batches": self.batches,
+            "ids_requested": self.ids_requested,
+            "bulk_calls": self.bulk_calls,
+            "fallback_calls": self.fallback_calls,
+            "largest_batch": self.largest_batch,
+            "avg_batch": round(self.ids_requested / self.batches, 2) if self.batches else None,
+        }
@@ -1,10 +1,56 @@
 from fastapi import FastAPI, HTTPException
-import httpx, os, asyncio, time
+from fastapi.responses import JSONResponse, Response
+import httpx, os, asyncio, time, hashlib, base64, threading
 from pydantic import BaseModel, Field
-from typing import List, Optional, Any
+from typing import List, NamedTuple, Optional, Any
 from fastapi.middleware.cors import CORSMiddleware
 import os
 from app.schemas import CreateOrderReq
+from app.adapters import SchemaAdapter
+from app.cache import TTLCache
+from app.codec import FastJSONResponse, dumps, loads, response_json
+from app.conditional import Revalidator, etag_matches, strong_etag
+from app.categories import CategoryIndex
+from app.upstream import Upstream, UpstreamError
+from app.pool import PoolConfig
+from app.breaker import CircuitBreaker, CircuitOpenError
+from app.metrics import REGISTRY, MetricsMiddleware
+from app.idempotency import IdempotencyConflict, IdempotencyPending, build_store
+from app.history import HistoryWriter
+from app.invalidation import InvalidationLog
+from app import deadline, timing
+from app.admission import AdmissionController, AdmissionMiddleware, parse_route_limits
+from app.loader import ProductBatchLoader
+from app.probe import DependencyProbe, DependencyProber
+from app.profiler import ProfilerBusy, SamplingProfiler
+from app.snapshot import CatalogReplica, CatalogSnapshot, SnapshotPublisher
+from app.stages import Stages
+from app.settings import (
+    PRODUCT_CACHE_TTL, PRODUCT_CACHE_STALE_TTL, PRODUCT_CACHE_NEGATIVE_TTL, PRODUCT_CACHE_MAX_ENTRIES,
+    CATEGORY_REFRESH_INTERVAL, ADMIN_TOKEN,
+    MS1_MAX_CONCURRENCY, MS2_MAX_CONCURRENCY, MS3_MAX_CONCURRENCY, UPSTREAM_COALESCE,
+    PRODUCT_BATCH_WINDOW_MS, PRODUCT_BATCH_MAX_IDS, PRODUCT_BULK_PATH, PRODUCT_BULK_PARAM,
+    BATCH_QUOTE_CONCURRENCY, MS1_POOL, MS2_POOL, MS3_POOL,
+    UPSTREAM_BREAKER_ENABLED, UPSTREAM_BREAKER_WINDOW, UPSTREAM_BREAKER_MIN_CALLS, UPSTREAM_BREAKER_ERROR_RATE,
+    UPSTREAM_BREAKER_SLOW_CALL_MS, UPSTREAM_BREAKER_SLOW_RATE, UPSTREAM_BREAKER_OPEN_SECONDS,
+    UPSTREAM_BREAKER_HALF_OPEN_CALLS, UPSTREAM_HEDGE, UPSTREAM_HEDGE_QUANTILE, UPSTREAM_HEDGE_MIN_DELAY_MS,
+    IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_MAX_BYTES, IDEMPOTENCY_SQLITE_PATH,
+    IDEMPOTENCY_WAIT_TIMEOUT, CATALOG_SNAPSHOT_PATH, CATALOG_SNAPSHOT_INTERVAL, CATALOG_SNAPSHOT_MAX_AGE,
+    CATALOG_PRODUCTS_PATH, USER_CACHE_TTL, USER_CACHE_NEGATIVE_TTL, USER_CACHE_MAX_ENTRIES, MS1_WEBHOOK_TOKEN,
+    USER_INVALIDATION_PATH, CATALOG_REPLICA, CATALOG_REPLICA_INTERVAL, CATALOG_REPLICA_MAX_AGE,
+    CATALOG_REPLICA_DELTA_PARAM, CATALOG_REPLICA_FULL_INTERVAL, USER_ORDERS_PATH, USER_ORDERS_USER_PARAM,
+    USER_ORDERS_PAGE_PARAM, USER_ORDERS_SIZE_PARAM, USER_ORDERS_PAGE_SIZE, USER_ORDERS_MAX_LIMIT, USER_ORDERS_MAX_PAGES,
+    HISTORY_ROUTE_TTL, HISTORY_UNSUPPORTED_TTL, HISTORY_QUEUE_SIZE, HISTORY_WORKERS, HISTORY_RETRIES,
+    HISTORY_RETRY_BACKOFF, HEALTH_PROBE_MS1_INTERVAL, HEALTH_PROBE_MS2_INTERVAL, HEALTH_PROBE_MS3_INTERVAL,
+    HEALTH_PROBE_MS1_TIMEOUT, HEALTH_PROBE_MS2_TIMEOUT, HEALTH_PROBE_MS3_TIMEOUT, HEALTH_PROBE_WINDOW,
+    HEALTH_PROBE_STALE_AFTER, HEALTH_PROBE_METHOD, HEALTH_PROBE_MS1_PATH, HEALTH_PROBE_MS2_PATH,
+    HEALTH_PROBE_MS3_PATH, REQUEST_DEADLINE, REQUEST_DEADLINE_HEADER, UPSTREAM_DEADLINE_HEADER,
+    CONDITIONAL_GET, CONDITIONAL_MAX_ENTRIES, SERVER_TIMING, TIMING_LOG_SAMPLE_RATE, TIMING_LOG_SLOW_MS,
+    PROFILE_MAX_SECONDS, PROFILE_INTERVAL_MS, ADMISSION_CONTROL, ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_ROUTE_LIMITS, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT_MS, ADMISSION_RETRY_AFTER,
+    ADMISSION_ADAPTIVE, ADMISSION_TARGET_LATENCY_MS, ADMISSION_MIN_CONCURRENCY, ADMISSION_ADJUST_INTERVAL,
+    ADMISSION_DECREASE_FACTOR,
+)
 
 
 # ---------- Config ----------
@@ -16,6 +62,50 @@ REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "5.0"))
 TAX_RATE = float(os.getenv("TAX_RATE", "0.18"))
 _CORS_ENV = os.getenv("CORS_ALLOWED_ORIGINS", "*").strip()
 
+# Cada microservicio con su propio pool de conexiones, límite de llamadas concurrentes,
+# circuit breaker y (opcional) hedging de GETs
+def _upstream(name: str, base_url: str, max_concurrency: int, pool: dict) -> Upstream:
+    breaker = CircuitBreaker(
+        name,
+        window=UPSTREAM_BREAKER_WINDOW,
+        min_calls=UPSTREAM_BREAKER_MIN_CALLS,
+        error_rate=UPSTREAM_BREAKER_ERROR_RATE,
+        slow_call=UPSTREAM_BREAKER_SLOW_CALL_MS / 1000.0,
+        slow_rate=UPSTREAM_BREAKER_SLOW_RATE,
+        open_seconds=UPSTREAM_BREAKER_OPEN_SECONDS,
+        half_open_calls=UPSTREAM_BREAKER_HALF_OPEN_CALLS,
+    ) if UPSTREAM_BREAKER_ENABLED else None
+    return Upstream(
+        name, base_url, max_concurrency,
+        coalesce=UPSTREAM_COALESCE,
+        pool=PoolConfig(**pool),
+        breaker=breaker,
+        hedge_quantile=UPSTREAM_HEDGE_QUANTILE if UPSTREAM_HEDGE else None,
+        deadline_header=UPSTREAM_DEADLINE_HEADER or None,
+        hedge_min_delay=UPSTREAM_HEDGE_MIN_DELAY_MS / 1000.0,
+    )
+
+ms1 = _upstream("ms1_usuarios", MS1, MS1_MAX_CONCURRENCY, MS1_POOL)
+ms2 = _upstream("ms2_productos", MS2, MS2_MAX_CONCURRENCY, MS2_POOL)
+ms3 = _upstream("ms3_pedidos", MS3, MS3_MAX_CONCURRENCY, MS3_POOL)
+UPSTREAMS = (ms1, ms2, ms3)
+
+# GET condicional por recurso: un 304 reutiliza lo ya parseado (ver app/conditional.py)
+ms1_validators, ms2_validators, ms3_validators = REVALIDATORS = tuple(
+    Revalidator(up, CONDITIONAL_MAX_ENTRIES, enabled=CONDITIONAL_GET) for up in UPSTREAMS
+)
+
+def _probe(upstream: Upstream, path: str, interval: float, timeout: float) -> DependencyProbe:
+    return DependencyProbe(upstream, path, method=HEALTH_PROBE_METHOD, interval=interval, timeout=timeout,
+                           window=HEALTH_PROBE_WINDOW, stale_after=HEALTH_PROBE_STALE_AFTER)
+
+# /health?deep=1 lee este estado; las peticiones de sondeo salen en background (una tarea por MS)
+dependency_prober = DependencyProber({
+    "ms1_usuarios": _probe(ms1, HEALTH_PROBE_MS1_PATH, HEALTH_PROBE_MS1_INTERVAL, HEALTH_PROBE_MS1_TIMEOUT),
+    "ms2_productos": _probe(ms2, HEALTH_PROBE_MS2_PATH, HEALTH_PROBE_MS2_INTERVAL, HEALTH_PROBE_MS2_TIMEOUT),
+    "ms3_pedidos": _probe(ms3, HEALTH_PROBE_MS3_PATH, HEALTH_PROBE_MS3_INTERVAL, HEALTH_PROBE_MS3_TIMEOUT),
+})
+
 def _parse_cors(env_val: str):
     if not env_val or env_val == "*":
         return {"allow_origins": ["*"]}
@@ -35,6 +125,28 @@ app = FastAPI(
     openapi_url="/openapi.json"
 )
 
+def _upstream_p95() -> Optional[float]:
+    return max((up.latency.percentile(0.95) for up in UPSTREAMS if len(up.latency)), default=None)
+
+# Admisión por ruta en /orq/*: dentro de CORS (el 503 también lleva los headers CORS);
+# /health, /metrics y /admin no pasan por aquí
+admission = AdmissionController(
+    app.router,
+    limit=ADMISSION_MAX_CONCURRENCY,
+    queue_size=ADMISSION_QUEUE_SIZE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT_MS / 1000.0,
+    retry_after=ADMISSION_RETRY_AFTER,
+    route_limits=parse_route_limits(ADMISSION_ROUTE_LIMITS),
+    adaptive=ADMISSION_ADAPTIVE,
+    min_limit=ADMISSION_MIN_CONCURRENCY,
+    signal=_upstream_p95,
+    target=ADMISSION_TARGET_LATENCY_MS / 1000.0,
+    adjust_interval=ADMISSION_ADJUST_INTERVAL,
+    decrease=ADMISSION_DECREASE_FACTOR,
+)
+if ADMISSION_CONTROL:
+    app.add_middleware(AdmissionMiddleware, controller=admission)
+
 _cors_kwargs = _parse_cors(_CORS_ENV)
 app.add_middleware(
     CORSMiddleware,
@@ -42,21 +154,86 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Location"]
+    expose_headers=["Location", "Retry-After"]
+)
+app.add_middleware(MetricsMiddleware)
+if SERVER_TIMING or TIMING_LOG_SAMPLE_RATE > 0 or TIMING_LOG_SLOW_MS > 0:
+    app.add_middleware(timing.TimingMiddleware, header=SERVER_TIMING, sample_rate=TIMING_LOG_SAMPLE_RATE,
+                       slow_ms=TIMING_LOG_SLOW_MS)
+
+# Cache compartida de productos de MS2 (id -> payload | None si 404)
+product_cache = TTLCache(
+    "ms2_productos",
+    max_entries=PRODUCT_CACHE_MAX_ENTRIES,
+    ttl=PRODUCT_CACHE_TTL,
+    stale_ttl=PRODUCT_CACHE_STALE_TTL,
+    negative_ttl=PRODUCT_CACHE_NEGATIVE_TTL,
 )
 
-client: Optional[httpx.AsyncClient] = None
+# Caches de MS1 para validar usuario/dirección (id_usuario -> valor | None si 404)
+user_cache = TTLCache(
+    "ms1_usuarios",
+    max_entries=USER_CACHE_MAX_ENTRIES,
+    ttl=USER_CACHE_TTL,
+    negative_ttl=USER_CACHE_NEGATIVE_TTL,
+)
+address_cache = TTLCache(
+    "ms1_direcciones",
+    max_entries=USER_CACHE_MAX_ENTRIES,
+    ttl=USER_CACHE_TTL,
+    negative_ttl=USER_CACHE_NEGATIVE_TTL,
+)
+
+@app.exception_handler(CircuitOpenError)
+async def _circuit_open_handler(request, exc: CircuitOpenError):
+    # MS degradado: fallar rápido en vez de esperar REQUEST_TIMEOUT por cada llamada
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Servicio {exc.name} no disponible temporalmente"},
+        headers={"Retry-After": str(max(1, int(exc.retry_after + 0.999)))},
+    )
+
+@app.exception_handler(deadline.DeadlineExceeded)
+async def _deadline_handler(request, exc: deadline.DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": "Tiempo del request agotado consultando microservicios"})
 
 @app.on_event("startup")
 async def _startup():
-    global client
-    client = httpx.AsyncClient(timeout=httpx.Timeout(REQUEST_TIMEOUT))
+    for up in UPSTREAMS:
+        up.open()
+    history_writer.start()
+    dependency_prober.start()
+    # carga inicial de categorías (si MS2 no responde, el refresco en background reintenta)
+    try:
+        await category_index.refresh()
+    except Exception:
+        pass
+    if catalog_replica is not None:
+        # carga completa antes de aceptar tráfico; si falla, se sigue por cache/MS2 hasta el próximo ciclo
+        try:
+            await catalog_replica.refresh()
+        except Exception:
+            pass
+        catalog_replica.start()
+    if snapshot_publisher is None:
+        category_index.start()
+    else:
+        # multi-worker: solo el líder refresca categorías/catálogo; el resto lee el snapshot
+        catalog_snapshot.reload()
+        snapshot_publisher.start()
 
 @app.on_event("shutdown")
 async def _shutdown():
-    global client
-    if client:
-        await client.aclose()
+    await dependency_prober.stop()
+    await history_writer.stop()
+    if snapshot_publisher is not None:
+        await snapshot_publisher.stop()
+    if catalog_replica is not None:
+        await catalog_replica.stop()
+    await category_index.stop()
+    for up in UPSTREAMS:
+        await up.aclose()
+    idempotency_store.close()
 
 def now_iso() -> str:
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
@@ -96,81 +273,280 @@ def normalize_list(maybe_list_or_wrapper):
                 return val
     return []
 
+# ---------- Esquemas de MS1/MS2/MS3 ----------
+# Cada campo admite varios alias; el adaptador aprende cuál usa cada MS con las primeras
+# respuestas y desde ahí lee con un solo dict.get (si el esquema cambia, lo re-detecta).
+PRODUCT = SchemaAdapter(
+    "ms2_producto",
+    id=("id_producto", "producto_id", "product_id", "id"),
+    nombre=("nombre", "name"),
+    precio=("precio", "price", "valor"),
+    categoria_id=("categoria_id", "id_categoria", "category_id", "categoriaId",
+                  ("categoria", "id"), ("categoria", "id_categoria"), ("categoria", "categoria_id"),
+                  ("category", "id"), ("category", "id_categoria"), ("category", "categoria_id")),
+)
+CATEGORY = SchemaAdapter(
+    "ms2_categoria",
+    id=("id_categoria", "categoria_id", "id", "category_id"),
+    nombre=("nombre_categoria", "categoria_nombre", "nombre", "name"),
+)
+ADDRESS = SchemaAdapter("ms1_direccion", id=("id_direccion", "direccion_id", "id"))
+USER = SchemaAdapter(
+    "ms1_usuario",
+    nombre=("nombre", "name"),
+    correo=("correo", "email"),
+    telefono=("telefono", "phone"),
+)
+ORDER = SchemaAdapter(
+    "ms3_pedido",
+    id=("_id", "id", "id_pedido", "orderId"),
+    id_usuario=("id_usuario", "usuario_id", "user_id"),
+    fecha=("fecha_pedido", "fecha", "createdAt"),
+    total=("total", "monto_total", "total_pedido"),
+    items=("productos", "items"),
+    estado=("estado", "status"),
+)
+ORDER_LINE = SchemaAdapter(
+    "ms3_linea",
+    id_producto=("id_producto", "producto_id", "product_id"),
+    cantidad=("cantidad", "qty", "quantity"),
+    precio_unitario=("precio_unitario", "precio", "unit_price"),
+)
+SCHEMAS = (PRODUCT, CATEGORY, ADDRESS, USER, ORDER, ORDER_LINE)
+
 def address_list_contains(addresses, id_direccion: int) -> bool:
-    """
-    Acepta varios esquemas:
-    - id_direccion
-    - direccion_id
-    - id
-    - o strings numéricos
-    """
-    for a in addresses:
-        addr_id = pick(a, "id_direccion", "direccion_id", "id")
-        try:
-            if int(addr_id) == int(id_direccion):
-                return True
-        except Exception:
-            continue
-    return False
+    """Acepta id_direccion / direccion_id / id, también como strings numéricos."""
+    id_direccion = int(id_direccion)
+    return any(ADDRESS.id.as_int(a) == id_direccion for a in addresses if isinstance(a, dict))
 
 def extract_category_id(product: dict) -> Optional[int]:
-    """
-    Admite varios esquemas posibles:
-    - categoria_id
-    - id_categoria
-    - category_id / categoriaId
-    - categoria: { id: ... }
-    """
-    cid = pick(product, "categoria_id", "id_categoria", "category_id", "categoriaId")
-    if cid is not None:
-        try:
-            return int(cid)
-        except Exception:
-            pass
-    # anidado
-    cat_obj = pick(product, "categoria", "category")
-    if isinstance(cat_obj, dict):
-        nested_id = pick(cat_obj, "id", "id_categoria", "categoria_id")
-        try:
-            return int(nested_id)
-        except Exception:
-            return None
-    return None
+    """categoria_id / id_categoria / category_id / categoriaId o anidado (categoria: {id: ...})."""
+    return PRODUCT.categoria_id.as_int(product)
 
 def extract_category_name(category: dict) -> Optional[str]:
-    return pick(category, "nombre_categoria", "categoria_nombre", "nombre", "name")
+    return CATEGORY.nombre(category)
+
+# ---------- Categorías de MS2 (mapa refrescado en background) ----------
+def build_category_map(cats) -> dict[int, Optional[str]]:
+    """Construye id_categoria -> nombre admitiendo distintos esquemas de MS2."""
+    cat_map = {}
+    if not isinstance(cats, list):
+        return cat_map
+    for c in cats:
+        if not isinstance(c, dict):
+            continue
+        cat_id = CATEGORY.id.as_int(c)
+        if cat_id is None:
+            continue
+        cat_map[cat_id] = extract_category_name(c)
+    return cat_map
+
+category_index = CategoryIndex(ms2, "/categorias", CATEGORY_REFRESH_INTERVAL, parse=build_category_map)
+
+# ---------- Productos de MS2 (con cache) ----------
+async def _load_product(prod_id: int) -> Optional[dict]:
+    status, payload, _ = await ms2_validators.get(f"/productos/{prod_id}", response_json)
+    if status == 200:
+        return payload if isinstance(payload, dict) else None
+    if status == 404:
+        return None  # se cachea como negativo
+    raise UpstreamError(status)  # 5xx y similares no se cachean
+
+def build_product_map(payload) -> dict[int, dict]:
+    """Respuesta de listado/bulk de MS2 -> {id_producto: producto}."""
+    by_id = {}
+    items = payload if isinstance(payload, list) else normalize_list(payload)
+    for p in items:
+        if not isinstance(p, dict):
+            continue
+        pid = PRODUCT.id.as_int(p)
+        if pid is not None:
+            by_id[pid] = p
+    return by_id
+
+# Los misses de la cache se agrupan en lotes hacia el endpoint bulk de MS2 (si lo soporta)
+product_loader = ProductBatchLoader(
+    ms2, PRODUCT_BULK_PATH, PRODUCT_BULK_PARAM,
+    window=PRODUCT_BATCH_WINDOW_MS / 1000.0,
+    max_batch=PRODUCT_BATCH_MAX_IDS,
+    parse=build_product_map,
+    fallback=_load_product,
+)
+
+async def get_product(prod_id: int) -> Optional[dict]:
+    """Producto de MS2 vía snapshot/réplica del catálogo o cache; None si no existe o MS2 no respondió 200."""
+    catalog = catalog_snapshot or catalog_replica
+    if catalog is not None:
+        prod = catalog.get(prod_id)
+        if prod is not None:
+            return prod
+    loader = product_loader.load if product_loader.enabled else _load_product
+    try:
+        return await product_cache.get_or_load(prod_id, loader)
+    except UpstreamError:
+        return None
+
+async def fetch_products(prod_ids) -> dict[int, Optional[dict]]:
+    """Trae en paralelo los productos pedidos; ids repetidos se consultan una sola vez."""
+    unique_ids = list(dict.fromkeys(prod_ids))
+    found = await asyncio.gather(*(get_product(pid) for pid in unique_ids))
+    return dict(zip(unique_ids, found))
+
+# ---------- Usuarios y direcciones de MS1 (con cache) ----------
+class UserAddresses(NamedTuple):
+    ids: frozenset  # ids de dirección normalizados a int: validar es un lookup en el set
+    count: int      # direcciones que devolvió MS1 (con o sin id reconocible)
+
+def _user_summary(r: httpx.Response) -> dict:
+    uj = response_json(r)
+    if not isinstance(uj, dict):
+        return {}  # existe, pero sin datos que resumir
+    return {"nombre": USER.nombre(uj), "correo": USER.correo(uj), "telefono": USER.telefono(uj)}
+
+def _user_addresses(r: httpx.Response) -> UserAddresses:
+    dir_list = normalize_list(response_json(r))
+    ids = (ADDRESS.id.as_int(a) for a in dir_list if isinstance(a, dict))
+    return UserAddresses(frozenset(i for i in ids if i is not None), len(dir_list))
+
+async def _load_user(id_usuario: int) -> Optional[dict]:
+    status, summary, _ = await ms1_validators.get(f"/usuarios/{id_usuario}", _user_summary)
+    if status == 200:
+        return summary
+    if status == 404:
+        return None  # se cachea como negativo
+    raise UpstreamError(status)
+
+async def _load_addresses(id_usuario: int) -> Optional[UserAddresses]:
+    status, addresses, _ = await ms1_validators.get(f"/direcciones/{id_usuario}", _user_addresses)
+    if status == 200:
+        return addresses
+    if status == 404:
+        return None
+    raise UpstreamError(status)
+
+def invalidate_users(ids: Optional[List[int]]) -> None:
+    """Olvida usuario y direcciones de `ids` (None = todos) en este worker."""
+    if ids is None:
+        user_cache.clear()
+        address_cache.clear()
+        ms1_validators.clear()
+        return
+    for id_usuario in ids:
+        user_cache.invalidate(id_usuario)
+        address_cache.invalidate(id_usuario)
+        # el webhook manda: la próxima lectura baja el body completo aunque MS1 diga 304
+        ms1_validators.invalidate(f"/usuarios/{id_usuario}")
+        ms1_validators.invalidate(f"/direcciones/{id_usuario}")
+
+# Con varios workers, el webhook llega a uno solo: el resto se entera por el log compartido
+user_invalidations = InvalidationLog(USER_INVALIDATION_PATH, invalidate_users) if USER_INVALIDATION_PATH else None
+
+async def get_user(id_usuario: int) -> Optional[dict]:
+    """Resumen del usuario (nombre, correo, telefono) o None si no existe o MS1 no respondió 200."""
+    if user_invalidations is not None:
+        user_invalidations.poll()
+    try:
+        return await user_cache.get_or_load(id_usuario, _load_user)
+    except UpstreamError:
+        return None
+
+async def get_addresses(id_usuario: int) -> Optional[UserAddresses]:
+    """Direcciones del usuario o None si MS1 no las devolvió (404 o error)."""
+    if user_invalidations is not None:
+        user_invalidations.poll()
+    try:
+        return await address_cache.get_or_load(id_usuario, _load_addresses)
+    except UpstreamError:
+        return None
+
+# ---------- Snapshot del catálogo compartido entre workers ----------
+def catalog_rows(payload) -> list[tuple]:
+    """Listado de MS2 -> filas (id, precio, categoria_id, nombre) del snapshot."""
+    return [
+        (pid, to_float(PRODUCT.precio(p, 0.0)), extract_category_id(p), PRODUCT.nombre(p))
+        for pid, p in build_product_map(payload).items()
+    ]
+
+def _on_snapshot_change(mapped) -> None:
+    # los seguidores toman las categorías del snapshot; el líder ya tiene las suyas
+    if not snapshot_publisher.is_leader:
+        category_index.load(mapped.category_map())
+
+catalog_snapshot = snapshot_publisher = None
+if CATALOG_SNAPSHOT_PATH:
+    catalog_snapshot = CatalogSnapshot(CATALOG_SNAPSHOT_PATH, CATALOG_SNAPSHOT_MAX_AGE,
+                                       on_change=_on_snapshot_change)
+    snapshot_publisher = SnapshotPublisher(
+        CATALOG_SNAPSHOT_PATH, ms2, CATALOG_PRODUCTS_PATH, CATALOG_SNAPSHOT_INTERVAL,
+        parse=catalog_rows,
+        categories=lambda: category_index.mapping,
+        meta=lambda: {"keys": PRODUCT.stats()["learned"]},
+        on_leader=category_index.start,
+    )
+
+# Un solo proceso: réplica en memoria con las mismas columnas (CATALOG_REPLICA=1)
+catalog_replica = None
+if CATALOG_REPLICA and catalog_snapshot is None:
+    catalog_replica = CatalogReplica(
+        ms2, CATALOG_PRODUCTS_PATH, CATALOG_REPLICA_INTERVAL, CATALOG_REPLICA_MAX_AGE,
+        parse=catalog_rows,
+        keys=lambda: PRODUCT.stats()["learned"],
+        delta_param=CATALOG_REPLICA_DELTA_PARAM,
+        full_interval=CATALOG_REPLICA_FULL_INTERVAL,
+    )
+
+def catalog_view():
+    """Columnas del catálogo local vigente (snapshot o réplica), o None."""
+    catalog = catalog_snapshot or catalog_replica
+    return catalog.view() if catalog is not None else None
 
 # ---------- Utilidades de idempotencia y validación ----------
-_IDEMP_CACHE: dict[str, dict] = {}
+# Resultados por Idempotency-Key: acotado (TTL + LRU por entradas/bytes) y con dedupe de
+# requests en vuelo; con IDEMPOTENCY_SQLITE_PATH se comparte entre los workers del nodo.
+idempotency_store = build_store(
+    IDEMPOTENCY_SQLITE_PATH,
+    ttl=IDEMPOTENCY_TTL,
+    max_entries=IDEMPOTENCY_MAX_ENTRIES,
+    max_bytes=IDEMPOTENCY_MAX_BYTES,
+    wait_timeout=IDEMPOTENCY_WAIT_TIMEOUT,
+)
+
+async def idempotent(scope: str, key: Optional[str], payload: BaseModel, fn) -> Response:
+    """
+    Ejecuta `fn()` (-> dict) una sola vez por (scope, Idempotency-Key) y reenvía el mismo body
+    a los reintentos. Sin key, solo ejecuta. Reutilizar la key con otro body -> 422.
+    """
+    if not key:
+        return FastJSONResponse(await fn())
+    if len(key) > 255:
+        raise HTTPException(400, "Idempotency-Key demasiado larga (máx. 255)")
+    fingerprint = hashlib.sha256(dumps(payload.model_dump(mode="json"))).hexdigest()
 
-def idem_get(key: Optional[str]):
-    return _IDEMP_CACHE.get(key) if key else None
+    async def run() -> bytes:
+        result = await fn()
+        with timing.stage("serialize"):
+            return dumps(result)
 
-def idem_set(key: Optional[str], value: dict):
-    if key:
-        _IDEMP_CACHE[key] = value
+    try:
+        body, replayed = await idempotency_store.run(f"{scope}:{key}", fingerprint, run)
+    except IdempotencyConflict:
+        raise HTTPException(422, "Idempotency-Key ya usada con un body distinto")
+    except IdempotencyPending:
+        raise HTTPException(409, "Hay un request en curso con esta Idempotency-Key; reintenta")
+    headers = {"Idempotent-Replayed": "true"} if replayed else None
+    return Response(body, media_type="application/json", headers=headers)
 
 async def ensure_user_and_address(id_usuario: int, id_direccion: Optional[int]):
     # usuario
-    u = await client.get(f"{MS1}/usuarios/{id_usuario}")
-    if u.status_code != 200:
+    if await get_user(id_usuario) is None:
         raise HTTPException(404, "Usuario no existe")
     # dirección
     if id_direccion is not None:
-        d = await client.get(f"{MS1}/direcciones/{id_usuario}")
-        if d.status_code != 200:
+        addresses = await get_addresses(id_usuario)
+        if addresses is None:
             raise HTTPException(400, "No se pudo obtener direcciones del usuario")
-        dir_list = normalize_list(d.json())
-        if not address_list_contains(dir_list, id_direccion):
-            disponibles = []
-            for a in dir_list:
-                for k in ("id_direccion", "direccion_id", "id"):
-                    if k in a:
-                        try:
-                            disponibles.append(int(a[k]))
-                        except Exception:
-                            pass
-                        break
+        if int(id_direccion) not in addresses.ids:
+            disponibles = sorted(addresses.ids)
             raise HTTPException(400, f"Dirección inválida para el usuario. Disponibles: {disponibles}")
 
 
@@ -198,7 +574,7 @@ async def healthz(deep: int = Query(default=0, ge=0, le=1)):
     """
     Liveness / Readiness:
     - GET /healthz         -> rápido (no consulta dependencias)
-    - GET /healthz?deep=1  -> verifica MS1/MS2/MS3 (best-effort)
+    - GET /healthz?deep=1  -> estado de MS1/MS2/MS3 según el sondeo en background (no llama a los MS)
     """
     status = {
         "service": "orquestador",
@@ -210,66 +586,330 @@ async def healthz(deep: int = Query(default=0, ge=0, le=1)):
     if not deep:
         return status
 
-    async def check(url: str):
-        try:
-            r = await client.get(url)
-            return {"url": url, "status": r.status_code}
-        except Exception as e:
-            return {"url": url, "error": str(e)}
-
-    # Endpoints ligeros y reales de tus MS
-    checks = await asyncio.gather(
-        check(f"{MS1}/usuarios/1"),   # cambia el ID si lo necesitas
-        check(f"{MS2}/productos"),
-        check(f"{MS3}/pedidos")
-    )
+    # recién arrancado: espera el primer sondeo de cada MS que aún no tiene ninguno (acotado por su timeout)
+    await dependency_prober.check_unprobed()
 
-    status["dependencies"] = {
-        "ms1_usuarios": checks[0],
-        "ms2_productos": checks[1],
-        "ms3_pedidos":   checks[2]
-    }
-    all_ok = all(c.get("status") == 200 for c in checks)
-    status["status"] = "ready" if all_ok else "degraded"
+    status["dependencies"] = dependency_prober.stats()
+    status["breakers"] = {up.name: up.breaker.stats() for up in UPSTREAMS if up.breaker is not None}
+    status["status"] = "ready" if dependency_prober.ready else "degraded"
     return status
 
-# ---------- Endpoint ÚNICO: /orq/cart/price-quote ----------
-@app.post("/orq/cart/price-quote")
-async def price_quote(payload: PriceQuoteReq):
-    # 1) Validar usuario
-    u = await client.get(f"{MS1}/usuarios/{payload.id_usuario}")
-    if u.status_code != 200:
-        raise HTTPException(404, "Usuario no existe")
+# ---------- Métricas Prometheus (/metrics) ----------
+from fastapi.responses import PlainTextResponse
+
+_BREAKER_STATE = {"closed": 0, "half_open": 1, "open": 2}
+
+CACHES = (product_cache, user_cache, address_cache)
+
+def _cache_samples():
+    for cache in CACHES:
+        st = cache.stats()
+        for event in ("hits", "stale_hits", "negative_hits", "misses", "evictions", "refreshes", "refresh_errors"):
+            yield (st["name"], event), st[event]
+
+REGISTRY.callback("orq_cache_events_total", "Eventos de las caches (productos, usuarios, direcciones)", "counter",
+                  ("cache", "event"), _cache_samples)
+REGISTRY.callback("orq_cache_entries", "Entradas en cada cache", "gauge", ("cache",),
+                  lambda: [((c.name,), len(c)) for c in CACHES])
+REGISTRY.callback("orq_category_index_entries", "Categorías en el índice en memoria", "gauge", (),
+                  lambda: [((), category_index.stats()["size"])])
+REGISTRY.callback("orq_category_refresh_total", "Refrescos de /categorias por resultado", "counter", ("result",),
+                  lambda: [(("total",), category_index.refreshes), (("not_modified",), category_index.not_modified),
+                           (("error",), category_index.errors)])
+REGISTRY.callback("orq_product_batch_total", "Lotes e ids del micro-batching de productos", "counter", ("kind",),
+                  lambda: [(("batches",), product_loader.batches), (("ids",), product_loader.ids_requested),
+                           (("bulk_calls",), product_loader.bulk_calls),
+                           (("fallback_calls",), product_loader.fallback_calls)])
+
+REGISTRY.callback("orq_catalog_snapshot_lookups_total", "Productos leídos del snapshot compartido", "counter",
+                  ("result",), lambda: [(("hit",), catalog_snapshot.hits), (("miss",), catalog_snapshot.misses)]
+                  if catalog_snapshot is not None else [])
+REGISTRY.callback("orq_history_writes_total", "Escrituras de historial en MS3 por resultado", "counter", ("result",),
+                  lambda: [(("written",), history_writer.written),
+                           (("unsupported",), history_writer.skipped_unsupported),
+                           (("retried",), history_writer.retried), (("failed",), history_writer.failed),
+                           (("dropped",), history_writer.dropped)])
+REGISTRY.callback("orq_history_queue_depth", "Escrituras de historial en cola", "gauge", (),
+                  lambda: [((), history_writer.stats()["queue"]["size"])])
+REGISTRY.callback("orq_conditional_get_total", "GET condicionales a los MS por resultado", "counter",
+                  ("upstream", "result"),
+                  lambda: [((v.upstream.name, result), getattr(v, result)) for v in REVALIDATORS
+                           for result in ("not_modified", "modified", "no_validators")])
+def _admission_samples(fn):
+    return lambda: [((path,), fn(lim)) for path, lim in admission.limiters.items()]
+
+REGISTRY.callback("orq_admission_in_flight", "Requests admitidos en proceso por ruta", "gauge", ("route",),
+                  _admission_samples(lambda lim: lim.in_flight))
+REGISTRY.callback("orq_admission_queued", "Requests esperando en la cola de admisión", "gauge", ("route",),
+                  _admission_samples(lambda lim: lim.waiting))
+REGISTRY.callback("orq_admission_limit", "Límite de concurrencia vigente por ruta", "gauge", ("route",),
+                  _admission_samples(lambda lim: int(lim.limit)))
+REGISTRY.callback("orq_admission_rejected_total", "Requests rechazados (503) por la admisión", "counter",
+                  ("route", "reason"),
+                  lambda: [((path, reason), value) for path, lim in admission.limiters.items()
+                           for reason, value in (("queue_full", lim.rejected_full),
+                                                 ("queue_timeout", lim.rejected_timeout))])
+REGISTRY.callback("orq_dependency_up", "Último sondeo de la dependencia (1=ok)", "gauge", ("dependency",),
+                  lambda: [((name,), int(p.healthy)) for name, p in dependency_prober.probes.items()])
+REGISTRY.callback("orq_dependency_probe_failures_total", "Sondeos fallidos por dependencia", "counter",
+                  ("dependency",), lambda: [((name,), p.failures) for name, p in dependency_prober.probes.items()])
+REGISTRY.callback("orq_catalog_replica_lookups_total", "Productos leídos de la réplica en memoria", "counter",
+                  ("result",), lambda: [(("hit",), catalog_replica.hits), (("miss",), catalog_replica.misses)]
+                  if catalog_replica is not None else [])
+REGISTRY.callback("orq_catalog_replica_bytes", "Bytes de las columnas de la réplica del catálogo", "gauge", (),
+                  lambda: [((), catalog_replica.stats()["bytes"])] if catalog_replica is not None else [])
+
+def _upstream_samples(fn):
+    return lambda: [((up.name,), fn(up)) for up in UPSTREAMS]
+
+def _pool_samples(key):
+    return _upstream_samples(lambda up: up.pool_telemetry.stats(up.client)[key])
+
+REGISTRY.callback("orq_upstream_in_flight", "Llamadas en curso por MS", "gauge", ("upstream",),
+                  _upstream_samples(lambda up: up.in_flight))
+REGISTRY.callback("orq_upstream_waiting", "Llamadas esperando el semáforo del MS", "gauge", ("upstream",),
+                  _upstream_samples(lambda up: up.waiting))
+REGISTRY.callback("orq_upstream_coalesced_total", "GETs ahorrados por singleflight", "counter", ("upstream",),
+                  _upstream_samples(lambda up: up._flight.shared if up._flight is not None else None))
+REGISTRY.callback("orq_upstream_hedges_total", "Peticiones hedge lanzadas", "counter", ("upstream",),
+                  _upstream_samples(lambda up: up.hedges))
+REGISTRY.callback("orq_breaker_state", "Circuit breaker (0=closed, 1=half_open, 2=open)", "gauge", ("upstream",),
+                  _upstream_samples(lambda up: _BREAKER_STATE[up.breaker.state] if up.breaker else None))
+REGISTRY.callback("orq_breaker_rejected_total", "Llamadas rechazadas con el circuito abierto", "counter",
+                  ("upstream",), _upstream_samples(lambda up: up.breaker.rejected if up.breaker else None))
+REGISTRY.callback("orq_pool_active_connections", "Conexiones activas del pool", "gauge", ("upstream",),
+                  _pool_samples("active_connections"))
+REGISTRY.callback("orq_pool_idle_connections", "Conexiones ociosas del pool", "gauge", ("upstream",),
+                  _pool_samples("idle_connections"))
+REGISTRY.callback("orq_pool_new_connections_total", "Conexiones nuevas abiertas", "counter", ("upstream",),
+                  _pool_samples("new_connections"))
+REGISTRY.callback("orq_pool_wait_seconds_total", "Tiempo total esperando una conexión libre", "counter",
+                  ("upstream",), _upstream_samples(lambda up: up.pool_telemetry.wait_total))
+REGISTRY.callback("orq_pool_requests_total", "Peticiones que obtuvieron conexión del pool", "counter",
+                  ("upstream",), _upstream_samples(lambda up: up.pool_telemetry.requests))
+
+REGISTRY.callback("orq_schema_shape_changes_total", "Cambios de esquema re-detectados por respuesta de MS",
+                  "counter", ("schema",), lambda: [((sc.name,), sc.stats()["shape_changes"]) for sc in SCHEMAS])
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# ---------- Admin (protegido con X-Admin-Token; sin ADMIN_TOKEN las rutas no existen) ----------
+import hmac
+from fastapi import Depends, Header
+
+def _check_token(expected: str, given: Optional[str]) -> None:
+    if not expected:
+        raise HTTPException(404, "Not Found")  # sin token configurado la ruta queda deshabilitada
+    if given is None or not hmac.compare_digest(given.encode(), expected.encode()):
+        raise HTTPException(403, "No autorizado")
 
-    # 2) Validar direccion si viene
-    if payload.id_direccion is not None:
-        d = await client.get(f"{MS1}/direcciones/{payload.id_usuario}")
-        if d.status_code != 200:
-            raise HTTPException(400, "No se pudo obtener direcciones del usuario")
-        dir_list = normalize_list(d.json())
-        if not address_list_contains(dir_list, payload.id_direccion):
-            # En vez de romper, devolvemos error claro (lo que ya viste)
-            raise HTTPException(400, "Dirección inválida para el usuario")
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    _check_token(ADMIN_TOKEN, x_admin_token)
+
+@app.get("/admin/cache", dependencies=[Depends(require_admin)])
+async def admin_cache_stats():
+    return {
+        "products": product_cache.stats(),
+        "product_batching": product_loader.stats(),
+        "categories": category_index.stats(),
+        "users": user_cache.stats(),
+        "addresses": address_cache.stats(),
+        "user_invalidations": user_invalidations.stats() if user_invalidations is not None else None,
+        "conditional_get": {v.upstream.name: v.stats() for v in REVALIDATORS},
+    }
 
-    # 3) Traer productos en paralelo
-    async def fetch(prod_id: int):
-        return await client.get(f"{MS2}/productos/{prod_id}")
+@app.delete("/admin/cache", dependencies=[Depends(require_admin)])
+async def admin_cache_clear():
+    product_cache.clear()
+    for v in REVALIDATORS:
+        v.clear()
+    invalidate_users(None)
+    if user_invalidations is not None:
+        user_invalidations.publish(None)
+    return {"products": product_cache.stats(), "users": user_cache.stats(), "addresses": address_cache.stats()}
+
+# ---------- Webhook de MS1: invalidar usuarios/direcciones cacheados ----------
+def require_ms1_webhook(x_webhook_token: Optional[str] = Header(default=None)):
+    _check_token(MS1_WEBHOOK_TOKEN, x_webhook_token)
+
+class UserInvalidation(BaseModel):
+    id_usuario: Optional[int] = None
+    ids: List[int] = []
+    all: bool = False
+
+@app.post("/webhooks/ms1/invalidate", dependencies=[Depends(require_ms1_webhook)])
+async def ms1_invalidate(body: UserInvalidation):
+    """MS1 avisa que cambió un usuario o sus direcciones (alta, baja, edición)."""
+    ids = None if body.all else list(dict.fromkeys(
+        ([body.id_usuario] if body.id_usuario is not None else []) + body.ids))
+    if ids == []:
+        raise HTTPException(400, "Indica id_usuario, ids o all=true")
+    invalidate_users(ids)
+    if user_invalidations is not None:
+        user_invalidations.publish(ids)
+    return {"invalidated": "all" if ids is None else ids}
+
+@app.get("/admin/upstreams", dependencies=[Depends(require_admin)])
+async def admin_upstreams():
+    return {up.name: up.stats() for up in UPSTREAMS}
+
+@app.get("/admin/catalog", dependencies=[Depends(require_admin)])
+async def admin_catalog():
+    """Catálogo local: snapshot compartido (multi-worker: rol, edad, tamaño, hits) o réplica en memoria."""
+    if catalog_snapshot is None and catalog_replica is None:
+        return {"enabled": False}
+    if catalog_replica is not None:
+        return {"enabled": True, "replica": catalog_replica.stats()}
+    return {"enabled": True, "snapshot": catalog_snapshot.stats(), "publisher": snapshot_publisher.stats()}
+
+@app.get("/admin/history", dependencies=[Depends(require_admin)])
+async def admin_history():
+    """Ruta/payload de historial aprendidos por MS3, cola de escrituras en background y fallos."""
+    return history_writer.stats()
+
+@app.get("/admin/admission", dependencies=[Depends(require_admin)])
+async def admin_admission():
+    return {"enabled": ADMISSION_CONTROL, "routes": admission.stats()}
+
+profiler = SamplingProfiler()
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def admin_profile(seconds: float = Query(default=10, gt=0, le=PROFILE_MAX_SECONDS),
+                        interval_ms: float = Query(default=PROFILE_INTERVAL_MS, ge=1, le=1000)):
+    """
+    Muestrea la pila del event loop de este worker durante `seconds` con tráfico real y devuelve
+    collapsed stacks (`flamegraph.pl`, speedscope). Un perfil a la vez por worker.
+    """
+    try:
+        collapsed, samples = await asyncio.to_thread(
+            profiler.run, threading.get_ident(), seconds, interval_ms / 1000.0)
+    except ProfilerBusy:
+        raise HTTPException(409, "Ya hay un perfil en curso en este worker")
+    return PlainTextResponse(collapsed, headers={
+        "X-Profile-Samples": str(samples),
+        "Content-Disposition": 'attachment; filename="orq-profile.collapsed"',
+    })
+
+@app.get("/admin/idempotency", dependencies=[Depends(require_admin)])
+async def admin_idempotency():
+    return idempotency_store.stats()
+
+@app.get("/admin/schemas", dependencies=[Depends(require_admin)])
+async def admin_schemas():
+    """Alias aprendido por campo para cada respuesta de MS1/MS2/MS3 (null = aún no visto)."""
+    return {schema.name: schema.stats() for schema in SCHEMAS}
+
+@app.post("/admin/categories/refresh", dependencies=[Depends(require_admin)])
+async def admin_categories_refresh():
+    """Fuerza la recarga completa de /categorias (ignora ETag/Last-Modified)."""
+    try:
+        changed = await category_index.refresh(force=True)
+    except Exception as e:
+        raise HTTPException(502, f"No se pudo refrescar categorías: {e}")
+    return {"changed": changed, "categories": category_index.stats()}
 
-    tasks = [fetch(i.id_producto) for i in payload.items]
-    responses = await asyncio.gather(*tasks)
+# ---------- Cotización: /orq/cart/price-quote ----------
+class QuoteLookups:
+    """
+    Lookups de una cotización (usuario, direcciones, productos) memoizados por id.
+    En el batch se comparte una instancia entre todos los carritos: cada id distinto
+    se consulta una sola vez en todo el lote.
+    """
 
+    def __init__(self):
+        self._memo: dict[tuple, asyncio.Future] = {}
+
+    def _once(self, key: tuple, factory) -> asyncio.Future:
+        fut = self._memo.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(factory())
+            self._memo[key] = fut
+        return fut
+
+    async def user(self, id_usuario: int) -> Optional[dict]:
+        return await asyncio.shield(self._once(("u", id_usuario), lambda: get_user(id_usuario)))
+
+    async def addresses(self, id_usuario: int) -> Optional[UserAddresses]:
+        return await asyncio.shield(self._once(("d", id_usuario), lambda: get_addresses(id_usuario)))
+
+    async def products(self, prod_ids) -> dict[int, Optional[dict]]:
+        unique_ids = list(dict.fromkeys(prod_ids))
+        futs = [self._once(("p", pid), lambda pid=pid: get_product(pid)) for pid in unique_ids]
+        gathered = asyncio.gather(*futs)
+        # si cancelan la etapa (validación fallida) y luego `cancel()`, nadie más lee este resultado
+        gathered.add_done_callback(lambda f: f.cancelled() or f.exception())
+        found = await asyncio.shield(gathered)
+        return dict(zip(unique_ids, found))
+
+    def cancel(self) -> None:
+        for fut in self._memo.values():
+            fut.cancel()
+
+
+async def compute_quote(payload: PriceQuoteReq, lookups: QuoteLookups) -> dict:
+    """Cotiza un carrito; lanza HTTPException si el usuario/dirección no son válidos."""
+    # Usuario, direcciones y productos se piden a la vez (especulativo); si la validación falla,
+    # al salir del bloque se cancela lo que siga en vuelo.
+    #    (usuario y direcciones salen de la cache de MS1: un cliente que repite checkout no llama a MS1)
+    async with Stages() as stages:
+        stages.start("user", lookups.user(payload.id_usuario))
+        if payload.id_direccion is not None:
+            stages.start("addresses", lookups.addresses(payload.id_usuario))
+
+        # Precios: con catálogo local (réplica/snapshot) se resuelven todas las líneas de una vez por
+        # índice en las columnas; los ids que no estén ahí (o sin catálogo local) se traen una sola vez
+        # (paralelo, vía cache) y precio, nombre y categoría salen del mismo payload de MS2
+        pids = [i.id_producto for i in payload.items]
+        view = catalog_view()
+        if view is not None:
+            idx, unit_prices, line_totals = view.price_lines(pids, [i.cantidad for i in payload.items])
+            missing = [pid for pid, i in zip(pids, idx) if i < 0]
+        else:
+            idx = unit_prices = line_totals = None
+            missing = pids
+        if missing:
+            stages.start("products", lookups.products(missing))
+
+        # 1) Validar usuario
+        if await stages.result("user") is None:
+            raise HTTPException(404, "Usuario no existe")
+
+        # 2) Validar direccion si viene
+        if payload.id_direccion is not None:
+            addresses = await stages.result("addresses")
+            if addresses is None:
+                raise HTTPException(400, "No se pudo obtener direcciones del usuario")
+            if payload.id_direccion not in addresses.ids:
+                # En vez de romper, devolvemos error claro (lo que ya viste)
+                raise HTTPException(400, "Dirección inválida para el usuario")
+
+        # 3) Precios
+        products = await stages.result("products") if missing else {}
+
+    t0 = time.perf_counter()
     quote_items = []
     issues = []
     subtotal = 0.0
 
-    for req_item, resp in zip(payload.items, responses):
-        if resp.status_code != 200:
-            issues.append({"id_producto": req_item.id_producto, "reason": "NOT_FOUND"})
-            continue
-        prod = resp.json()
-        nombre = pick(prod, "nombre", "name", default=f"producto:{req_item.id_producto}")
-        precio_unit = to_float(pick(prod, "precio", "price", "valor", default=0.0))
-        line_total = round(precio_unit * req_item.cantidad, 2)
+    for n, req_item in enumerate(payload.items):
+        i = idx[n] if idx is not None else -1
+        if i >= 0:
+            nombre = view.name(i) or f"producto:{req_item.id_producto}"
+            precio_unit = unit_prices[n]
+            line_total = line_totals[n]
+            categoria_id = view.category(i)
+        else:
+            prod = products.get(req_item.id_producto)
+            if prod is None:
+                issues.append({"id_producto": req_item.id_producto, "reason": "NOT_FOUND"})
+                continue
+            nombre = PRODUCT.nombre(prod, f"producto:{req_item.id_producto}")
+            precio_unit = to_float(PRODUCT.precio(prod, 0.0))
+            line_total = round(precio_unit * req_item.cantidad, 2)
+            # categoría best-effort: id del producto (si lo trae) + nombre del índice de categorías
+            categoria_id = extract_category_id(prod)
         subtotal += line_total
 
         # detectar drift si el cliente mandó expected_price
@@ -286,47 +926,14 @@ async def price_quote(payload: PriceQuoteReq):
             "precio_unitario": precio_unit,
             "cantidad": req_item.cantidad,
             "line_total": line_total,
-            # los completamos luego:
-            "categoria_id": None,
-            "categoria_nombre": None,
+            "categoria_id": categoria_id,
+            "categoria_nombre": category_index.get(categoria_id),
             "price_changed": price_changed,
         })
 
-    # 4) Intentar enriquecer con categoría (best-effort, no rompe si falta)
-    #    a) primero intentamos sacar categoria_id de cada producto (si no lo tiene, quedará None)
-    #    b) luego pedimos /categorias y hacemos map id->nombre admitiendo distintos campos
-    try:
-        # Re-fetch productos (ligero) solo para sacar categoria_id de forma robusta
-        # (si ya lo tienes con seguridad, puedes evitar este paso)
-        for qi in quote_items:
-            r = await client.get(f"{MS2}/productos/{qi['id_producto']}")
-            if r.status_code == 200:
-                prod = r.json()
-                cid = extract_category_id(prod)
-                if cid is not None:
-                    qi["categoria_id"] = cid
-
-        cats = await client.get(f"{MS2}/categorias")
-        cat_map = {}
-        if cats.status_code == 200 and isinstance(cats.json(), list):
-            for c in cats.json():
-                # claves posibles de id de categoría
-                cat_id = pick(c, "id_categoria", "categoria_id", "id", "category_id")
-                try:
-                    cat_id = int(cat_id)
-                except Exception:
-                    continue
-                cat_map[cat_id] = extract_category_name(c)
-        # asignar nombre si tenemos id y nombre
-        for qi in quote_items:
-            if qi["categoria_id"] in cat_map:
-                qi["categoria_nombre"] = cat_map[qi["categoria_id"]]
-    except Exception:
-        # no frenamos la cotización si /categorias u otros esquemas difieren
-        pass
-
     taxes = round(subtotal * TAX_RATE, 2)
     total = round(subtotal + taxes, 2)
+    timing.record("pricing", time.perf_counter() - t0)
 
     return {
         "generatedAt": now_iso(),
@@ -334,82 +941,167 @@ async def price_quote(payload: PriceQuoteReq):
         "issues": issues,  # NOT_FOUND o PRICE_CHANGED si aplica
         "totals": {"subtotal": round(subtotal, 2), "taxes": taxes, "total": total}
     }
-from fastapi import Header
 
+@app.post("/orq/cart/price-quote")
+async def price_quote(payload: PriceQuoteReq,
+                      idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+                      request_timeout: Optional[str] = Header(default=None, alias=REQUEST_DEADLINE_HEADER)):
+    async def quote() -> dict:
+        lookups = QuoteLookups()
+        try:
+            async with deadline.scope(deadline.budget(REQUEST_DEADLINE, request_timeout)):
+                return await compute_quote(payload, lookups)
+        finally:
+            lookups.cancel()
 
-@app.get("/orq/orders/{order_id}/details")
-async def order_details(order_id: str, id_usuario: int):
+    return await idempotent("price-quote", idempotency_key, payload, quote)
+
+
+# ---------- Cotización en lote (NDJSON en streaming) ----------
+import tempfile
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+
+async def _spool_body(request: Request):
+    """Vuelca el body a un archivo temporal (en memoria solo hasta 1 MiB)."""
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+async def _iter_batch_carts(request: Request):
     """
-    Devuelve el pedido con enriquecimiento:
-    - Valida que el pedido exista (MS3) y pertenezca a id_usuario.
-    - Enriquecer líneas con datos actuales de MS2 (nombre, categoría, precio vigente).
-    - Adjunta resumen del usuario y conteo de direcciones (MS1).
+    Itera (index, PriceQuoteReq | error) del body del batch:
+    - `application/x-ndjson`: un carrito por línea (el body se vuelca a disco y se lee por líneas).
+    - JSON: lista de carritos o {"carts": [...]}.
+    El body se lee completo antes de empezar a responder: StreamingResponse escucha
+    `receive()` para detectar desconexiones y no se puede seguir leyendo el body en paralelo.
     """
-    # 1) Traer pedido de MS3
-    r = await client.get(f"{MS3}/pedidos/{order_id}")
-    if r.status_code != 200:
-        raise HTTPException(404, "Pedido no existe")
-    pedido = r.json()
-
-    # 2) Verificar dueño
-    pedido_user = pick(pedido, "id_usuario", "usuario_id", "user_id")
-    if pedido_user is None or int(pedido_user) != int(id_usuario):
-        raise HTTPException(403, "No autorizado")
+    ctype = request.headers.get("content-type", "")
+    if "ndjson" in ctype:
+        spool = await _spool_body(request)
+
+        async def lines():
+            with spool:
+                idx = 0
+                for line in spool:
+                    if line.strip():
+                        yield idx, _parse_cart(line)
+                        idx += 1
+        return lines()
+    try:
+        body = loads(await request.body())
+    except Exception:
+        raise HTTPException(400, "Body inválido: se espera JSON o NDJSON")
+    carts = body.get("carts") if isinstance(body, dict) else body
+    if not isinstance(carts, list):
+        raise HTTPException(422, "Se espera una lista de carritos o {\"carts\": [...]}")
 
-    fecha_pedido = pick(pedido, "fecha_pedido", "fecha", "createdAt")
-    total_ms3 = to_float(pick(pedido, "total", "monto_total", "total_pedido", default=0.0))
-    items_ms3 = pick(pedido, "productos", "items", default=[])
-    if not isinstance(items_ms3, list):
-        items_ms3 = []
+    async def items():
+        for idx, raw in enumerate(carts):
+            try:
+                yield idx, PriceQuoteReq.model_validate(raw)
+            except ValidationError as e:
+                yield idx, e
+    return items()
 
-    # 3) Enriquecer cada línea con MS2 (paralelo)
-    async def fetch_prod(prod_id: int):
-        return await client.get(f"{MS2}/productos/{prod_id}")
+def _parse_cart(line: bytes):
+    try:
+        return PriceQuoteReq.model_validate_json(line)
+    except ValidationError as e:
+        return e
+
+async def _quote_one(idx: int, cart, lookups: QuoteLookups, budget: Optional[float]) -> dict:
+    if isinstance(cart, ValidationError):
+        errors = cart.errors(include_url=False, include_input=False, include_context=False)
+        return {"index": idx, "status": 422, "detail": errors}
+    try:
+        async with deadline.scope(budget):
+            return {"index": idx, "status": 200, "quote": await compute_quote(cart, lookups)}
+    except HTTPException as e:
+        return {"index": idx, "status": e.status_code, "detail": e.detail}
+    except CircuitOpenError as e:
+        return {"index": idx, "status": 503, "detail": f"Servicio {e.name} no disponible temporalmente"}
+    except deadline.DeadlineExceeded:
+        return {"index": idx, "status": 504, "detail": "Tiempo agotado cotizando el carrito"}
+    except Exception as e:
+        return {"index": idx, "status": 502, "detail": f"Error consultando microservicios: {e!r}"}
+
+def _ndjson_line(obj: dict) -> bytes:
+    return dumps(obj) + b"\n"
+
+@app.post("/orq/cart/price-quote/batch")
+async def price_quote_batch(request: Request):
+    """
+    Cotiza muchos carritos (`PriceQuoteReq`) y devuelve NDJSON: una línea
+    `{"index", "status", "quote" | "detail"}` por carrito, en orden de finalización.
+    Usuarios, direcciones y productos se consultan una sola vez por id en todo el lote
+    y como mucho `BATCH_QUOTE_CONCURRENCY` carritos están en proceso a la vez.
+    El deadline (`REQUEST_DEADLINE` o el header del cliente) se aplica a cada carrito.
+    """
+    carts = await _iter_batch_carts(request)
+    budget = deadline.budget(REQUEST_DEADLINE, request.headers.get(REQUEST_DEADLINE_HEADER))
 
-    tasks = []
-    for it in items_ms3:
-        prod_id = pick(it, "id_producto", "producto_id", "product_id")
+    async def stream():
+        lookups = QuoteLookups()
+        pending: set[asyncio.Task] = set()
         try:
-            prod_id = int(prod_id)
-        except Exception:
-            prod_id = None
-        tasks.append(fetch_prod(prod_id) if prod_id is not None else None)
+            async for idx, cart in carts:
+                if len(pending) >= BATCH_QUOTE_CONCURRENCY:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for t in done:
+                        yield _ndjson_line(t.result())
+                pending.add(asyncio.create_task(_quote_one(idx, cart, lookups, budget)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    yield _ndjson_line(t.result())
+        finally:
+            # cliente desconectado o error: no dejar trabajo huérfano
+            for t in pending:
+                t.cancel()
+            lookups.cancel()
+            await carts.aclose()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+from fastapi import Header
 
-    responses = []
-    for t in tasks:
-        if t is None:
-            responses.append(None)
-        else:
-            responses.append(await t)
+
+def order_line_ids(pedido: dict) -> tuple[list[dict], list[Optional[int]]]:
+    """Líneas (dicts) del pedido de MS3 y el id de producto de cada una."""
+    items_ms3 = ORDER.items(pedido, [])
+    if not isinstance(items_ms3, list):
+        items_ms3 = []
+    items_ms3 = [it for it in items_ms3 if isinstance(it, dict)]
+    return items_ms3, [ORDER_LINE.id_producto.as_int(it) for it in items_ms3]
+
+def user_summary_of(id_usuario: int, u: Optional[dict], d: Optional[UserAddresses]) -> dict:
+    user_summary = {"id_usuario": id_usuario, **u} if u else {}
+    if d is not None:
+        user_summary["direcciones_count"] = d.count
+    return user_summary
+
+def enrich_order(order_id: str, pedido: dict, products: dict[int, Optional[dict]],
+                 user_summary: Optional[dict] = None) -> dict:
+    """
+    Pedido de MS3 enriquecido con datos actuales de MS2 (nombre, categoría, precio vigente),
+    totales recalculados e issues. `products` ya trae los productos de sus líneas.
+    """
+    fecha_pedido = ORDER.fecha(pedido)
+    total_ms3 = to_float(ORDER.total(pedido, 0.0))
+    items_ms3, line_ids = order_line_ids(pedido)
 
     lines = []
     issues = []
     recomputed_subtotal = 0.0
 
-    # Mapa de categorías (best-effort)
-    cat_map = {}
-    try:
-        cats = await client.get(f"{MS2}/categorias")
-        if cats.status_code == 200 and isinstance(cats.json(), list):
-            for c in cats.json():
-                cat_id = pick(c, "id_categoria", "categoria_id", "id", "category_id")
-                try:
-                    cat_id = int(cat_id)
-                except Exception:
-                    continue
-                cat_map[cat_id] = extract_category_name(c)
-    except Exception:
-        pass
-
-    for it, resp in zip(items_ms3, responses):
-        pid = pick(it, "id_producto", "producto_id", "product_id")
-        try:
-            pid = int(pid)
-        except Exception:
-            pid = None
-
-        cantidad = to_float(pick(it, "cantidad", "qty", "quantity", default=0), 0.0)
-        precio_unit_ms3 = to_float(pick(it, "precio_unitario", "precio", "unit_price", default=0.0), 0.0)
+    for it, pid in zip(items_ms3, line_ids):
+        prod = products.get(pid) if pid is not None else None
+        cantidad = to_float(ORDER_LINE.cantidad(it, 0), 0.0)
+        precio_unit_ms3 = to_float(ORDER_LINE.precio_unitario(it, 0.0), 0.0)
         line_total_ms3 = round(precio_unit_ms3 * cantidad, 2)
         recomputed_subtotal += line_total_ms3
 
@@ -419,15 +1111,13 @@ async def order_details(order_id: str, id_usuario: int):
         categoria_id = None
         categoria_nombre = None
 
-        if resp is None or (hasattr(resp, "status_code") and resp.status_code != 200):
+        if prod is None:
             issues.append({"id_producto": pid, "reason": "PRODUCT_NOT_FOUND"})
         else:
-            prod = resp.json()
-            nombre = pick(prod, "nombre", "name")
-            current_price_ms2 = to_float(pick(prod, "precio", "price", "valor", default=None))
+            nombre = PRODUCT.nombre(prod)
+            current_price_ms2 = to_float(PRODUCT.precio(prod))
             categoria_id = extract_category_id(prod)
-            if categoria_id in cat_map:
-                categoria_nombre = cat_map[categoria_id]
+            categoria_nombre = category_index.get(categoria_id)
 
         price_drift = (
             current_price_ms2 is not None and
@@ -451,31 +1141,18 @@ async def order_details(order_id: str, id_usuario: int):
     taxes_est = round(recomputed_subtotal * TAX_RATE, 2)
     total_est = round(recomputed_subtotal + taxes_est, 2)
 
-    # 4) Resumen de usuario (MS1)
-    user_summary = {}
-    u = await client.get(f"{MS1}/usuarios/{id_usuario}")
-    if u.status_code == 200:
-        uj = u.json()
-        user_summary = {
-            "id_usuario": id_usuario,
-            "nombre": pick(uj, "nombre", "name"),
-            "correo": pick(uj, "correo", "email"),
-            "telefono": pick(uj, "telefono", "phone"),
-        }
-    d = await client.get(f"{MS1}/direcciones/{id_usuario}")
-    if d.status_code == 200:
-        dir_list = normalize_list(d.json())
-        user_summary["direcciones_count"] = len(dir_list)
-
-    # 5) Posibles inconsistencias
+    # Posibles inconsistencias
     if abs(total_ms3 - total_est) > 0.01:
         issues.append({"reason": "TOTAL_MISMATCH", "total_ms3": total_ms3, "total_est": total_est})
 
-    return {
+    out = {
         "orderId": order_id,
-        "estado": pick(pedido, "estado", "status"),
+        "estado": ORDER.estado(pedido),
         "fecha_pedido": fecha_pedido,
-        "user": user_summary,
+    }
+    if user_summary is not None:
+        out["user"] = user_summary
+    out.update({
         "lines": lines,
         "issues": issues,
         "totals": {
@@ -484,7 +1161,178 @@ async def order_details(order_id: str, id_usuario: int):
             "taxes_estimated": taxes_est,
             "total_estimated": total_est
         }
-    }
+    })
+    return out
+
+
+@app.get("/orq/orders/{order_id}/details")
+async def order_details(order_id: str, id_usuario: int,
+                        request_timeout: Optional[str] = Header(default=None, alias=REQUEST_DEADLINE_HEADER),
+                        if_none_match: Optional[str] = Header(default=None, alias="If-None-Match")):
+    """
+    Devuelve el pedido con enriquecimiento:
+    - Valida que el pedido exista (MS3) y pertenezca a id_usuario.
+    - Enriquecer líneas con datos actuales de MS2 (nombre, categoría, precio vigente).
+    - Adjunta resumen del usuario y conteo de direcciones (MS1).
+    - ETag fuerte; con `If-None-Match` igual responde 304 sin body.
+    """
+    async with deadline.scope(deadline.budget(REQUEST_DEADLINE, request_timeout)), Stages() as stages:
+        # usuario y direcciones (MS1, cacheados) solo dependen de id_usuario: salen junto con el pedido
+        # y se descartan si el pedido no existe o no es suyo
+        stages.start("user", get_user(id_usuario))
+        stages.start("addresses", get_addresses(id_usuario))
+
+        # 1) Traer pedido de MS3 (condicional: si no cambió, 304 y el pedido ya parseado)
+        status, pedido, order_version = await ms3_validators.get(f"/pedidos/{order_id}", response_json)
+        if status != 200:
+            raise HTTPException(404, "Pedido no existe")
+
+        # 2) Verificar dueño
+        pedido_user = ORDER.id_usuario.as_int(pedido) if isinstance(pedido, dict) else None
+        if pedido_user is None or pedido_user != int(id_usuario):
+            raise HTTPException(403, "No autorizado")
+
+        # 3) Con el pedido validado, productos de MS2 (cada upstream acotado por su semáforo).
+        #    Las categorías salen del índice en memoria (sin llamada).
+        _, line_ids = order_line_ids(pedido)
+        products = await fetch_products(pid for pid in line_ids if pid is not None)
+        u, d = await stages.result("user"), await stages.result("addresses")
+
+    # 4) ETag de todo lo que determina el body: si el cliente ya lo tiene, 304 sin armar ni serializar nada
+    user_summary = user_summary_of(id_usuario, u, d)
+    etag = details_etag(order_version, line_ids, products, user_summary)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    # 5) Líneas, totales e issues + resumen de usuario (MS1)
+    with timing.stage("enrich"):
+        body = enrich_order(order_id, pedido, products, user_summary)
+    return FastJSONResponse(body, headers=headers)
+
+def details_etag(order_version: str, line_ids: list[Optional[int]], products: dict[int, Optional[dict]],
+                 user_summary: dict) -> str:
+    """Versión del pedido en MS3 + los campos de MS2/categorías/MS1 que usa `enrich_order`."""
+    lines = []
+    for pid in line_ids:
+        prod = products.get(pid) if pid is not None else None
+        if prod is None:
+            lines.append(pid)
+            continue
+        categoria_id = extract_category_id(prod)
+        lines.append((pid, PRODUCT.nombre(prod), PRODUCT.precio(prod), categoria_id, category_index.get(categoria_id)))
+    return strong_etag((order_version, TAX_RATE, lines, user_summary))
+
+
+# ---------- Historial de pedidos de un usuario (paginado, NDJSON en streaming) ----------
+def _encode_cursor(page: int, skip: int, size: int, prev_first: Optional[str] = None) -> str:
+    c = {"p": page, "s": skip, "n": size}
+    if prev_first is not None:
+        c["f"] = prev_first
+    return base64.urlsafe_b64encode(dumps(c)).rstrip(b"=").decode()
+
+def _decode_cursor(cursor: Optional[str]) -> tuple[int, int, int, Optional[str]]:
+    """
+    (página de MS3, pedidos ya devueltos de esa página, tamaño de página, primer id de la página
+    anterior). Sin cursor: inicio.
+    """
+    if not cursor:
+        return 1, 0, USER_ORDERS_PAGE_SIZE, None
+    try:
+        c = loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        page, skip, size, prev_first = int(c["p"]), int(c["s"]), int(c["n"]), c.get("f")
+    except Exception:
+        raise HTTPException(400, "cursor inválido")
+    if page < 1 or skip < 0 or size < 1:
+        raise HTTPException(400, "cursor inválido")
+    return page, skip, size, prev_first
+
+async def _user_orders_page(id_usuario: int, limit: int, cursor: Optional[str]) -> tuple[list[dict], Optional[str]]:
+    """
+    Hasta `limit` pedidos del usuario recorriendo `GET /pedidos` de MS3 por páginas de tamaño fijo
+    (el cursor guarda página + desplazamiento, así `limit` puede variar entre llamadas).
+    El dueño se verifica aquí aunque MS3 filtre. Si MS3 ignora la paginación (devuelve más que la
+    página, o la página siguiente empieza igual que la anterior) el listado se trata como una sola página.
+    """
+    page, skip, size, prev_first = _decode_cursor(cursor)
+    orders: list[dict] = []
+    for _ in range(max(1, USER_ORDERS_MAX_PAGES)):
+        r = await ms3.get(USER_ORDERS_PATH, params={
+            USER_ORDERS_USER_PARAM: id_usuario, USER_ORDERS_PAGE_PARAM: page, USER_ORDERS_SIZE_PARAM: size,
+        })
+        if r.status_code != 200:
+            raise HTTPException(502, "No se pudo listar pedidos en MS3")
+        items = normalize_list(response_json(r))
+        first = _maybe_oid(ORDER.id(items[0])) if items and isinstance(items[0], dict) else None
+        if skip == 0 and prev_first is not None and first == prev_first:
+            return orders, None  # MS3 repitió la página anterior: no pagina
+        mine = [o for o in items if isinstance(o, dict) and ORDER.id_usuario.as_int(o) == id_usuario]
+        taken = mine[skip:skip + limit - len(orders)]
+        orders.extend(taken)
+        skip += len(taken)
+        if skip < len(mine):
+            return orders, _encode_cursor(page, skip, size)  # quedan pedidos en esta página
+        if len(items) != size:
+            return orders, None  # página incompleta = última (o MS3 devolvió todo de una vez)
+        page, skip, prev_first = page + 1, 0, first
+        if len(orders) >= limit:
+            break
+    # página llena o tope de páginas recorridas: seguir en la próxima llamada
+    return orders, _encode_cursor(page, skip, size, prev_first)
+
+async def _with_items(order: dict) -> dict:
+    """Si el listado de MS3 no trae las líneas del pedido, se piden al detalle."""
+    if isinstance(ORDER.items(order), list):
+        return order
+    order_id = _maybe_oid(ORDER.id(order))
+    if order_id is None:
+        return order
+    r = await ms3.get(f"/pedidos/{order_id}")
+    full = response_json(r) if r.status_code == 200 else None
+    return full if isinstance(full, dict) else order
+
+@app.get("/orq/users/{id_usuario}/orders")
+async def user_orders(id_usuario: int,
+                      limit: int = Query(default=20, ge=1, le=USER_ORDERS_MAX_LIMIT),
+                      cursor: Optional[str] = None,
+                      request_timeout: Optional[str] = Header(default=None, alias=REQUEST_DEADLINE_HEADER)):
+    """
+    Historial de pedidos del usuario en NDJSON:
+    - `{"user": {...}}` (resumen de MS1, una sola vez),
+    - una línea por pedido (formato de `/orq/orders/{id}/details`, sin `user`) en cuanto sus
+      productos están listos,
+    - `{"next_cursor": "..." | null, "count": n}` al final.
+    Los productos de toda la página se piden juntos (ids deduplicados entre pedidos).
+    """
+    # el deadline cubre lo que se resuelve antes de empezar a responder; el stream no tiene tope
+    async with deadline.scope(deadline.budget(REQUEST_DEADLINE, request_timeout)), Stages() as stages:
+        stages.start("page", _user_orders_page(id_usuario, limit, cursor))
+        stages.start("addresses", get_addresses(id_usuario))
+        u = await get_user(id_usuario)
+        if u is None:
+            raise HTTPException(404, "Usuario no existe")
+        (orders, next_cursor), d = await stages.result("page"), await stages.result("addresses")
+        orders = await asyncio.gather(*(_with_items(o) for o in orders))
+
+    # una tarea por producto distinto de la página: el micro-batching las agrupa hacia MS2
+    per_order = [[pid for pid in order_line_ids(o)[1] if pid is not None] for o in orders]
+    tasks = {pid: asyncio.ensure_future(get_product(pid)) for ids in per_order for pid in ids}
+
+    async def stream():
+        try:
+            yield _ndjson_line({"user": user_summary_of(id_usuario, u, d)})
+            for order, ids in zip(orders, per_order):
+                # un producto que falló (p.ej. circuito abierto) se reporta como PRODUCT_NOT_FOUND
+                found = await asyncio.gather(*(tasks[pid] for pid in ids), return_exceptions=True)
+                found = [None if isinstance(f, BaseException) else f for f in found]
+                order_id = _maybe_oid(ORDER.id(order))
+                yield _ndjson_line(enrich_order(order_id, order, dict(zip(ids, found))))
+            yield _ndjson_line({"next_cursor": next_cursor, "count": len(orders)})
+        finally:
+            for t in tasks.values():
+                t.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 
 from typing import Tuple
@@ -532,55 +1380,25 @@ def extract_order_id_from_location(headers: dict) -> str | None:
     return parts[-1] if parts else None
 
 # ---------- Helper: escribir historial con rutas alternativas (u omitir si no existe) ----------
+# La ruta/payload que acepta MS3 (o "no soportado") se aprende una vez y se recuerda HISTORY_ROUTE_TTL
+history_writer = HistoryWriter(
+    ms3,
+    ttl=HISTORY_ROUTE_TTL,
+    unsupported_ttl=HISTORY_UNSUPPORTED_TTL,
+    queue_size=HISTORY_QUEUE_SIZE,
+    workers=HISTORY_WORKERS,
+    retries=HISTORY_RETRIES,
+    retry_backoff=HISTORY_RETRY_BACKOFF,
+)
+
 async def write_history(order_id: str, estado: str, comentarios: str) -> tuple[bool, str]:
     """
-    Intenta varias rutas/payloads típicas para MS3. Si todas devuelven 404, lo trata como 'no soportado' y no falla.
+    Escribe el historial en MS3 (rutas/payloads típicos, descubiertos una vez). Si todas las rutas
+    dan 404 lo trata como 'no soportado' y no falla.
     Devuelve (ok, msg). ok=True si lo logró o si no está soportado; ok=False solo si MS3 sí tiene historial pero falló.
     """
-    # posibles rutas
-    paths = [
-        f"{MS3}/historial",
-        f"{MS3}/pedidos/{order_id}/historial",
-        f"{MS3}/historial/{order_id}",
-    ]
-    # posibles payloads
-    payloads = [
-        {"id_pedido": order_id, "estado": estado, "comentarios": comentarios},
-        {"idPedido": order_id, "estado": estado, "comentarios": comentarios},
-        {"pedido_id": order_id, "estado": estado, "comentarios": comentarios},
-        {"estado": estado, "comentarios": comentarios},  # por si la ruta ya infiere el id
-    ]
+    return await history_writer.write(order_id, estado, comentarios)
 
-    last_status = None
-    last_body = None
-    saw_404 = True  # asumimos 'no soportado' hasta ver algo distinto a 404
-
-    for path in paths:
-        for body in payloads:
-            try:
-                r = await client.post(path, json=body)
-            except Exception as e:
-                last_status = "EXC"
-                last_body = repr(e)
-                continue
-
-            last_status = r.status_code
-            try:
-                last_body = r.json()
-            except Exception:
-                try:
-                    last_body = (await r.aread()).decode()
-                except Exception:
-                    last_body = str(r)
-
-            if r.status_code in (200, 201):
-                return True, f"historial ok via {path}"
-            if r.status_code != 404:
-                saw_404 = False  # MS3 sí tiene algo en esa ruta, pero falló (4xx/5xx distinto a 404)
-
-    # Si solo vimos 404: historial no existe en MS3 => lo tratamos como opcional
-    if saw_404:
-        return True, "historial no soportado en MS3 (404 en todas las rutas)"
-
-    # Si hubo rutas que respondieron distinto a 404 y ninguna funcionó => devolver False (fallo real)
-    return False, f"fallo historial MS3 (último status {last_status}, body={last_body})"
+def write_history_async(order_id: str, estado: str, comentarios: str) -> bool:
+    """Igual que write_history pero fuera del camino crítico (cola + reintentos); False si la cola está llena."""
+    return history_writer.enqueue(order_id, estado, comentarios)
@@ -0,0 +1,231 @@
+"""
+Registro de métricas en proceso con salida en formato texto de Prometheus.
+El registro en el hot path es una búsqueda en dict + sumas (sin locks: todo corre en el
+event loop); los valores de caches/pools se leen con callbacks solo al hacer scrape.
+"""
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _fmt_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for values, child in self._children.items():
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, values)} {_fmt_value(child.value)}")
+        return lines
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for values, child in self._children.items():
+            acc = 0
+            for bound, n in zip(self.buckets + (float("inf"),), child.counts):
+                acc += n
+                le = f'le="{_fmt_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, values, le)} {acc}")
+            labels = _fmt_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_fmt_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Métrica cuyo valor se calcula al hacer scrape: fn() -> [(label_values, valor), ...]."""
+
+    def __init__(self, name: str, help: str, type: str, labelnames: Iterable[str],
+                 fn: Callable[[], Iterable[tuple[tuple, Optional[float]]]]):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self._fn = fn
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        try:
+            samples = list(self._fn())
+        except Exception:
+            return lines
+        for values, value in samples:
+            if value is None:
+                continue
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, tuple(values))} {_fmt_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, type: str, labelnames: Iterable[str], fn) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, type, labelnames, fn))
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "orq_http_requests_total", "Requests atendidos por ruta, método y status", ("method", "route", "status"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "orq_http_request_duration_seconds", "Latencia de requests por ruta", ("method", "route"))
+HTTP_IN_FLIGHT = REGISTRY.gauge("orq_http_requests_in_flight", "Requests en curso")
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    "orq_upstream_responses_total", "Respuestas de MS1/MS2/MS3 por status (error = excepción)",
+    ("upstream", "method", "status"))
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "orq_upstream_request_duration_seconds", "Latencia de llamadas a MS1/MS2/MS3", ("upstream", "method"))
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: latencia y status por ruta (plantilla de FastAPI, no el path crudo) + requests en curso."""
+
+    def __init__(self, app, exclude: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.exclude = frozenset(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = HTTP_IN_FLIGHT.labels()
+        in_flight.inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            in_flight.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_LATENCY.labels(method, path).observe(elapsed)
+            HTTP_REQUESTS.labels(method, path, str(status)).inc()
@@ -0,0 +1,120 @@
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+
+try:  # HTTP/2 requiere el extra httpx[http2] (paquete h2)
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+@dataclass
+class PoolConfig:
+    """Límites y timeouts del pool de conexiones de un microservicio."""
+    max_connections: int = 100
+    max_keepalive: int = 20
+    keepalive_expiry: float = 5.0
+    http2: bool = False
+    connect_timeout: float = 5.0
+    read_timeout: float = 5.0
+    write_timeout: float = 5.0
+    pool_timeout: float = 5.0
+
+    def build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            http2=self.http2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=self.max_connections or None,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                connect=self.connect_timeout,
+                read=self.read_timeout,
+                write=self.write_timeout,
+                pool=self.pool_timeout,
+            ),
+        )
+
+
+class PoolTelemetry:
+    """
+    Métricas de un pool httpx a partir de la extensión `trace` de httpcore:
+    - espera por una conexión libre (tiempo hasta enviar headers menos el tiempo de conectar)
+    - conexiones nuevas (total y por segundo en la última ventana)
+    Las conexiones activas/ociosas se leen del pool de httpcore al pedir stats.
+    """
+
+    def __init__(self, rate_window: float = 60.0):
+        self.rate_window = rate_window
+        self.requests = 0
+        self.new_connections = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._connects: deque[float] = deque()
+
+    def tracer(self):
+        """Callback `trace` para una petición (extensions={"trace": ...})."""
+        start = time.perf_counter()
+        marks = {"connect": 0.0, "t": 0.0}
+
+        async def trace(event: str, info: dict) -> None:
+            now = time.perf_counter()
+            if event.endswith((".connect_tcp.started", ".start_tls.started")):
+                marks["t"] = now
+            elif event.endswith((".connect_tcp.complete", ".start_tls.complete")):
+                marks["connect"] += now - marks["t"]
+                if event.endswith(".connect_tcp.complete"):
+                    self._new_connection(now)
+            elif event.endswith(".send_request_headers.started"):
+                self._observe_wait(now - start - marks["connect"])
+
+        return trace
+
+    def _new_connection(self, now: float) -> None:
+        self.new_connections += 1
+        self._connects.append(now)
+        cutoff = now - self.rate_window
+        while self._connects and self._connects[0] < cutoff:
+            self._connects.popleft()
+
+    def _observe_wait(self, wait: float) -> None:
+        wait = max(0.0, wait)
+        self.requests += 1
+        self.wait_total += wait
+        if wait > self.wait_max:
+            self.wait_max = wait
+
+    def stats(self, client: Optional[httpx.AsyncClient]) -> dict:
+        now = time.perf_counter()
+        cutoff = now - self.rate_window
+        while self._connects and self._connects[0] < cutoff:
+            self._connects.popleft()
+        active = idle = 0
+        http2 = 0
+        # httpx no expone el pool: leemos el de httpcore de forma defensiva
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        for conn in getattr(pool, "connections", None) or []:
+            try:
+                if conn.is_idle():
+                    idle += 1
+                elif not conn.is_closed():
+                    active += 1
+                if "HTTP/2" in repr(conn):
+                    http2 += 1
+            except Exception:
+                continue
+        return {
+            "active_connections": active,
+            "idle_connections": idle,
+            "http2_connections": http2,
+            "new_connections": self.new_connections,
+            "new_connections_per_s": round(len(self._connects) / self.rate_window, 3),
+            "requests": self.requests,
+            "pool_wait_avg_ms": round(self.wait_total / self.requests * 1000, 3) if self.requests else None,
+            "pool_wait_max_ms": round(self.wait_max * 1000, 3),
+        }
@@ -0,0 +1,147 @@
+"""
+Sondeo de dependencias en segundo plano para `/health?deep=1`.
+
+Cada MS se sondea en su propia tarea, con su `interval` y su `timeout`, mediante una petición
+ligera (un solo recurso) directamente sobre su cliente: un MS lento no atrasa los sondeos de los
+demás, y no pasa por semáforo, singleflight, hedging ni breaker, así el sondeo no compite con el
+tráfico real y sigue midiendo aunque el circuito esté abierto.
+`/health?deep=1` responde al instante con el último estado, p50/p99 de la ventana y el tiempo
+desde el último éxito.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+from app.latency import LatencyWindow
+from app.upstream import Upstream, _ms
+
+
+class DependencyProbe:
+    def __init__(self, upstream: Upstream, path: str, method: str = "GET", interval: float = 10.0,
+                 timeout: float = 1.0, window: int = 60, stale_after: Optional[float] = None):
+        self.upstream = upstream
+        self.path = path
+        self.method = method.upper()
+        self.interval = interval
+        self.timeout = timeout
+        self.stale_after = stale_after if stale_after is not None else 3 * interval
+        self.latency = LatencyWindow(size=window, every=1)
+        self._results: deque[bool] = deque(maxlen=max(1, window))
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Optional[asyncio.Future] = None
+        self.checks = 0
+        self.failures = 0
+        self.last_status: Optional[int] = None
+        self.last_error: Optional[str] = None
+        self.last_check: Optional[float] = None
+        self.last_success: Optional[float] = None
+
+    async def check(self) -> None:
+        # el loop y un /health recién arrancado pueden pedir el mismo sondeo: se comparte
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._check())
+            self._pending.add_done_callback(self._clear_pending)
+        await asyncio.shield(self._pending)
+
+    def _clear_pending(self, fut: asyncio.Future) -> None:
+        self._pending = None
+        if not fut.cancelled():
+            fut.exception()
+
+    async def _check(self) -> None:
+        t0 = time.perf_counter()
+        status, error = None, None
+        try:
+            r = await self.upstream.client.request(self.method, self.upstream.url(self.path), timeout=self.timeout)
+            status = r.status_code
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = repr(e)
+        elapsed = time.perf_counter() - t0
+        # cualquier respuesta < 500 cuenta: un 404 del recurso de prueba también prueba que el MS responde
+        ok = status is not None and status < 500
+        self.checks += 1
+        self.last_check = time.monotonic()
+        self.last_status, self.last_error = status, error
+        self._results.append(ok)
+        if ok:
+            self.last_success = self.last_check
+            self.latency.add(elapsed)
+        else:
+            self.failures += 1
+            if error is None:
+                self.last_error = f"status {status}"
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass  # el error ya quedó en last_error
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.last_success is not None and time.monotonic() - self.last_success <= self.stale_after
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        window = len(self._results)
+        return {
+            "url": self.upstream.url(self.path),
+            "status": self.last_status,
+            "ok": self.healthy,
+            "interval_s": self.interval,
+            "latency_p50_ms": _ms(self.latency.percentile(0.5)),
+            "latency_p99_ms": _ms(self.latency.percentile(0.99)),
+            "success_rate": round(sum(self._results) / window, 3) if window else None,
+            "last_success_s_ago": round(now - self.last_success, 1) if self.last_success is not None else None,
+            "last_check_s_ago": round(now - self.last_check, 1) if self.last_check is not None else None,
+            "last_error": self.last_error,
+            "checks": self.checks,
+            "failures": self.failures,
+        }
+
+
+class DependencyProber:
+    """Agrupa los `DependencyProbe`; cada uno corre en su propia tarea."""
+
+    def __init__(self, probes: dict[str, DependencyProbe]):
+        self.probes = probes
+
+    async def check_unprobed(self) -> None:
+        """Recién arrancado: espera el primer sondeo de las dependencias que aún no tienen ninguno."""
+        pending = [p.check() for p in self.probes.values() if p.checks == 0]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def start(self) -> None:
+        for probe in self.probes.values():
+            probe.start()
+
+    async def stop(self) -> None:
+        await asyncio.gather(*(p.stop() for p in self.probes.values()))
+
+    @property
+    def ready(self) -> bool:
+        return all(p.healthy for p in self.probes.values())
+
+    def stats(self) -> dict:
+        return {name: p.stats() for name, p in self.probes.items()}
@@ -0,0 +1,60 @@
+"""
+Profiler por muestreo para producción (solo admin).
+
+Un hilo aparte toma cada `interval` segundos la pila del hilo del event loop
+(`sys._current_frames`) durante `seconds` segundos, sin instrumentar nada: el costo es una
+lectura de frames por muestra. Devuelve "collapsed stacks" (`raíz;...;hoja cuenta` por línea),
+el formato que consumen flamegraph.pl y speedscope.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+
+class ProfilerBusy(Exception):
+    """Ya hay un perfil en curso en este worker."""
+
+
+class SamplingProfiler:
+    def __init__(self, max_depth: int = 128):
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.last_samples = 0
+
+    def run(self, thread_id: int, seconds: float, interval: float) -> tuple[str, int]:
+        """Bloqueante (correr fuera del loop): (collapsed stacks, muestras)."""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            stacks: Counter = Counter()
+            samples = 0
+            end = time.monotonic() + seconds
+            while time.monotonic() < end:
+                frame = sys._current_frames().get(thread_id)
+                if frame is not None:
+                    stacks[self._collapse(frame)] += 1
+                    samples += 1
+                time.sleep(interval)
+            self.runs += 1
+            self.last_samples = samples
+            return "".join(f"{stack} {n}\n" for stack, n in stacks.most_common()), samples
+        finally:
+            self._lock.release()
+
+    def _collapse(self, frame) -> str:
+        names = []
+        f: Optional[object] = frame
+        while f is not None and len(names) < self.max_depth:
+            code = f.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            f = f.f_back
+        names.reverse()
+        return ";".join(names)
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 # Service URLs (default to localhost; override with env vars if you dockerize)
 MS1_URL = os.getenv("MS1_URL", "http://localhost:8001")  # usuarios
@@ -7,3 +8,176 @@ MS3_URL = os.getenv("MS3_URL", "http://localhost:8003")  # pedidos
 
 REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "5.0"))
 TAX_RATE = float(os.getenv("TAX_RATE", "0.18"))  # IGV example
+
+# Cache de productos (MS2 /productos/{id})
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "30"))  # 0 = desactivada
+PRODUCT_CACHE_STALE_TTL = float(os.getenv("PRODUCT_CACHE_STALE_TTL", "300"))
+PRODUCT_CACHE_NEGATIVE_TTL = float(os.getenv("PRODUCT_CACHE_NEGATIVE_TTL", "10"))
+PRODUCT_CACHE_MAX_ENTRIES = int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", "5000"))
+
+# Endpoints /admin/* (si está vacío quedan deshabilitados: 404)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Cache de validaciones contra MS1 (existencia del usuario, resumen y ids de sus direcciones).
+# Sin stale-while-revalidate: un usuario/dirección borrado no debe seguir validando.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))  # 0 = desactivada
+USER_CACHE_NEGATIVE_TTL = float(os.getenv("USER_CACHE_NEGATIVE_TTL", "5"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+# Token propio del webhook de invalidación que llama MS1 (no hereda ADMIN_TOKEN; vacío = webhook deshabilitado: 404)
+MS1_WEBHOOK_TOKEN = os.getenv("MS1_WEBHOOK_TOKEN", "")
+
+# Índice de categorías (MS2 /categorias) refrescado en background
+CATEGORY_REFRESH_INTERVAL = float(os.getenv("CATEGORY_REFRESH_INTERVAL", "300"))
+
+# Máximo de llamadas concurrentes por microservicio (0 = sin límite)
+MS1_MAX_CONCURRENCY = int(os.getenv("MS1_MAX_CONCURRENCY", "50"))
+MS2_MAX_CONCURRENCY = int(os.getenv("MS2_MAX_CONCURRENCY", "50"))
+MS3_MAX_CONCURRENCY = int(os.getenv("MS3_MAX_CONCURRENCY", "50"))
+
+# Coalescer GETs idénticos en vuelo hacia MS1/MS2/MS3 (singleflight), independiente de la cache
+UPSTREAM_COALESCE = os.getenv("UPSTREAM_COALESCE", "1").lower() not in ("0", "false", "no")
+
+# Micro-batching de productos hacia MS2 (GET {PRODUCT_BULK_PATH}?{PRODUCT_BULK_PARAM}=1,2,3)
+PRODUCT_BATCH_WINDOW_MS = float(os.getenv("PRODUCT_BATCH_WINDOW_MS", "2"))  # 0 = sin batching
+PRODUCT_BATCH_MAX_IDS = int(os.getenv("PRODUCT_BATCH_MAX_IDS", "100"))
+PRODUCT_BULK_PATH = os.getenv("PRODUCT_BULK_PATH", "/productos")
+PRODUCT_BULK_PARAM = os.getenv("PRODUCT_BULK_PARAM", "ids")
+
+# Cotización en lote: carritos procesados a la vez por request
+BATCH_QUOTE_CONCURRENCY = int(os.getenv("BATCH_QUOTE_CONCURRENCY", "64"))
+
+# Historial de pedidos de un usuario (MS3 GET {USER_ORDERS_PATH}?{user}=..&{page}=..&{size}=..)
+USER_ORDERS_PATH = os.getenv("USER_ORDERS_PATH", "/pedidos")
+USER_ORDERS_USER_PARAM = os.getenv("USER_ORDERS_USER_PARAM", "id_usuario")
+USER_ORDERS_PAGE_PARAM = os.getenv("USER_ORDERS_PAGE_PARAM", "page")
+USER_ORDERS_SIZE_PARAM = os.getenv("USER_ORDERS_SIZE_PARAM", "limit")
+USER_ORDERS_PAGE_SIZE = int(os.getenv("USER_ORDERS_PAGE_SIZE", "50"))  # tamaño de página pedido a MS3
+USER_ORDERS_MAX_LIMIT = int(os.getenv("USER_ORDERS_MAX_LIMIT", "100"))
+USER_ORDERS_MAX_PAGES = int(os.getenv("USER_ORDERS_MAX_PAGES", "5"))  # páginas de MS3 por request como máximo
+
+# Pool de conexiones por microservicio: MS{1,2,3}_MAX_CONNECTIONS, _MAX_KEEPALIVE, _KEEPALIVE_EXPIRY,
+# _HTTP2, _CONNECT_TIMEOUT, _READ_TIMEOUT, _WRITE_TIMEOUT, _POOL_TIMEOUT (timeouts por defecto = REQUEST_TIMEOUT)
+def _pool_env(prefix: str) -> dict:
+    def env(name, default):
+        return os.getenv(f"{prefix}_{name}", default)
+    return {
+        "max_connections": int(env("MAX_CONNECTIONS", "100")),
+        "max_keepalive": int(env("MAX_KEEPALIVE", "20")),
+        "keepalive_expiry": float(env("KEEPALIVE_EXPIRY", "5")),
+        "http2": env("HTTP2", "0").lower() in ("1", "true", "yes"),
+        "connect_timeout": float(env("CONNECT_TIMEOUT", str(REQUEST_TIMEOUT))),
+        "read_timeout": float(env("READ_TIMEOUT", str(REQUEST_TIMEOUT))),
+        "write_timeout": float(env("WRITE_TIMEOUT", str(REQUEST_TIMEOUT))),
+        "pool_timeout": float(env("POOL_TIMEOUT", str(REQUEST_TIMEOUT))),
+    }
+
+MS1_POOL = _pool_env("MS1")
+MS2_POOL = _pool_env("MS2")
+MS3_POOL = _pool_env("MS3")
+
+# Circuit breaker por microservicio
+UPSTREAM_BREAKER_ENABLED = os.getenv("UPSTREAM_BREAKER_ENABLED", "1").lower() not in ("0", "false", "no")
+UPSTREAM_BREAKER_WINDOW = int(os.getenv("UPSTREAM_BREAKER_WINDOW", "50"))  # últimas N llamadas
+UPSTREAM_BREAKER_MIN_CALLS = int(os.getenv("UPSTREAM_BREAKER_MIN_CALLS", "20"))
+UPSTREAM_BREAKER_ERROR_RATE = float(os.getenv("UPSTREAM_BREAKER_ERROR_RATE", "0.5"))
+UPSTREAM_BREAKER_SLOW_CALL_MS = float(os.getenv("UPSTREAM_BREAKER_SLOW_CALL_MS", "2000"))
+UPSTREAM_BREAKER_SLOW_RATE = float(os.getenv("UPSTREAM_BREAKER_SLOW_RATE", "0.8"))
+UPSTREAM_BREAKER_OPEN_SECONDS = float(os.getenv("UPSTREAM_BREAKER_OPEN_SECONDS", "10"))
+UPSTREAM_BREAKER_HALF_OPEN_CALLS = int(os.getenv("UPSTREAM_BREAKER_HALF_OPEN_CALLS", "3"))
+
+# Hedging de GETs: segunda petición si la primera supera el percentil observado
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "0").lower() in ("1", "true", "yes")
+UPSTREAM_HEDGE_QUANTILE = float(os.getenv("UPSTREAM_HEDGE_QUANTILE", "0.95"))
+UPSTREAM_HEDGE_MIN_DELAY_MS = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY_MS", "5"))
+
+# Idempotencia (Idempotency-Key): TTL, cotas LRU y SQLite opcional compartido entre workers
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+IDEMPOTENCY_MAX_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BYTES", str(64 * 1024 * 1024)))
+IDEMPOTENCY_SQLITE_PATH = os.getenv("IDEMPOTENCY_SQLITE_PATH", "")  # vacío = solo en memoria
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", str(REQUEST_TIMEOUT * 2)))
+
+# Multi-worker: un worker (líder por flock) publica un snapshot del catálogo de MS2 que el resto
+# lee vía mmap. Con WEB_CONCURRENCY > 1 se activa por defecto en el directorio temporal.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+CATALOG_SNAPSHOT_PATH = os.getenv(
+    "CATALOG_SNAPSHOT_PATH",
+    os.path.join(tempfile.gettempdir(), "orq-catalog.snap") if WEB_CONCURRENCY > 1 else "",
+)
+CATALOG_SNAPSHOT_INTERVAL = float(os.getenv("CATALOG_SNAPSHOT_INTERVAL", "60"))
+CATALOG_SNAPSHOT_MAX_AGE = float(os.getenv("CATALOG_SNAPSHOT_MAX_AGE", str(CATALOG_SNAPSHOT_INTERVAL * 3)))
+CATALOG_PRODUCTS_PATH = os.getenv("CATALOG_PRODUCTS_PATH", "/productos")
+
+# Réplica del catálogo en memoria (un proceso): carga /productos completo y lo refresca en background.
+# Con varios workers el snapshot compartido cumple ese rol y la réplica no se usa.
+CATALOG_REPLICA = os.getenv("CATALOG_REPLICA", "0").lower() in ("1", "true", "yes")
+CATALOG_REPLICA_INTERVAL = float(os.getenv("CATALOG_REPLICA_INTERVAL", "30"))
+CATALOG_REPLICA_MAX_AGE = float(os.getenv("CATALOG_REPLICA_MAX_AGE", str(CATALOG_REPLICA_INTERVAL * 4)))
+CATALOG_REPLICA_DELTA_PARAM = os.getenv("CATALOG_REPLICA_DELTA_PARAM", "")  # p.ej. "updated_since"; vacío = off
+CATALOG_REPLICA_FULL_INTERVAL = float(os.getenv("CATALOG_REPLICA_FULL_INTERVAL", "3600"))
+
+# Invalidaciones de la cache de MS1 difundidas a todos los workers del nodo
+USER_INVALIDATION_PATH = os.getenv(
+    "USER_INVALIDATION_PATH",
+    os.path.join(tempfile.gettempdir(), "orq-ms1-invalidations.log") if WEB_CONCURRENCY > 1 else "",
+)
+
+# Historial en MS3: ruta/payload descubiertos una vez y recordados; escritura opcional en background
+HISTORY_ROUTE_TTL = float(os.getenv("HISTORY_ROUTE_TTL", "3600"))
+HISTORY_UNSUPPORTED_TTL = float(os.getenv("HISTORY_UNSUPPORTED_TTL", "600"))
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "1000"))
+HISTORY_WORKERS = int(os.getenv("HISTORY_WORKERS", "4"))
+HISTORY_RETRIES = int(os.getenv("HISTORY_RETRIES", "3"))
+HISTORY_RETRY_BACKOFF = float(os.getenv("HISTORY_RETRY_BACKOFF", "0.5"))
+
+# /health?deep=1: sondeo de dependencias en segundo plano (petición ligera por MS, timeout corto)
+# Defaults comunes; cada MS puede tener los suyos (HEALTH_PROBE_MS1_INTERVAL, HEALTH_PROBE_MS2_TIMEOUT, ...)
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "10"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "1.0"))
+HEALTH_PROBE_MS1_INTERVAL = float(os.getenv("HEALTH_PROBE_MS1_INTERVAL", str(HEALTH_PROBE_INTERVAL)))
+HEALTH_PROBE_MS2_INTERVAL = float(os.getenv("HEALTH_PROBE_MS2_INTERVAL", str(HEALTH_PROBE_INTERVAL)))
+HEALTH_PROBE_MS3_INTERVAL = float(os.getenv("HEALTH_PROBE_MS3_INTERVAL", str(HEALTH_PROBE_INTERVAL)))
+HEALTH_PROBE_MS1_TIMEOUT = float(os.getenv("HEALTH_PROBE_MS1_TIMEOUT", str(HEALTH_PROBE_TIMEOUT)))
+HEALTH_PROBE_MS2_TIMEOUT = float(os.getenv("HEALTH_PROBE_MS2_TIMEOUT", str(HEALTH_PROBE_TIMEOUT)))
+HEALTH_PROBE_MS3_TIMEOUT = float(os.getenv("HEALTH_PROBE_MS3_TIMEOUT", str(HEALTH_PROBE_TIMEOUT)))
+HEALTH_PROBE_WINDOW = int(os.getenv("HEALTH_PROBE_WINDOW", "60"))  # muestras por dependencia
+HEALTH_PROBE_STALE_AFTER = (  # vacío = 3 × el intervalo de cada dependencia
+    float(os.environ["HEALTH_PROBE_STALE_AFTER"]) if os.getenv("HEALTH_PROBE_STALE_AFTER") else None
+)
+HEALTH_PROBE_METHOD = os.getenv("HEALTH_PROBE_METHOD", "GET")  # HEAD si los MS lo soportan
+HEALTH_PROBE_MS1_PATH = os.getenv("HEALTH_PROBE_MS1_PATH", "/usuarios/1")
+HEALTH_PROBE_MS2_PATH = os.getenv("HEALTH_PROBE_MS2_PATH", "/productos/1")  # no el catálogo completo
+# MS3 usa ObjectId: un id entero sintético puede dar 500, así que se sondea el listado (limit si lo soporta)
+HEALTH_PROBE_MS3_PATH = os.getenv("HEALTH_PROBE_MS3_PATH", "/pedidos?limit=1")
+
+# Deadline de extremo a extremo por request (s; 0 = off). El cliente puede acortarlo con
+# REQUEST_DEADLINE_HEADER (ms); lo que queda se propaga a cada MS en UPSTREAM_DEADLINE_HEADER ("" = no enviar)
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", str(REQUEST_TIMEOUT)))
+REQUEST_DEADLINE_HEADER = os.getenv("REQUEST_DEADLINE_HEADER", "X-Request-Timeout-Ms")
+UPSTREAM_DEADLINE_HEADER = os.getenv("UPSTREAM_DEADLINE_HEADER", REQUEST_DEADLINE_HEADER)
+
+# GET condicional hacia MS1/MS2/MS3 (If-None-Match / If-Modified-Since) cuando envían validadores
+CONDITIONAL_GET = os.getenv("CONDITIONAL_GET", "1").lower() not in ("0", "false", "no")
+CONDITIONAL_MAX_ENTRIES = int(os.getenv("CONDITIONAL_MAX_ENTRIES", "10000"))  # por MS
+
+# Desglose de tiempos: header Server-Timing y log JSON de una fracción de requests (y de los lentos)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1").lower() not in ("0", "false", "no")
+TIMING_LOG_SAMPLE_RATE = float(os.getenv("TIMING_LOG_SAMPLE_RATE", "0.01"))
+TIMING_LOG_SLOW_MS = float(os.getenv("TIMING_LOG_SLOW_MS", "1000"))  # 0 = solo muestreo
+# Profiler por muestreo en GET /admin/profile
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+
+# Control de admisión en /orq/*: límite de requests en proceso y cola acotada por ruta (503 al saturarse)
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1").lower() not in ("0", "false", "no")
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "128"))  # por ruta
+ADMISSION_ROUTE_LIMITS = os.getenv("ADMISSION_ROUTE_LIMITS", "")  # "/orq/cart/price-quote/batch=8,..." (0 = sin límite)
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "256"))
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "500"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+# Modo adaptativo (AIMD) según la latencia p95 observada de los MS
+ADMISSION_ADAPTIVE = os.getenv("ADMISSION_ADAPTIVE", "0").lower() in ("1", "true", "yes")
+ADMISSION_TARGET_LATENCY_MS = float(os.getenv("ADMISSION_TARGET_LATENCY_MS", "250"))
+ADMISSION_MIN_CONCURRENCY = int(os.getenv("ADMISSION_MIN_CONCURRENCY", "4"))
+ADMISSION_ADJUST_INTERVAL = float(os.getenv("ADMISSION_ADJUST_INTERVAL", "1.0"))
+ADMISSION_DECREASE_FACTOR = float(os.getenv("ADMISSION_DECREASE_FACTOR", "0.7"))
@@ -0,0 +1,61 @@
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalescencia de llamadas idénticas en vuelo: mientras una llamada con la misma
+    clave está en curso, los demás llamadores esperan ese mismo resultado (o excepción).
+    - Si un llamador se cancela, los demás siguen esperando la llamada compartida.
+    - Si se cancelan todos, la llamada compartida se cancela.
+    `context` (opcional) es el contexto en el que corre la llamada compartida.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+        self.leaders = 0   # llamadas reales ejecutadas
+        self.shared = 0    # llamadas ahorradas (se unieron a una en vuelo)
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]],
+                 context: Optional[contextvars.Context] = None) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.get_running_loop().create_task(fn(), context=context))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda t, k=key, c=call: self._done(t, k, c))
+            self.leaders += 1
+        else:
+            self.shared += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # nadie más espera: liberar la clave y cancelar la llamada compartida
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _done(self, task: asyncio.Task, key: Hashable, call: _Call) -> None:
+        self._forget(key, call)
+        if not task.cancelled():
+            task.exception()  # marcar como recuperada aunque ya no quede nadie esperando
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.shared}
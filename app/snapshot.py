@@ -0,0 +1,613 @@
+"""
+Snapshot del catálogo de MS2 compartido entre workers de uvicorn (mismo nodo).
+
+Un solo proceso (el que toma el `flock` del archivo `.lock`) descarga `/productos` y las
+categorías, y publica un archivo binario columnar; el resto lo lee vía `mmap` sin copiarlo:
+
+    header | ids int64[n] (ordenados) | precios float64[n] | categoria int64[n] | offsets uint64[n+1]
+           | nombres utf-8 | ids categorías int64[m] | offsets uint64[m+1] | nombres utf-8 | meta JSON
+
+El archivo se reemplaza atómicamente (`os.replace`), así que un lector nunca ve uno a medias.
+Si el líder muere, otro worker toma el lock en el siguiente intento.
+
+`CatalogReplica` es la variante de un solo proceso: las mismas columnas, en memoria (`array`).
+Ambos exponen `CatalogColumns`, con el que se cotizan carritos grandes por índice sin armar un
+dict por producto.
+"""
+import asyncio
+import fcntl
+import json
+import mmap
+import operator
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from itertools import repeat
+from typing import Any, Callable, Iterable, Optional
+
+from app.codec import response_json
+from app.upstream import Upstream
+
+MAGIC = b"ORQCAT01"
+HEADER = struct.Struct("<8sQdQQQQQ")  # magic, seq, created_at, n, m, product_names, category_names, meta
+NO_CATEGORY = -(2 ** 63)
+DENSE_MAX_SPREAD = 4  # índice directo por id si (max_id - min_id) < 4 * productos
+
+Row = tuple[int, float, Optional[int], Optional[str]]  # (id, precio, categoria_id, nombre)
+
+
+def _pad(n: int) -> int:
+    return (8 - n % 8) % 8
+
+
+def _names(values: Iterable[Optional[str]]) -> tuple[array, bytes]:
+    offsets = array("Q", [0])
+    blob = bytearray()
+    for v in values:
+        if v:
+            blob += v.encode()
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+class CatalogColumns:
+    """
+    Catálogo columnar: ids ordenados (int64), precios (float64), categoría por producto (int64,
+    NO_CATEGORY si no tiene) y tablas de nombres (offsets + utf-8). Las columnas son `array`
+    (réplica en memoria) o `memoryview` sobre el mmap del snapshot.
+    """
+
+    ids: Any
+    prices: Any
+    categories: Any
+    name_offsets: Any
+    names: Any
+    cat_ids: Any
+    cat_offsets: Any
+    cat_names: Any
+
+    @classmethod
+    def build(cls, rows: list[Row], categories: dict[int, Optional[str]]) -> "CatalogColumns":
+        rows = sorted(rows, key=lambda r: r[0])
+        c = cls.__new__(cls)
+        c.ids = array("q", (r[0] for r in rows))
+        c.prices = array("d", (r[1] for r in rows))
+        c.categories = array("q", (NO_CATEGORY if r[2] is None else r[2] for r in rows))
+        c.name_offsets, c.names = _names(r[3] for r in rows)
+        cat_items = sorted(categories.items())
+        c.cat_ids = array("q", (k for k, _ in cat_items))
+        c.cat_offsets, c.cat_names = _names(n for _, n in cat_items)
+        return c
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def index(self, pid: int) -> int:
+        i = bisect_left(self.ids, pid)
+        return i if i < len(self.ids) and self.ids[i] == pid else -1
+
+    def _dense(self) -> Optional[tuple[int, array]]:
+        """
+        Si los ids son casi consecutivos (autoincrementales), posición por `id - base` en un
+        array int32: lookup O(1) sin dict. None si el rango es demasiado disperso.
+        """
+        try:
+            return self._positions
+        except AttributeError:
+            pass
+        ids = self.ids
+        n = len(ids)
+        dense = None
+        if n and ids[-1] - ids[0] < DENSE_MAX_SPREAD * n:
+            base = ids[0]
+            pos = array("i", [-1]) * (ids[-1] - base + 1)
+            for i, pid in enumerate(ids):
+                pos[pid - base] = i
+            dense = (base, pos)
+        self._positions = dense
+        return dense
+
+    def locate(self, pids: list[int]) -> list[int]:
+        """Índice de cada id (-1 si no está), sin dicts intermedios."""
+        dense = self._dense()
+        if dense is not None:
+            base, pos = dense
+            size = len(pos)
+            return [pos[p - base] if 0 <= p - base < size else -1 for p in pids]
+        ids = self.ids
+        n = len(ids)
+        found = map(bisect_left, repeat(ids), pids)
+        return [i if i < n and ids[i] == pid else -1 for i, pid in zip(found, pids)]
+
+    def price_lines(self, pids: list[int], qtys: list[float]) -> tuple[list[int], list[float], list[float]]:
+        """(índices, precio unitario, total de línea redondeado a 2); precio 0.0 si el id no está."""
+        idx = self.locate(pids)
+        prices = self.prices
+        unit = [prices[i] if i >= 0 else 0.0 for i in idx]
+        return idx, unit, list(map(round, map(operator.mul, unit, qtys), repeat(2)))
+
+    def name(self, i: int) -> Optional[str]:
+        a, b = self.name_offsets[i], self.name_offsets[i + 1]
+        return str(self.names[a:b], "utf-8") if b > a else None
+
+    def category(self, i: int) -> Optional[int]:
+        cat = self.categories[i]
+        return None if cat == NO_CATEGORY else cat
+
+    def category_map(self) -> dict[int, Optional[str]]:
+        out = {}
+        for j, cid in enumerate(self.cat_ids):
+            a, b = self.cat_offsets[j], self.cat_offsets[j + 1]
+            out[cid] = str(self.cat_names[a:b], "utf-8") if b > a else None
+        return out
+
+    def rows(self) -> list[Row]:
+        return [(self.ids[i], self.prices[i], self.category(i), self.name(i)) for i in range(len(self))]
+
+    def product(self, i: int, keys: dict) -> dict:
+        """Producto `i` como dict con los nombres de campo que usa MS2 (`keys`: alias aprendidos)."""
+        out = {keys.get("id") or "id_producto": self.ids[i], keys.get("precio") or "precio": self.prices[i]}
+        name = self.name(i)
+        if name is not None:
+            out[keys.get("nombre") or "nombre"] = name
+        cat = self.category(i)
+        if cat is not None:
+            cat_key = keys.get("categoria_id") or "categoria_id"
+            if "." in cat_key:
+                outer, inner = cat_key.split(".", 1)
+                out[outer] = {inner: cat}
+            else:
+                out[cat_key] = cat
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes de las columnas de productos (sin la tabla de categorías ni el índice denso)."""
+        return sum(memoryview(col).nbytes for col in (self.ids, self.prices, self.categories, self.name_offsets)) \
+            + len(self.names)
+
+    def footprint(self) -> dict:
+        n = len(self)
+        dense = self._dense()
+        total = self.nbytes + (memoryview(dense[1]).nbytes if dense else 0)
+        return {
+            "products": n,
+            "bytes": total,
+            "bytes_per_100k_skus": round(total / n * 100_000) if n else None,
+        }
+
+
+def write_snapshot(path: str, rows: list[Row], categories: dict[int, Optional[str]], meta: dict) -> int:
+    """Escribe el snapshot en un temporal y lo publica con os.replace. Devuelve el tamaño en bytes."""
+    c = CatalogColumns.build(rows, categories)
+    meta_bytes = json.dumps(meta).encode()
+
+    seq = time.time_ns()
+    parts = [
+        HEADER.pack(MAGIC, seq, time.time(), len(c.ids), len(c.cat_ids), len(c.names), len(c.cat_names),
+                    len(meta_bytes)),
+        c.ids.tobytes(), c.prices.tobytes(), c.categories.tobytes(), c.name_offsets.tobytes(),
+        c.names, b"\0" * _pad(len(c.names)),
+        c.cat_ids.tobytes(), c.cat_offsets.tobytes(), c.cat_names, b"\0" * _pad(len(c.cat_names)),
+        meta_bytes,
+    ]
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        for p in parts:
+            f.write(p)
+        size = f.tell()
+    os.replace(tmp, path)
+    return size
+
+
+class _Mapped(CatalogColumns):
+    """Columnas (memoryview) sobre un snapshot mapeado; nada se copia al abrirlo."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.inode = (st.st_ino, st.st_mtime_ns)
+        self.size = st.st_size
+        magic, self.seq, self.created_at, n, m, names_len, cat_names_len, meta_len = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError("snapshot con formato desconocido")
+        buf = memoryview(self.mm)
+        pos = HEADER.size
+
+        def take(nbytes: int, fmt: Optional[str] = None):
+            nonlocal pos
+            view = buf[pos:pos + nbytes]
+            pos += nbytes
+            return view.cast(fmt) if fmt else view
+
+        self.ids = take(8 * n, "q")
+        self.prices = take(8 * n, "d")
+        self.categories = take(8 * n, "q")
+        self.name_offsets = take(8 * (n + 1), "Q")
+        self.names = take(names_len)
+        pos += _pad(names_len)
+        self.cat_ids = take(8 * m, "q")
+        self.cat_offsets = take(8 * (m + 1), "Q")
+        self.cat_names = take(cat_names_len)
+        pos += _pad(cat_names_len)
+        self.meta = json.loads(bytes(take(meta_len))) if meta_len else {}
+
+
+class CatalogSnapshot:
+    """
+    Lector del snapshot (en cada worker). `get(pid)` devuelve el producto como dict con los
+    mismos nombres de campos que usa MS2 (`meta["keys"]`), o None si no hay snapshot vigente
+    o el id no está (el llamador sigue por la cache / MS2).
+    El archivo se re-mapea si cambió, revisando como mucho cada `check_interval` segundos.
+    """
+
+    def __init__(self, path: str, max_age: float, check_interval: float = 1.0,
+                 on_change: Optional[Callable[["_Mapped"], None]] = None):
+        self.path = path
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.on_change = on_change
+        self._mapped: Optional[_Mapped] = None
+        self._checked_at = 0.0
+        self._keys: dict = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+
+    def _current(self) -> Optional[_Mapped]:
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self.reload()
+        m = self._mapped
+        if m is None or time.time() - m.created_at > self.max_age:
+            return None  # líder caído o MS2 sin responder: no servir datos tan viejos
+        return m
+
+    def reload(self) -> bool:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if self._mapped is not None and self._mapped.inode == (st.st_ino, st.st_mtime_ns):
+            return False
+        try:
+            mapped = _Mapped(self.path)
+        except Exception as e:
+            self.last_error = repr(e)
+            return False
+        self._mapped = mapped
+        self._keys = mapped.meta.get("keys") or {}
+        self.reloads += 1
+        if self.on_change is not None:
+            self.on_change(mapped)
+        return True
+
+    def view(self) -> Optional[CatalogColumns]:
+        """Columnas del snapshot vigente (None si no hay o es demasiado viejo)."""
+        return self._current()
+
+    def get(self, pid: int) -> Optional[dict]:
+        m = self._current()
+        i = m.index(pid) if m is not None else -1
+        if i < 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return m.product(i, self._keys)
+
+    def stats(self) -> dict:
+        fresh = self._current() is not None
+        m = self._mapped
+        return {
+            "path": self.path,
+            "loaded": m is not None,
+            "products": len(m) if m else 0,
+            "categories": len(m.cat_ids) if m else 0,
+            "bytes": m.size if m else 0,
+            "bytes_per_100k_skus": m.footprint()["bytes_per_100k_skus"] if m else None,
+            "age_seconds": round(time.time() - m.created_at, 3) if m else None,
+            "fresh": fresh,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
+
+
+class SnapshotPublisher:
+    """
+    Elección de líder con `flock` no bloqueante sobre `{path}.lock`: el dueño del lock refresca
+    `/productos` cada `interval` segundos (GET condicional) y publica el snapshot.
+    Los demás reintentan el lock cada `interval` por si el líder murió.
+    """
+
+    def __init__(self, path: str, upstream: Upstream, products_path: str, interval: float,
+                 parse: Callable[[Any], list[Row]], categories: Callable[[], dict], meta: Callable[[], dict],
+                 on_leader: Optional[Callable[[], Any]] = None):
+        self.path = path
+        self.upstream = upstream
+        self.products_path = products_path
+        self.interval = interval
+        self._parse = parse
+        self._categories = categories
+        self._meta = meta
+        self.on_leader = on_leader
+        self._lock_fd: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._etag: Optional[str] = None
+        self._rows: Optional[list[Row]] = None
+        self._published_categories: Optional[dict] = None
+        self.publishes = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.last_size = 0
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock_fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._lock_fd is not None:
+            return True
+        fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._lock_fd = fd
+        if self.on_leader is not None:
+            self.on_leader()
+        return True
+
+    async def publish(self) -> bool:
+        """Descarga el catálogo (si cambió) y publica; False si no hubo nada nuevo."""
+        headers = {"If-None-Match": self._etag} if self._etag and self._rows is not None else {}
+        try:
+            r = await self.upstream.get(self.products_path, headers=headers)
+            if r.status_code == 304:
+                self.not_modified += 1
+            elif r.status_code == 200:
+                self._rows = self._parse(response_json(r))
+                self._etag = r.headers.get("ETag")
+            else:
+                raise RuntimeError(f"status {r.status_code}")
+            categories = self._categories()
+            if r.status_code == 304 and categories == self._published_categories:
+                # nada cambió: re-publicar igual si el snapshot envejece (los lectores lo descartan)
+                if self._age() < self.interval * 2:
+                    return False
+            self.last_size = await asyncio.to_thread(write_snapshot, self.path, self._rows, categories, self._meta())
+        except Exception as e:
+            self.errors += 1
+            self.last_error = repr(e)
+            raise
+        self._published_categories = categories
+        self.publishes += 1
+        return True
+
+    def _age(self) -> float:
+        try:
+            with open(self.path, "rb") as f:
+                return time.time() - HEADER.unpack(f.read(HEADER.size))[2]
+        except Exception:
+            return float("inf")
+
+    async def _run(self) -> None:
+        while True:
+            if self.try_acquire():
+                try:
+                    await self.publish()
+                except Exception:
+                    pass  # se reintenta en el próximo ciclo; los lectores siguen con el snapshot anterior
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def stats(self) -> dict:
+        return {
+            "role": "leader" if self.is_leader else "follower",
+            "pid": os.getpid(),
+            "interval": self.interval,
+            "publishes": self.publishes,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_size_bytes": self.last_size if self.is_leader else None,
+        }
+
+
+class CatalogReplica:
+    """
+    Réplica en memoria del catálogo de MS2 para un solo proceso: carga `/productos` completo al
+    arrancar y refresca cada `interval` segundos.
+    - Con `delta_param`, pide solo lo modificado (`?{delta_param}=<epoch>`) y lo aplica en sitio;
+      cada `full_interval` segundos recarga todo para enterarse de las bajas.
+    - Sin delta, GET condicional; si los ids no cambiaron solo se parchean precios/categorías.
+    `view()` devuelve None si la réplica es más vieja que `max_age` (el llamador sigue por cache/MS2).
+    """
+
+    def __init__(self, upstream: Upstream, products_path: str, interval: float, max_age: float,
+                 parse: Callable[[Any], list[Row]], keys: Callable[[], dict],
+                 delta_param: str = "", full_interval: float = 3600.0):
+        self.upstream = upstream
+        self.products_path = products_path
+        self.interval = max(1.0, float(interval))
+        self.max_age = max_age
+        self._parse = parse
+        self._keys = keys
+        self.delta_param = delta_param
+        self.full_interval = full_interval
+        self.columns: Optional[CatalogColumns] = None
+        self._etag: Optional[str] = None
+        self._loaded_at = 0.0      # último refresco correcto (time.time)
+        self._full_at = 0.0        # última carga completa
+        self._since: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.full_loads = 0
+        self.delta_loads = 0
+        self.not_modified = 0
+        self.patched = 0
+        self.rebuilds = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.last_refresh_ms: Optional[float] = None
+
+    def view(self) -> Optional[CatalogColumns]:
+        c = self.columns
+        if c is None or time.time() - self._loaded_at > self.max_age:
+            return None
+        return c
+
+    def get(self, pid: int) -> Optional[dict]:
+        c = self.view()
+        i = c.index(pid) if c is not None else -1
+        if i < 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return c.product(i, self._keys())
+
+    async def refresh(self) -> bool:
+        """Un ciclo de refresco; devuelve True si el catálogo cambió."""
+        started = time.time()
+        full = (self.columns is None or not self.delta_param or self._since is None
+                or started - self._full_at >= self.full_interval)
+        params, headers = {}, {}
+        if not full:
+            params[self.delta_param] = int(self._since)
+        elif self._etag and self.columns is not None:
+            headers["If-None-Match"] = self._etag
+        try:
+            r = await self.upstream.get(self.products_path, params=params or None, headers=headers)
+            if r.status_code == 304:
+                self.not_modified += 1
+                changed = False
+            elif r.status_code == 200:
+                rows = self._parse(response_json(r))
+                if not full and len(rows) < len(self.columns):
+                    changed = self._apply_delta(rows)
+                    self.delta_loads += 1
+                else:
+                    # carga completa (o MS2 ignoró el filtro y devolvió todo)
+                    changed = self._apply_full(rows)
+                    self._etag = r.headers.get("ETag")
+                    self._full_at = started
+                    self.full_loads += 1
+            else:
+                raise RuntimeError(f"status {r.status_code}")
+        except Exception as e:
+            self.errors += 1
+            self.last_error = repr(e)
+            raise
+        self._since = started - 1  # margen por relojes/redondeo: repetir un producto es inocuo
+        self._loaded_at = time.time()
+        self.last_refresh_ms = round((self._loaded_at - started) * 1000, 2)
+        return changed
+
+    def _apply_full(self, rows: list[Row]) -> bool:
+        c = self.columns
+        if c is not None and len(rows) == len(c):
+            rows = sorted(rows, key=lambda r: r[0])
+            if all(r[0] == c.ids[i] for i, r in enumerate(rows)):
+                return self._patch(c, [(i, r) for i, r in enumerate(rows)])
+        self.columns = CatalogColumns.build(rows, {})
+        self.rebuilds += 1
+        return True
+
+    def _apply_delta(self, rows: list[Row]) -> bool:
+        c = self.columns
+        found, new = [], []
+        for r in rows:
+            i = c.index(r[0])
+            (found if i >= 0 else new).append((i, r))
+        if new:
+            merged = {row[0]: row for row in c.rows()}
+            merged.update((r[0], r) for _, r in found + new)
+            self.columns = CatalogColumns.build(list(merged.values()), {})
+            self.rebuilds += 1
+            return True
+        return self._patch(c, found)
+
+    def _patch(self, c: CatalogColumns, updates: list[tuple[int, Row]]) -> bool:
+        """Actualiza en sitio precio/categoría; los nombres (tabla de offsets) se rehacen solo si cambió alguno."""
+        changed = names_changed = 0
+        for i, (_, price, cat, name) in updates:
+            cat = NO_CATEGORY if cat is None else cat
+            if c.prices[i] != price or c.categories[i] != cat:
+                c.prices[i] = price
+                c.categories[i] = cat
+                changed += 1
+            if c.name(i) != (name or None):
+                names_changed += 1
+        if names_changed:
+            by_index = dict(updates)
+            c.name_offsets, c.names = _names(
+                by_index[i][3] if i in by_index else c.name(i) for i in range(len(c)))
+        self.patched += changed + names_changed
+        return bool(changed or names_changed)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception:
+                pass  # se sigue sirviendo la réplica anterior hasta `max_age`
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        c = self.columns
+        return {
+            **(c.footprint() if c is not None else {"products": 0, "bytes": 0, "bytes_per_100k_skus": None}),
+            "loaded": c is not None,
+            "fresh": self.view() is not None,
+            "age_seconds": round(time.time() - self._loaded_at, 3) if c is not None else None,
+            "mode": "delta" if self.delta_param else "conditional",
+            "hits": self.hits,
+            "misses": self.misses,
+            "full_loads": self.full_loads,
+            "delta_loads": self.delta_loads,
+            "not_modified": self.not_modified,
+            "patched": self.patched,
+            "rebuilds": self.rebuilds,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_refresh_ms": self.last_refresh_ms,
+        }
@@ -0,0 +1,41 @@
+import asyncio
+from typing import Any, Awaitable, Hashable
+
+
+class Stages:
+    """
+    Etapas de una orquestación lanzadas en paralelo apenas se conocen sus entradas
+    (especulativas: p.ej. productos de MS2 antes de saber si el usuario existe).
+    `result` espera una etapa; al salir del bloque se cancela lo que siga en vuelo, así una
+    validación que falla (usuario 404) no espera al resto. La latencia del camino feliz es
+    el max() de las etapas, no la suma.
+    """
+
+    def __init__(self):
+        self._tasks: dict[Hashable, asyncio.Future] = {}
+
+    def start(self, name: Hashable, aw: Awaitable[Any]) -> asyncio.Future:
+        task = asyncio.ensure_future(aw)
+        task.add_done_callback(_retrieve)
+        self._tasks[name] = task
+        return task
+
+    async def result(self, name: Hashable) -> Any:
+        return await self._tasks[name]
+
+    def cancel(self) -> None:
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+
+    async def __aenter__(self) -> "Stages":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.cancel()
+
+
+def _retrieve(task: asyncio.Future) -> None:
+    # una etapa descartada que falló no debe loguear "exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
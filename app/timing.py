@@ -0,0 +1,125 @@
+"""
+Desglose de tiempos por request.
+
+`TimingMiddleware` abre un `RequestTimings` por request (contextvar: las tareas hijas lo heredan)
+donde se acumulan las etapas: cada llamada a un MS (por nombre de upstream), parseo de JSON,
+armado de la respuesta y serialización. Se devuelve en `Server-Timing` y, para una fracción
+de los requests (o los lentos), en una línea de log JSON.
+Las etapas concurrentes se suman: `ms2_productos;dur=` puede superar a `total` si hubo llamadas
+en paralelo (`desc` lleva cuántas).
+El trabajo compartido entre requests (singleflight, lotes del loader, refrescos SWR) corre en un
+contexto `detached()`: no suma en el request que lo lanzó y cada llamador registra lo que esperó.
+"""
+import contextvars
+import json
+import logging
+import random
+import sys
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger("orq.timing")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_current: contextvars.ContextVar[Optional["RequestTimings"]] = contextvars.ContextVar("orq_timings", default=None)
+
+
+class RequestTimings:
+    __slots__ = ("started", "stages")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: dict[str, list] = {}  # nombre -> [segundos, llamadas]
+
+    def add(self, name: str, seconds: float) -> None:
+        stage = self.stages.get(name)
+        if stage is None:
+            self.stages[name] = [seconds, 1]
+        else:
+            stage[0] += seconds
+            stage[1] += 1
+
+    def header(self, total: float) -> str:
+        parts = [f'{name};dur={s * 1000:.2f};desc="{n}"' for name, (s, n) in self.stages.items()]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+    def as_dict(self) -> dict:
+        return {name: {"ms": round(s * 1000, 3), "n": n} for name, (s, n) in self.stages.items()}
+
+
+def record(name: str, seconds: float) -> None:
+    """Suma `seconds` a la etapa `name` del request en curso (no-op fuera de un request)."""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+def detached(ctx: Optional[contextvars.Context] = None) -> contextvars.Context:
+    """Contexto (por defecto, copia del actual) sin `RequestTimings`, para tareas compartidas entre requests."""
+    ctx = ctx if ctx is not None else contextvars.copy_context()
+    ctx.run(_current.set, None)
+    return ctx
+
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - t0)
+
+
+class TimingMiddleware:
+    """Middleware ASGI: `Server-Timing` en la respuesta y log muestreado de las etapas."""
+
+    def __init__(self, app, header: bool = True, sample_rate: float = 0.0, slow_ms: float = 0.0,
+                 exclude=("/metrics", "/health", "/admin/profile")):
+        self.app = app
+        self.header = header
+        self.sample_rate = sample_rate
+        self.slow = slow_ms / 1000.0 if slow_ms > 0 else None
+        self.exclude = frozenset(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings()
+        token = _current.set(timings)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.header:
+                    total = time.perf_counter() - timings.started
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", timings.header(total).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            elapsed = time.perf_counter() - timings.started
+            if (self.sample_rate > 0 and random.random() < self.sample_rate) or \
+                    (self.slow is not None and elapsed >= self.slow):
+                route = scope.get("route")
+                logger.info(json.dumps({
+                    "event": "request_timing",
+                    "method": scope["method"],
+                    "route": getattr(route, "path", None) or scope["path"],
+                    "status": status,
+                    "total_ms": round(elapsed * 1000, 3),
+                    "stages": timings.as_dict(),
+                }))
@@ -0,0 +1,248 @@
+import asyncio
+import time
+from typing import Optional
+
+import httpx
+
+from app import deadline, timing
+from app.breaker import CircuitBreaker
+from app.latency import LatencyWindow
+from app.metrics import UPSTREAM_LATENCY, UPSTREAM_RESPONSES
+from app.pool import PoolConfig, PoolTelemetry, HTTP2_AVAILABLE
+from app.singleflight import SingleFlight
+
+
+class UpstreamError(Exception):
+    """Respuesta no exitosa (distinta de 200/404) de un microservicio."""
+    def __init__(self, status_code: int):
+        super().__init__(f"upstream status {status_code}")
+        self.status_code = status_code
+
+
+class Upstream:
+    """
+    Microservicio consumido (MS1/MS2/MS3): base URL, pool de conexiones propio
+    (un MS lento no ocupa los slots de los demás) y límite de concurrencia.
+    El semáforo acota cuántas llamadas simultáneas se abren contra ese servicio
+    (p.ej. un pedido de 200 líneas no abre 200 sockets a MS2). `max_concurrency <= 0` = sin límite.
+    Con `coalesce`, los GET idénticos en vuelo comparten una sola llamada (singleflight).
+    Con `breaker`, se falla rápido (CircuitOpenError) mientras el MS está degradado.
+    Con `hedge_quantile`, un GET que tarda más que ese percentil observado dispara una
+    segunda petición idéntica y se queda con la primera que responda.
+    Dentro de un `deadline.scope`, cada llamada usa solo el tiempo que le queda al request
+    (timeout recortado y header `deadline_header` en ms hacia el MS).
+    """
+
+    def __init__(self, name: str, base_url: str, max_concurrency: int = 0, coalesce: bool = True,
+                 pool: Optional[PoolConfig] = None, breaker: Optional[CircuitBreaker] = None,
+                 hedge_quantile: Optional[float] = None, hedge_min_delay: float = 0.005,
+                 hedge_min_samples: int = 20, deadline_header: Optional[str] = None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = int(max_concurrency)
+        self._sem: Optional[asyncio.Semaphore] = (
+            asyncio.Semaphore(self.max_concurrency) if self.max_concurrency > 0 else None
+        )
+        self.pool = pool or PoolConfig()
+        self.pool_telemetry = PoolTelemetry()
+        self.client: Optional[httpx.AsyncClient] = None
+        self._flight: Optional[SingleFlight] = SingleFlight() if coalesce else None
+        self.breaker = breaker
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.deadline_header = deadline_header
+        self.latency = LatencyWindow()
+        self.in_flight = 0
+        self.waiting = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def open(self) -> None:
+        if self.client is None:
+            self.client = self.pool.build_client()
+
+    async def aclose(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        breaker = self.breaker
+        if breaker is not None:
+            try:
+                breaker.acquire()  # CircuitOpenError si está abierto
+            except Exception:
+                UPSTREAM_RESPONSES.labels(self.name, method, "circuit_open").inc()
+                raise
+        try:
+            if self._sem is None:
+                return await self._dispatch(method, path, **kwargs)
+            self.waiting += 1
+            try:
+                await self._sem.acquire()
+            finally:
+                self.waiting -= 1
+            try:
+                return await self._dispatch(method, path, **kwargs)
+            finally:
+                self._sem.release()
+        finally:
+            if breaker is not None:
+                breaker.release()
+
+    async def _dispatch(self, method: str, path: str, **kwargs) -> httpx.Response:
+        delay = self._hedge_delay() if method == "GET" else None
+        if delay is None:
+            return await self._attempt(method, path, **kwargs)
+        return await self._hedged(delay, method, path, **kwargs)
+
+    def _hedge_delay(self) -> Optional[float]:
+        if self.hedge_quantile is None or len(self.latency) < self.hedge_min_samples:
+            return None
+        if self.breaker is not None and self.breaker.state != CircuitBreaker.CLOSED:
+            return None  # no duplicar carga sobre un MS degradado
+        return max(self.hedge_min_delay, self.latency.percentile(self.hedge_quantile))
+
+    async def _hedged(self, delay: float, method: str, path: str, **kwargs) -> httpx.Response:
+        attempts = [asyncio.ensure_future(self._attempt(method, path, **kwargs))]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if done:
+                return attempts[0].result()
+            self.hedges += 1
+            attempts.append(asyncio.ensure_future(self._attempt(method, path, **kwargs)))
+            pending = set(attempts)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        if t is attempts[1]:
+                            self.hedge_wins += 1
+                        return t.result()
+                    error = t.exception()
+            raise error
+        finally:
+            for t in attempts:
+                if not t.done():
+                    t.cancel()
+
+    async def _attempt(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Una petición real: alimenta el breaker y la ventana de latencias."""
+        t0 = time.perf_counter()
+        try:
+            r = await self._send(method, path, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except deadline.DeadlineExceeded:
+            # se agotó el presupuesto del request, no el timeout del MS: no cuenta para el breaker
+            UPSTREAM_RESPONSES.labels(self.name, method, "deadline").inc()
+            timing.record(self.name, time.perf_counter() - t0)
+            raise
+        except Exception:
+            if self.breaker is not None:
+                self.breaker.record(False, time.perf_counter() - t0)
+            UPSTREAM_RESPONSES.labels(self.name, method, "error").inc()
+            timing.record(self.name, time.perf_counter() - t0)
+            raise
+        elapsed = time.perf_counter() - t0
+        timing.record(self.name, elapsed)
+        UPSTREAM_LATENCY.labels(self.name, method).observe(elapsed)
+        UPSTREAM_RESPONSES.labels(self.name, method, str(r.status_code)).inc()
+        ok = r.status_code < 500
+        if self.breaker is not None:
+            self.breaker.record(ok, elapsed)
+        if ok:
+            self.latency.add(elapsed)
+        return r
+
+    async def _send(self, method: str, path: str, **kwargs) -> httpx.Response:
+        left = deadline.remaining()
+        clipped = False
+        if left is not None:
+            if left <= 0:
+                raise deadline.DeadlineExceeded()
+            phases = {k: getattr(self.client.timeout, k) for k in ("connect", "read", "write", "pool")}
+            clipped = any(t is None or t > left for t in phases.values())
+            if clipped:
+                kwargs["timeout"] = httpx.Timeout(**{k: left if t is None else min(t, left) for k, t in phases.items()})
+            if self.deadline_header:
+                kwargs["headers"] = {**(kwargs.get("headers") or {}), self.deadline_header: str(int(left * 1000))}
+        self.in_flight += 1
+        try:
+            extensions = dict(kwargs.pop("extensions", None) or {})
+            extensions.setdefault("trace", self.pool_telemetry.tracer())
+            return await self.client.request(method, self.url(path), extensions=extensions, **kwargs)
+        except httpx.TimeoutException:
+            if clipped and deadline.expired():
+                raise deadline.DeadlineExceeded() from None
+            raise
+        finally:
+            self.in_flight -= 1
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        key = self._flight_key(path, kwargs) if self._flight is not None else None
+        if key is None:
+            return await self.request("GET", path, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return await self._flight.do(key, lambda: self.request("GET", path, **kwargs),
+                                         context=timing.detached())
+        except deadline.DeadlineExceeded:
+            if deadline.expired():
+                raise
+        finally:
+            # la llamada compartida no suma en ningún request: cada llamador registra lo que esperó
+            timing.record(self.name, time.perf_counter() - t0)
+        # venció el deadline de quien lideraba la llamada compartida, no el nuestro
+        return await self.request("GET", path, **kwargs)
+
+    @staticmethod
+    def _flight_key(path: str, kwargs: dict):
+        # solo se coalescen GET cuyos argumentos identifican la petición (headers/params)
+        if set(kwargs) - {"headers", "params"}:
+            return None
+        try:
+            return (
+                path,
+                tuple(sorted((kwargs.get("headers") or {}).items())),
+                tuple(sorted((kwargs.get("params") or {}).items())),
+            )
+        except (TypeError, AttributeError):
+            return None
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            "url": self.base_url,
+            "max_concurrency": self.max_concurrency or None,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "latency_p50_ms": _ms(self.latency.percentile(0.5)),
+            "latency_p95_ms": _ms(self.latency.percentile(0.95)),
+            "breaker": self.breaker.stats() if self.breaker is not None else None,
+            "hedging": {
+                "enabled": self.hedge_quantile is not None,
+                "delay_ms": _ms(self._hedge_delay()),
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+            },
+            "singleflight": self._flight.stats() if self._flight is not None else None,
+            "pool": {
+                "max_connections": self.pool.max_connections,
+                "max_keepalive": self.pool.max_keepalive,
+                "http2": self.pool.http2 and HTTP2_AVAILABLE,
+                "http2_requested_but_unavailable": self.pool.http2 and not HTTP2_AVAILABLE,
+                **self.pool_telemetry.stats(self.client),
+            },
+        }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 3) if seconds is not None else None
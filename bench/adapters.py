@@ -0,0 +1,111 @@
+"""
+Micro-benchmark de extracción de campos de un producto de MS2 (nombre, precio, categoría) por
+variante de esquema: `pick()` + `extract_category_id` previos vs los adaptadores aprendidos.
+
+    python -m bench.adapters --products 1000 --number 200
+    python -m bench.adapters --check      # sale con 1 si el adaptador es más lento que pick()
+"""
+import argparse
+import random
+import sys
+import timeit
+from typing import Any, Optional
+
+from app.adapters import SchemaAdapter
+from bench.fakes import SCHEMAS, FakeConfig, _product
+
+
+# --- versión previa (pick por llamada), copiada tal cual para comparar ---
+def pick(d: dict, *keys: str, default=None):
+    for k in keys:
+        if k in d and d[k] is not None:
+            return d[k]
+    return default
+
+
+def extract_category_id(product: dict) -> Optional[int]:
+    cid = pick(product, "categoria_id", "id_categoria", "category_id", "categoriaId")
+    if cid is not None:
+        try:
+            return int(cid)
+        except Exception:
+            pass
+    cat_obj = pick(product, "categoria", "category")
+    if isinstance(cat_obj, dict):
+        nested_id = pick(cat_obj, "id", "id_categoria", "categoria_id")
+        try:
+            return int(nested_id)
+        except Exception:
+            return None
+    return None
+
+
+def by_pick(p: dict) -> tuple[Any, Any, Optional[int]]:
+    return pick(p, "nombre", "name"), pick(p, "precio", "price", "valor"), extract_category_id(p)
+
+
+def adapter() -> SchemaAdapter:
+    # mismos alias que PRODUCT en app/main.py (sin importar la app entera)
+    return SchemaAdapter(
+        "ms2_producto",
+        nombre=("nombre", "name"),
+        precio=("precio", "price", "valor"),
+        categoria_id=("categoria_id", "id_categoria", "category_id", "categoriaId",
+                      ("categoria", "id"), ("categoria", "id_categoria"), ("categoria", "categoria_id"),
+                      ("category", "id"), ("category", "id_categoria"), ("category", "categoria_id")),
+    )
+
+
+def products(schema: str, n: int) -> list[dict]:
+    cfg = FakeConfig(schema=schema, catalog=n)
+    rng = random.Random(cfg.seed)
+    return [_product(pid, cfg, rng) for pid in range(1, n + 1)]
+
+
+def measure(schema: str, n: int, number: int) -> tuple[float, float]:
+    """(µs por producto con pick, µs por producto con el adaptador)."""
+    items = products(schema, n)
+    schema_adapter = adapter()
+    nombre, precio, categoria_id = schema_adapter.nombre, schema_adapter.precio, schema_adapter.categoria_id
+
+    def by_adapter(p: dict):
+        return nombre(p), precio(p), categoria_id.as_int(p)
+
+    assert [by_pick(p) for p in items] == [by_adapter(p) for p in items]
+
+    def run_pick():
+        for p in items:
+            by_pick(p)
+
+    def run_adapter():
+        for p in items:
+            by_adapter(p)
+
+    per_item = number * len(items)
+    t_pick = min(timeit.repeat(run_pick, number=number, repeat=5)) / per_item * 1e6
+    t_adapter = min(timeit.repeat(run_adapter, number=number, repeat=5)) / per_item * 1e6
+    return t_pick, t_adapter
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Costo por producto de leer nombre/precio/categoría")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--check", action="store_true", help="exit 1 si el adaptador es más lento que pick()")
+    args = parser.parse_args()
+
+    print(f"{args.products} productos x {args.number} iteraciones")
+    print(f"{'esquema':<10} {'pick (µs)':>10} {'adaptador (µs)':>15} {'x':>6}")
+    slower = []
+    for schema in SCHEMAS:
+        t_pick, t_adapter = measure(schema, args.products, args.number)
+        print(f"{schema:<10} {t_pick:>10.2f} {t_adapter:>15.2f} {t_pick / t_adapter:>6.2f}")
+        if t_adapter > t_pick:
+            slower.append(schema)
+    if args.check and slower:
+        print(f"adaptador más lento que pick() en: {', '.join(slower)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
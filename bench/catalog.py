@@ -0,0 +1,84 @@
+"""
+Micro-benchmark de la réplica columnar del catálogo (`CatalogColumns`).
+
+- memoria: bytes de las columnas para `--skus` productos (y por 100k SKUs)
+- precio de un carrito de `--lines` líneas: un dict por producto leído de la TTLCache caliente
+  (como `compute_quote` sin catálogo local) vs `price_lines` sobre las columnas
+
+    python -m bench.catalog --skus 100000 --lines 500
+"""
+import argparse
+import asyncio
+import random
+import sys
+import timeit
+
+from app.adapters import SchemaAdapter
+from app.cache import TTLCache
+from app.snapshot import CatalogColumns
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Réplica columnar del catálogo")
+    parser.add_argument("--skus", type=int, default=100_000)
+    parser.add_argument("--lines", type=int, default=500)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    rows = [(pid, round(rng.uniform(1, 500), 2), pid % 40 + 1, f"Producto {pid}") for pid in range(1, args.skus + 1)]
+    columns = CatalogColumns.build(rows, {})
+    as_dicts = {pid: {"id_producto": pid, "precio": price, "categoria_id": cat, "nombre": name}
+                for pid, price, cat, name in rows}
+    dict_bytes = sys.getsizeof(as_dicts) + sum(sys.getsizeof(d) + sum(sys.getsizeof(v) for v in d.values())
+                                              for d in as_dicts.values())
+
+    product = SchemaAdapter("ms2_producto", precio=("precio", "price"), nombre=("nombre", "name"),
+                            categoria_id=("categoria_id", "category_id"))
+    pids = [rng.randint(1, args.skus) for _ in range(args.lines)]
+    qtys = [rng.randint(1, 9) for _ in range(args.lines)]
+
+    cache = TTLCache("bench", max_entries=args.skus, ttl=3600)
+    for pid, p in as_dicts.items():
+        cache.set(pid, p)
+
+    async def load(pid):
+        return as_dicts.get(pid)
+
+    async def fetch(unique):
+        return await asyncio.gather(*(cache.get_or_load(pid, load) for pid in unique))
+
+    loop = asyncio.new_event_loop()
+
+    def per_item():
+        unique = list(dict.fromkeys(pids))
+        found = dict(zip(unique, loop.run_until_complete(fetch(unique))))
+        subtotal = 0.0
+        for pid, qty in zip(pids, qtys):
+            p = found[pid]
+            product.nombre(p)
+            product.categoria_id(p)
+            subtotal += round(float(product.precio(p, 0.0)) * qty, 2)
+        return subtotal
+
+    def columnar():
+        idx, unit, totals = columns.price_lines(pids, qtys)
+        for i in idx:
+            columns.name(i)
+            columns.category(i)
+        return sum(totals)
+
+    assert abs(per_item() - columnar()) < 1e-6
+    fp = columns.footprint()
+    print(f"{args.skus} SKUs: columnas {fp['bytes']} bytes ({fp['bytes_per_100k_skus']} por 100k SKUs); "
+          f"dicts ~{dict_bytes} bytes")
+    n = args.number
+    t_dict = min(timeit.repeat(per_item, number=n, repeat=3))
+    t_cols = min(timeit.repeat(columnar, number=n, repeat=3))
+    print(f"carrito de {args.lines} líneas: dicts {t_dict / n * 1e6:.1f} µs, columnas {t_cols / n * 1e6:.1f} µs "
+          f"(x{t_dict / t_cols:.1f})")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
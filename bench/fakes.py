@@ -0,0 +1,323 @@
+"""
+Stand-ins de MS1 (usuarios), MS2 (productos) y MS3 (pedidos) para el benchmark.
+Un solo proceso asyncio levanta los tres en puertos consecutivos; no necesitan red externa.
+
+- Latencia fija + jitter, tasa de errores 5xx y tamaño de catálogo configurables.
+- `schema` elige los nombres de campos que devuelve cada MS (todas son variantes que
+  `pick()` del orquestador admite): canonical | alt | english | mixed (rota por entidad).
+- `GET /_stats` y `POST /_reset` en cada puerto exponen/reinician el conteo de llamadas.
+
+    python -m bench.fakes --port 9101 --catalog 2000 --latency-ms 5 --schema mixed
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+from collections import Counter
+from dataclasses import dataclass, asdict
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+SCHEMAS = ("canonical", "alt", "english", "mixed")
+
+
+@dataclass
+class FakeConfig:
+    catalog: int = 2000          # productos en MS2
+    categories: int = 20
+    users: int = 200
+    addresses: int = 3           # direcciones por usuario
+    orders: int = 500            # pedidos en MS3
+    order_lines: int = 20        # líneas por pedido
+    latency_ms: float = 5.0
+    jitter_ms: float = 2.0
+    error_rate: float = 0.0      # fracción de respuestas 500 (solo rutas de datos)
+    schema: str = "canonical"
+    bulk: bool = True            # MS2 soporta GET /productos?ids=1,2,3
+    etags: bool = False          # ETag + 304 en los GET de un recurso (usuario, producto, pedido)
+    seed: int = 42
+
+
+def order_id(k: int) -> str:
+    return f"ord-{k}"
+
+
+def order_owner(k: int, cfg: FakeConfig) -> int:
+    return k % cfg.users + 1
+
+
+def _variant(cfg: FakeConfig, n: int) -> str:
+    if cfg.schema == "mixed":
+        return SCHEMAS[n % 3]
+    return cfg.schema
+
+
+# --- constructores de payload por variante de esquema ---
+def _product(pid: int, cfg: FakeConfig, rng: random.Random) -> dict:
+    price = round(rng.uniform(1, 500), 2)
+    cat = pid % cfg.categories + 1
+    v = _variant(cfg, pid)
+    if v == "alt":
+        return {"producto_id": pid, "name": f"Producto {pid}", "price": price, "id_categoria": cat, "stock": 10}
+    if v == "english":
+        return {"id": pid, "name": f"Product {pid}", "valor": price, "category": {"id": cat}, "stock": 10}
+    return {"id_producto": pid, "nombre": f"Producto {pid}", "precio": price, "categoria_id": cat, "stock": 10}
+
+
+def _category(cid: int, cfg: FakeConfig) -> dict:
+    v = _variant(cfg, cid)
+    if v == "alt":
+        return {"categoria_id": cid, "categoria_nombre": f"Categoría {cid}"}
+    if v == "english":
+        return {"id": cid, "name": f"Category {cid}"}
+    return {"id_categoria": cid, "nombre_categoria": f"Categoría {cid}"}
+
+
+def _user(uid: int, cfg: FakeConfig) -> dict:
+    if _variant(cfg, uid) == "english":
+        return {"id": uid, "name": f"User {uid}", "email": f"u{uid}@x.pe", "phone": "999"}
+    return {"id_usuario": uid, "nombre": f"Usuario {uid}", "correo": f"u{uid}@x.pe", "telefono": "999"}
+
+
+def _addresses(uid: int, cfg: FakeConfig):
+    v = _variant(cfg, uid)
+    key = {"alt": "direccion_id", "english": "id"}.get(v, "id_direccion")
+    items = [{key: a, "direccion": f"Calle {a}", "ciudad": "Lima"} for a in range(1, cfg.addresses + 1)]
+    return {"data": items} if v == "english" else items
+
+
+def _order(k: int, cfg: FakeConfig, products: dict, rng: random.Random) -> dict:
+    uid = order_owner(k, cfg)
+    pids = rng.sample(range(1, cfg.catalog + 1), min(cfg.order_lines, cfg.catalog))
+    v = _variant(cfg, k)
+    lines, total = [], 0.0
+    for pid in pids:
+        qty = rng.randint(1, 3)
+        price = _price_of(products[pid])
+        total += qty * price
+        if v == "alt":
+            lines.append({"producto_id": pid, "qty": qty, "precio": price})
+        elif v == "english":
+            lines.append({"product_id": pid, "quantity": qty, "unit_price": price})
+        else:
+            lines.append({"id_producto": pid, "cantidad": qty, "precio_unitario": price})
+    total = round(total * 1.18, 2)
+    if v == "alt":
+        return {"_id": order_id(k), "usuario_id": uid, "status": "pendiente", "fecha": "2025-01-01",
+                "monto_total": total, "items": lines}
+    if v == "english":
+        return {"_id": order_id(k), "user_id": uid, "status": "pending", "createdAt": "2025-01-01",
+                "total_pedido": total, "items": lines}
+    return {"_id": order_id(k), "id_usuario": uid, "estado": "pendiente", "fecha_pedido": "2025-01-01",
+            "total": total, "productos": lines}
+
+
+def _price_of(p: dict) -> float:
+    for k in ("precio", "price", "valor"):
+        if k in p:
+            return p[k]
+    return 0.0
+
+
+class FakeServices:
+    """Datos deterministas (semilla) + las tres apps ASGI."""
+
+    def __init__(self, cfg: FakeConfig):
+        self.cfg = cfg
+        rng = random.Random(cfg.seed)
+        self._rng = random.Random(cfg.seed + 1)
+        self.products = {pid: _product(pid, cfg, rng) for pid in range(1, cfg.catalog + 1)}
+        self.categories = [_category(c, cfg) for c in range(1, cfg.categories + 1)]
+        self.orders = {order_id(k): _order(k, cfg, self.products, rng) for k in range(cfg.orders)}
+        # listados pre-serializados: /productos con 10k SKUs no debe medir el json.dumps del fake
+        self._products_body = json.dumps(list(self.products.values())).encode()
+        self._categories_body = json.dumps(self.categories).encode()
+        self._orders_body = json.dumps(list(self.orders.values())[:50]).encode()
+        self.orders_by_user: dict[int, list] = {}
+        for k, o in enumerate(self.orders.values()):
+            self.orders_by_user.setdefault(order_owner(k, cfg), []).append(o)
+        self.calls = {name: Counter() for name in ("ms1", "ms2", "ms3")}
+
+    # --- utilidades ---
+    async def _delay(self) -> bool:
+        """Simula latencia; devuelve True si esta llamada debe fallar con 500."""
+        cfg = self.cfg
+        d = cfg.latency_ms + (self._rng.uniform(-cfg.jitter_ms, cfg.jitter_ms) if cfg.jitter_ms else 0.0)
+        if d > 0:
+            await asyncio.sleep(d / 1000.0)
+        return cfg.error_rate > 0 and self._rng.random() < cfg.error_rate
+
+    @staticmethod
+    def _json(obj, status: int = 200, raw: bytes = None) -> Response:
+        body = raw if raw is not None else json.dumps(obj).encode()
+        return Response(body, status_code=status, media_type="application/json")
+
+    def _resource(self, request: Request, obj) -> Response:
+        """GET de un recurso; con `etags`, ETag del body y 304 si el cliente ya lo tiene."""
+        body = json.dumps(obj).encode()
+        if not self.cfg.etags:
+            return self._json(None, raw=body)
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        resp = self._json(None, raw=body)
+        resp.headers["ETag"] = etag
+        return resp
+
+    def _counted(self, service: str, handler):
+        async def endpoint(request: Request):
+            self.calls[service][f"{request.method} {request.scope['route_name']}"] += 1
+            self.calls[service]["total"] += 1
+            if await self._delay():
+                return self._json({"detail": "fallo simulado"}, 500)
+            return await handler(request)
+        return endpoint
+
+    def _admin_routes(self, service: str) -> list:
+        async def stats(request: Request):
+            return self._json(dict(self.calls[service]))
+
+        async def reset(request: Request):
+            self.calls[service].clear()
+            return self._json({})
+
+        return [Route("/_stats", stats), Route("/_reset", reset, methods=["POST"])]
+
+    def _app(self, service: str, routes: list) -> Starlette:
+        wrapped = []
+        for path, handler, methods in routes:
+            ep = self._counted(service, handler)
+            wrapped.append(Route(path, _tag(ep, path), methods=methods))
+        return Starlette(routes=wrapped + self._admin_routes(service))
+
+    # --- MS1 ---
+    def ms1(self) -> Starlette:
+        cfg = self.cfg
+
+        async def user(request: Request):
+            uid = int(request.path_params["uid"])
+            if not 1 <= uid <= cfg.users:
+                return self._json({"detail": "Usuario no encontrado"}, 404)
+            return self._resource(request, _user(uid, cfg))
+
+        async def addresses(request: Request):
+            uid = int(request.path_params["uid"])
+            if not 1 <= uid <= cfg.users:
+                return self._json({"detail": "Usuario no encontrado"}, 404)
+            return self._resource(request, _addresses(uid, cfg))
+
+        return self._app("ms1", [
+            ("/usuarios/{uid:int}", user, ["GET"]),
+            ("/direcciones/{uid:int}", addresses, ["GET"]),
+        ])
+
+    # --- MS2 ---
+    def ms2(self) -> Starlette:
+        async def product(request: Request):
+            p = self.products.get(int(request.path_params["pid"]))
+            if p is None:
+                return self._json({"detail": "Producto no encontrado"}, 404)
+            return self._resource(request, p)
+
+        async def products(request: Request):
+            ids = request.query_params.get("ids")
+            if ids and self.cfg.bulk:
+                found = [self.products[int(i)] for i in ids.split(",") if i.isdigit() and int(i) in self.products]
+                return self._json(found)
+            return self._json(None, raw=self._products_body)
+
+        async def categories(request: Request):
+            if request.headers.get("if-none-match") == '"cats-v1"':
+                return Response(status_code=304)
+            resp = self._json(None, raw=self._categories_body)
+            resp.headers["ETag"] = '"cats-v1"'
+            return resp
+
+        return self._app("ms2", [
+            ("/productos/{pid:int}", product, ["GET"]),
+            ("/productos", products, ["GET"]),
+            ("/categorias", categories, ["GET"]),
+        ])
+
+    # --- MS3 ---
+    def ms3(self) -> Starlette:
+        async def order(request: Request):
+            o = self.orders.get(request.path_params["oid"])
+            if o is None:
+                return self._json({"detail": "Pedido no encontrado"}, 404)
+            return self._resource(request, o)
+
+        async def orders(request: Request):
+            q = request.query_params
+            uid = q.get("id_usuario", "")
+            if not uid.isdigit():
+                return self._json(None, raw=self._orders_body)
+            # GET /pedidos?id_usuario=&page=&limit= (historial paginado)
+            page, limit = int(q.get("page", "1")), int(q.get("limit", "50"))
+            return self._json(self.orders_by_user.get(int(uid), [])[(page - 1) * limit:page * limit])
+
+        async def history(request: Request):
+            return self._json({"ok": True}, 201)
+
+        return self._app("ms3", [
+            ("/pedidos/{oid}", order, ["GET"]),
+            ("/pedidos", orders, ["GET"]),
+            ("/historial", history, ["POST"]),
+        ])
+
+
+def _tag(endpoint, path: str):
+    """Guarda la plantilla de ruta en el scope para contar por ruta y no por path crudo."""
+    async def tagged(request: Request):
+        request.scope["route_name"] = path
+        return await endpoint(request)
+    return tagged
+
+
+async def serve(cfg: FakeConfig, port: int, host: str = "127.0.0.1") -> None:
+    import uvicorn
+
+    fakes = FakeServices(cfg)
+    servers = []
+    for offset, app in enumerate((fakes.ms1(), fakes.ms2(), fakes.ms3())):
+        config = uvicorn.Config(app, host=host, port=port + offset, log_level="warning",
+                                access_log=False, lifespan="off")
+        servers.append(uvicorn.Server(config))
+    await asyncio.gather(*(s.serve() for s in servers))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    d = FakeConfig()
+    parser.add_argument("--catalog", type=int, default=d.catalog, help="productos en MS2")
+    parser.add_argument("--categories", type=int, default=d.categories)
+    parser.add_argument("--users", type=int, default=d.users)
+    parser.add_argument("--addresses", type=int, default=d.addresses, help="direcciones por usuario")
+    parser.add_argument("--orders", type=int, default=d.orders)
+    parser.add_argument("--order-lines", type=int, default=d.order_lines)
+    parser.add_argument("--latency-ms", type=float, default=d.latency_ms, help="latencia media de cada MS")
+    parser.add_argument("--jitter-ms", type=float, default=d.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=d.error_rate, help="fracción de 500 (0..1)")
+    parser.add_argument("--schema", choices=SCHEMAS, default=d.schema)
+    parser.add_argument("--no-bulk", dest="bulk", action="store_false", help="MS2 sin GET /productos?ids=")
+    parser.add_argument("--etags", action="store_true", help="ETag + 304 en usuario/producto/pedido")
+    parser.add_argument("--seed", type=int, default=d.seed)
+
+
+def config_from_args(args: argparse.Namespace) -> FakeConfig:
+    return FakeConfig(**{k: getattr(args, k) for k in asdict(FakeConfig())})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="MS1/MS2/MS3 falsos para el benchmark")
+    parser.add_argument("--port", type=int, default=9101, help="MS1 en port, MS2 en port+1, MS3 en port+2")
+    add_arguments(parser)
+    args = parser.parse_args()
+    asyncio.run(serve(config_from_args(args), args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Benchmark de carga del orquestador contra MS1/MS2/MS3 falsos (bench/fakes.py), todo en local.
+
+Levanta los fakes y el orquestador (uvicorn) como subprocesos, ejecuta cada escenario con
+`--concurrency` clientes durante `--duration` segundos (tras un warm-up) y reporta req/s,
+p50/p95/p99 y llamadas a cada MS por request. Guarda el resultado en JSON y, si existe un
+baseline, muestra la diferencia.
+
+    python -m bench.run                                  # escenarios por defecto
+    python -m bench.run --scenarios price_quote --concurrency 64 --latency-ms 20
+    python -m bench.run --out bench/baseline.json        # actualizar el baseline versionado
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+from bench.fakes import FakeConfig, add_arguments, config_from_args, order_id, order_owner
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_BASELINE = ROOT / "bench" / "baseline.json"
+DEFAULT_OUT = ROOT / "bench" / "last_run.json"
+SCENARIOS = ("price_quote", "order_details", "order_poll", "user_orders", "health_deep")
+# escenarios que repiten el GET con el ETag recibido (If-None-Match), como una UI que hace polling
+REVALIDATING = ("order_poll",)
+
+
+# ---------- Procesos ----------
+def _spawn(args: list[str], env: Optional[dict] = None) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, *args], cwd=ROOT, env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, start_new_session=True,
+    )
+
+
+def _stop(proc: subprocess.Popen) -> None:
+    if proc.poll() is None:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+
+
+def _check_free(ports: list[int]) -> None:
+    """Un fake u orquestador de otra corrida en estos puertos respondería en lugar de los nuevos."""
+    for port in ports:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                raise RuntimeError(f"el puerto {port} ya está en uso (¿quedó corriendo otra corrida?)")
+
+
+async def _wait_ready(client: httpx.AsyncClient, url: str, proc: subprocess.Popen, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            err = proc.stderr.read().decode(errors="replace") if proc.stderr else ""
+            raise RuntimeError(f"el proceso terminó antes de estar listo ({url}):\n{err}")
+        try:
+            if (await client.get(url)).status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"timeout esperando {url}")
+
+
+# ---------- Carga ----------
+class Workload:
+    """Genera requests deterministas (semilla) para cada escenario."""
+
+    def __init__(self, cfg: FakeConfig, cart_items: int, seed: int):
+        self.cfg = cfg
+        self.cart_items = cart_items
+        self.rng = random.Random(seed)
+
+    def price_quote(self) -> tuple[str, str, Optional[dict]]:
+        cfg, rng = self.cfg, self.rng
+        items = [
+            {"id_producto": rng.randint(1, cfg.catalog), "cantidad": rng.randint(1, 3)}
+            for _ in range(self.cart_items)
+        ]
+        body = {"id_usuario": rng.randint(1, cfg.users), "id_direccion": rng.randint(1, cfg.addresses),
+                "items": items}
+        return "POST", "/orq/cart/price-quote", body
+
+    def order_details(self) -> tuple[str, str, Optional[dict]]:
+        k = self.rng.randrange(self.cfg.orders)
+        return "GET", f"/orq/orders/{order_id(k)}/details?id_usuario={order_owner(k, self.cfg)}", None
+
+    def order_poll(self) -> tuple[str, str, Optional[dict]]:
+        k = self.rng.randrange(min(20, self.cfg.orders))
+        return "GET", f"/orq/orders/{order_id(k)}/details?id_usuario={order_owner(k, self.cfg)}", None
+
+    def user_orders(self) -> tuple[str, str, Optional[dict]]:
+        return "GET", f"/orq/users/{self.rng.randint(1, self.cfg.users)}/orders?limit=20", None
+
+    def health_deep(self) -> tuple[str, str, Optional[dict]]:
+        return "GET", "/health?deep=1", None
+
+
+async def _drive(client: httpx.AsyncClient, make, concurrency: int, duration: float,
+                 revalidate: bool = False) -> dict:
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    etags: dict[str, str] = {}
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            method, path, body = make()
+            headers = {"If-None-Match": etags[path]} if revalidate and path in etags else None
+            t0 = time.perf_counter()
+            try:
+                r = await client.request(method, path, json=body, headers=headers)
+                statuses[str(r.status_code)] += 1
+                if revalidate and "ETag" in r.headers:
+                    etags[path] = r.headers["ETag"]
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {"elapsed": time.perf_counter() - t0, "latencies": latencies, "statuses": statuses}
+
+
+def _percentile(sorted_values: list[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+def _summary(run: dict, calls: dict) -> dict:
+    lat = sorted(run["latencies"])
+    n = len(lat)
+    ok = sum(v for k, v in run["statuses"].items() if k.startswith("2") or k == "304")
+    ms = lambda s: round(s * 1000, 3) if s is not None else None
+    upstream_total = sum(calls.values())
+    return {
+        "requests": n,
+        "ok": ok,
+        "statuses": dict(run["statuses"]),
+        "duration_s": round(run["elapsed"], 3),
+        "rps": round(n / run["elapsed"], 1) if run["elapsed"] else 0.0,
+        "latency_ms": {
+            "mean": ms(sum(lat) / n) if n else None,
+            "p50": ms(_percentile(lat, 0.50)),
+            "p95": ms(_percentile(lat, 0.95)),
+            "p99": ms(_percentile(lat, 0.99)),
+            "max": ms(lat[-1]) if n else None,
+        },
+        "upstream_calls": {**calls, "total": upstream_total},
+        "upstream_calls_per_request": {
+            k: round(v / n, 3) if n else None for k, v in {**calls, "total": upstream_total}.items()
+        },
+    }
+
+
+async def _upstream_calls(client: httpx.AsyncClient, fake_urls: dict, reset: bool = False) -> dict:
+    out = {}
+    for name, url in fake_urls.items():
+        if reset:
+            await client.post(f"{url}/_reset")
+        else:
+            out[name] = (await client.get(f"{url}/_stats")).json().get("total", 0)
+    return out
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    cfg = config_from_args(args)
+    fake_urls = {name: f"http://127.0.0.1:{args.fake_port + i}" for i, name in enumerate(("ms1", "ms2", "ms3"))}
+    orq_url = f"http://127.0.0.1:{args.port}"
+    fake_args = ["-m", "bench.fakes", "--port", str(args.fake_port)]
+    for k, v in vars(args).items():
+        if k in FakeConfig.__dataclass_fields__ and k not in ("bulk", "etags"):
+            fake_args += [f"--{k.replace('_', '-')}", str(v)]
+    if not cfg.bulk:
+        fake_args.append("--no-bulk")
+    if cfg.etags:
+        fake_args.append("--etags")
+    orq_env = {"MS1_URL": fake_urls["ms1"], "MS2_URL": fake_urls["ms2"], "MS3_URL": fake_urls["ms3"]}
+    if args.workers > 1:
+        # snapshot propio de esta corrida (no uno viejo de otra con otro catálogo)
+        orq_env["CATALOG_SNAPSHOT_PATH"] = os.path.join(tempfile.mkdtemp(prefix="orq-bench-"), "catalog.snap")
+    orq_env.update(kv.split("=", 1) for kv in args.env)
+
+    _check_free([args.port] + [args.fake_port + i for i in range(3)])
+    procs = [_spawn(fake_args)]
+    try:
+        async with httpx.AsyncClient(timeout=5.0) as ctl:
+            for url in fake_urls.values():
+                await _wait_ready(ctl, f"{url}/_stats", procs[0])
+            procs.append(_spawn(["-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.port),
+                                 "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+                                {"WEB_CONCURRENCY": str(args.workers), **orq_env}))
+            await _wait_ready(ctl, f"{orq_url}/health", procs[1])
+
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            results = {}
+            async with httpx.AsyncClient(base_url=orq_url, limits=limits, timeout=30.0) as client:
+                workload = Workload(cfg, args.cart_items, args.seed)
+                for name in args.scenarios:
+                    make = getattr(workload, name)
+                    revalidate = name in REVALIDATING
+                    if args.warmup > 0:
+                        await _drive(client, make, args.concurrency, args.warmup, revalidate)
+                    await _upstream_calls(ctl, fake_urls, reset=True)
+                    run = await _drive(client, make, args.concurrency, args.duration, revalidate)
+                    results[name] = _summary(run, await _upstream_calls(ctl, fake_urls))
+                    _print_scenario(name, results[name])
+    finally:
+        for p in reversed(procs):
+            _stop(p)
+
+    return {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "cart_items": args.cart_items,
+            "fakes": {k: getattr(cfg, k) for k in FakeConfig.__dataclass_fields__},
+            "orchestrator_env": dict(kv.split("=", 1) for kv in args.env),
+        },
+        "results": results,
+    }
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+# ---------- Reporte ----------
+def _print_scenario(name: str, r: dict) -> None:
+    lat = r["latency_ms"]
+    per_req = r["upstream_calls_per_request"]
+    errors = r["requests"] - r["ok"]
+    print(f"{name:<14} {r['rps']:>9.1f} req/s  p50 {lat['p50']:>8} ms  p95 {lat['p95']:>8} ms  "
+          f"p99 {lat['p99']:>8} ms  upstream/req {per_req['total']} "
+          f"(ms1 {per_req.get('ms1')}, ms2 {per_req.get('ms2')}, ms3 {per_req.get('ms3')})"
+          + (f"  errores {errors} {r['statuses']}" if errors else ""), flush=True)
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Imprime deltas contra el baseline; devuelve los escenarios que empeoraron más de `threshold` %."""
+    regressions = []
+    print(f"\nvs baseline ({baseline.get('meta', {}).get('git_rev')}, {baseline.get('meta', {}).get('created_at')}):")
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        d_rps = _delta(cur["rps"], base["rps"])
+        d_p95 = _delta(cur["latency_ms"]["p95"], base["latency_ms"]["p95"])
+        d_calls = _delta(cur["upstream_calls_per_request"]["total"], base["upstream_calls_per_request"]["total"])
+        print(f"  {name:<14} req/s {_fmt_delta(d_rps)}  p95 {_fmt_delta(d_p95)}  upstream/req {_fmt_delta(d_calls)}")
+        if (d_rps is not None and d_rps < -threshold) or (d_p95 is not None and d_p95 > threshold):
+            regressions.append(name)
+    return regressions
+
+
+def _delta(cur, base) -> Optional[float]:
+    if cur is None or not base:
+        return None
+    return (cur - base) / base * 100
+
+
+def _fmt_delta(d: Optional[float]) -> str:
+    return "   n/a" if d is None else f"{d:+6.1f}%"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark del orquestador con MS falsos")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="segundos medidos por escenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="segundos de warm-up (caches) por escenario")
+    parser.add_argument("--cart-items", type=int, default=5, help="líneas por carrito en price_quote")
+    parser.add_argument("--workers", type=int, default=1, help="workers de uvicorn del orquestador")
+    parser.add_argument("--port", type=int, default=9100, help="puerto del orquestador")
+    parser.add_argument("--fake-port", type=int, default=9101, help="MS1 en este puerto, MS2 +1, MS3 +2")
+    parser.add_argument("--env", action="append", default=[], metavar="CLAVE=VALOR",
+                        help="variable de entorno extra para el orquestador (repetible)")
+    parser.add_argument("--out", type=Path, default=DEFAULT_OUT, help="JSON de salida")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="JSON con el que comparar")
+    parser.add_argument("--fail-threshold", type=float, default=None, metavar="PCT",
+                        help="salir con código 1 si req/s cae o p95 sube más de PCT %% vs el baseline")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args))
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(result, indent=2, ensure_ascii=False) + "\n")
+    print(f"\nresultado guardado en {args.out}")
+
+    if args.baseline.exists() and args.baseline.resolve() != args.out.resolve():
+        regressions = compare(result, json.loads(args.baseline.read_text()), args.fail_threshold or 0.0)
+        if args.fail_threshold is not None and regressions:
+            print(f"regresión > {args.fail_threshold}% en: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Micro-benchmark de serialización para un pedido de 100 líneas (`order_details`).
+
+- encode: camino genérico de FastAPI (jsonable_encoder + JSONResponse) vs FastJSONResponse
+- decode: body del pedido de MS3 leído dos veces con `r.json()` vs `response_json(r)`
+
+    python -m bench.serialization --lines 100 --number 2000
+"""
+import argparse
+import json
+import timeit
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app import codec
+from app.codec import FastJSONResponse, response_json
+
+
+def order_details_payload(lines: int) -> dict:
+    items = [{
+        "id_producto": i,
+        "nombre": f"Producto {i} – edición ñandú",
+        "cantidad": float(i % 3 + 1),
+        "precio_unitario_ms3": round(10 + i * 1.37, 2),
+        "line_total_ms3": round((10 + i * 1.37) * (i % 3 + 1), 2),
+        "current_price_ms2": round(10 + i * 1.37, 2),
+        "price_changed_since_order": False,
+        "categoria_id": i % 20 + 1,
+        "categoria_nombre": f"Categoría {i % 20 + 1}",
+    } for i in range(1, lines + 1)]
+    return {
+        "orderId": "ord-1",
+        "estado": "pendiente",
+        "fecha_pedido": "2025-01-01",
+        "user": {"id_usuario": 1, "nombre": "Usuario 1", "correo": "u1@x.pe", "telefono": "999",
+                 "direcciones_count": 3},
+        "lines": items,
+        "issues": [],
+        "totals": {"total_ms3": 1234.5, "recomputed_subtotal_ms3": 1046.19, "taxes_estimated": 188.31,
+                   "total_estimated": 1234.5},
+    }
+
+
+def ms3_order_response(lines: int) -> bytes:
+    return json.dumps({
+        "_id": "ord-1", "id_usuario": 1, "estado": "pendiente", "fecha_pedido": "2025-01-01", "total": 1234.5,
+        "productos": [{"id_producto": i, "cantidad": i % 3 + 1, "precio_unitario": round(10 + i * 1.37, 2)}
+                      for i in range(1, lines + 1)],
+    }).encode()
+
+
+def _us(seconds: float, number: int) -> float:
+    return round(seconds / number * 1e6, 2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Costo de serialización por pedido")
+    parser.add_argument("--lines", type=int, default=100)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    payload = order_details_payload(args.lines)
+    body = ms3_order_response(args.lines)
+    assert json.loads(FastJSONResponse(payload).body) == json.loads(JSONResponse(jsonable_encoder(payload)).body)
+
+    def encode_before():
+        JSONResponse(jsonable_encoder(payload))
+
+    def encode_after():
+        FastJSONResponse(payload)
+
+    def decode_before():
+        r = httpx.Response(200, content=body)
+        r.json()
+        r.json()  # la misma respuesta compartida (singleflight / lookups del batch)
+
+    def decode_after():
+        r = httpx.Response(200, content=body)
+        response_json(r)
+        response_json(r)
+
+    n = args.number
+    rows = [
+        ("encode", encode_before, encode_after),
+        ("decode x2", decode_before, decode_after),
+    ]
+    print(f"{args.lines} líneas, {n} iteraciones, orjson={'sí' if codec.HAVE_ORJSON else 'no (stdlib)'}")
+    print(f"{'':<10} {'antes (µs)':>12} {'después (µs)':>14} {'x':>6}")
+    for name, before, after in rows:
+        t_before = min(timeit.repeat(before, number=n, repeat=3))
+        t_after = min(timeit.repeat(after, number=n, repeat=3))
+        print(f"{name:<10} {_us(t_before, n):>12} {_us(t_after, n):>14} {t_before / t_after:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
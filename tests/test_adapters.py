@@ -0,0 +1,43 @@
+from app.adapters import SchemaAdapter
+
+
+def _product() -> SchemaAdapter:
+    return SchemaAdapter(
+        "ms2_producto",
+        precio=("precio", "price", "valor"),
+        categoria_id=("categoria_id", "id_categoria", ("categoria", "id"), ("categoria", "id_categoria"),
+                      ("category", "id")),
+    )
+
+
+def test_higher_priority_alias_wins_after_learning_a_later_one():
+    adapter = _product()
+    assert adapter.precio({"price": 10}) == 10
+    assert adapter.precio({"price": 10}) == 10
+    probes = adapter.stats()["probes"]
+    assert adapter.precio({"precio": 5, "price": 10}) == 5  # como pick(): gana "precio"
+    assert adapter.precio({"precio": None, "price": 10}) == 10
+    assert adapter.stats()["probes"] == probes  # sin recorrer la lista completa
+
+
+def test_nested_inner_priority_and_flat_over_nested():
+    adapter = _product()
+    assert adapter.categoria_id.as_int({"categoria": {"id_categoria": "3"}}) == 3
+    assert adapter.categoria_id.as_int({"categoria": {"id": 4, "id_categoria": 3}}) == 4
+    assert adapter.categoria_id.as_int({"id_categoria": 2, "categoria": {"id": 4}}) == 2
+    assert adapter.stats()["learned"]["categoria_id"] == "categoria.id_categoria"
+
+
+def test_mixed_schemas_converge_without_probing_every_item():
+    adapter = _product()
+    items = [{"precio": 1}, {"price": 2}, {"valor": 3}] * 10
+    assert [adapter.precio(p) for p in items] == [1, 2, 3] * 10
+    assert adapter.stats()["probes"] == 3  # una vez por esquema
+
+
+def test_as_int_falls_back_to_the_next_alias_when_conversion_fails():
+    adapter = _product()
+    assert adapter.categoria_id.as_int({"categoria_id": "abc", "category": {"id": "7"}}) == 7
+    assert adapter.categoria_id.as_int({"categoria_id": 1}) == 1
+    assert adapter.categoria_id.as_int({"precio": 1}) is None
+    assert adapter.precio({}, 0.0) == 0.0
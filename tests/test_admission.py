@@ -0,0 +1,175 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app.admission import (AdmissionController, AdmissionLimiter, AdmissionMiddleware, Overloaded,
+                           parse_route_limits)
+
+
+def test_queue_is_bounded():
+    async def main():
+        limiter = AdmissionLimiter("/orq/x", limit=1, queue_size=1, queue_timeout=1.0)
+        await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1
+        with pytest.raises(Overloaded) as exc:
+            await limiter.acquire()
+        assert exc.value.reason == "queue_full"
+
+        limiter.release()  # el cupo pasa directo al de la cola
+        await queued
+        assert limiter.in_flight == 1 and limiter.waiting == 0
+        limiter.release()
+        assert limiter.stats()["rejected_queue_full"] == 1
+
+    asyncio.run(main())
+
+
+def test_queue_timeout_rejects_and_frees_the_slot_in_queue():
+    async def main():
+        limiter = AdmissionLimiter("/orq/x", limit=1, queue_size=1, queue_timeout=0.01)
+        await limiter.acquire()
+        with pytest.raises(Overloaded) as exc:
+            await limiter.acquire()
+        assert exc.value.reason == "queue_timeout"
+        assert limiter.waiting == 0
+        limiter.release()
+        assert limiter.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_slot_granted_in_the_same_tick_as_the_timeout_is_returned(monkeypatch):
+    async def main():
+        limiter = AdmissionLimiter("/orq/x", limit=1, queue_size=1, queue_timeout=1.0)
+        await limiter.acquire()
+
+        async def granted_then_timeout(fut, timeout):
+            limiter.release()  # el cupo pasa al de la cola...
+            assert fut.done()
+            raise asyncio.TimeoutError  # ...y el timeout vence antes de que despierte
+
+        monkeypatch.setattr(asyncio, "wait_for", granted_then_timeout)
+        with pytest.raises(Overloaded) as exc:
+            await limiter.acquire()
+        monkeypatch.undo()
+        assert exc.value.reason == "queue_timeout"
+        assert limiter.in_flight == 0 and limiter.waiting == 0
+        await limiter.acquire()  # el cupo no se perdió
+        assert limiter.in_flight == 1
+
+    asyncio.run(main())
+
+
+def test_waiters_are_admitted_in_fifo_order():
+    async def main():
+        limiter = AdmissionLimiter("/orq/x", limit=1, queue_size=3, queue_timeout=1.0)
+        await limiter.acquire()
+        order = []
+
+        async def waiter(i):
+            await limiter.acquire()
+            order.append(i)
+
+        tasks = [asyncio.create_task(waiter(i)) for i in range(3)]
+        await asyncio.sleep(0)
+        for _ in range(3):
+            limiter.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order == [0, 1, 2]
+
+    asyncio.run(main())
+
+
+def test_aimd_decreases_on_high_latency_or_errors_and_grows_back():
+    async def main():
+        latency = [0.5]
+        limiter = AdmissionLimiter("/orq/x", limit=10, queue_size=0, queue_timeout=0.1, adaptive=True,
+                                   min_limit=2, signal=lambda: latency[0], target=0.25,
+                                   adjust_interval=0.0, decrease=0.5)
+        for expected in (5, 2, 2):  # nunca baja de min_limit
+            await limiter.acquire()
+            limiter.release()
+            assert int(limiter.limit) == expected
+
+        latency[0] = 0.1
+        await limiter.acquire()
+        limiter.release(ok=False)  # 5xx: señal de congestión aunque la latencia esté bien
+        assert int(limiter.limit) == 2
+
+        await limiter.acquire()
+        await limiter.acquire()  # límite en uso
+        limiter.release()
+        assert int(limiter.limit) == 3  # +1 por ajuste
+        limiter.release()
+        assert int(limiter.limit) == 3  # sin uso no crece
+        assert limiter.stats()["decreases"] == 4
+
+    asyncio.run(main())
+
+
+def _app(limit: int, queue_size: int, route_limits=None):
+    release = asyncio.Event()
+
+    async def slow(request):
+        await release.wait()
+        return JSONResponse({"ok": True})
+
+    async def health(request):
+        return JSONResponse({"status": "ok"})
+
+    app = Starlette(routes=[Route("/orq/slow/{id}", slow), Route("/health", health)])
+    controller = AdmissionController(app.router, limit=limit, queue_size=queue_size, queue_timeout=1.0,
+                                     retry_after=2, route_limits=route_limits)
+    app.add_middleware(AdmissionMiddleware, controller=controller)
+    return app, controller, release
+
+
+def test_middleware_sheds_with_503_and_retry_after():
+    app, controller, release = _app(limit=1, queue_size=1)
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://orq") as client:
+            admitted = asyncio.create_task(client.get("/orq/slow/1"))
+            queued = asyncio.create_task(client.get("/orq/slow/2"))
+            while controller.limiters.get("/orq/slow/{id}") is None or \
+                    controller.limiters["/orq/slow/{id}"].waiting == 0:
+                await asyncio.sleep(0.001)
+
+            shed = await client.get("/orq/slow/3")
+            assert shed.status_code == 503
+            assert shed.headers["Retry-After"] == "2"
+            assert shed.json()["reason"] == "queue_full"
+            assert (await client.get("/health")).status_code == 200  # fuera de /orq/*
+
+            release.set()
+            assert (await admitted).status_code == 200
+            assert (await queued).status_code == 200
+        stats = controller.stats()["/orq/slow/{id}"]
+        assert stats["in_flight"] == 0 and stats["rejected_queue_full"] == 1
+
+    asyncio.run(main())
+
+
+def test_route_limit_zero_disables_admission():
+    app, controller, release = _app(limit=1, queue_size=0, route_limits={"/orq/slow/{id}": 0})
+    release.set()
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://orq") as client:
+            responses = await asyncio.gather(*(client.get(f"/orq/slow/{i}") for i in range(3)))
+        assert [r.status_code for r in responses] == [200, 200, 200]
+        assert controller.stats() == {}
+
+    asyncio.run(main())
+
+
+def test_parse_route_limits():
+    assert parse_route_limits("/orq/cart/price-quote=100, /orq/users/{id_usuario}/orders=0,") == {
+        "/orq/cart/price-quote": 100, "/orq/users/{id_usuario}/orders": 0}
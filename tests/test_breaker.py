@@ -0,0 +1,110 @@
+import asyncio
+
+import httpx
+import pytest
+
+import app.breaker
+from app.breaker import CircuitBreaker, CircuitOpenError
+from app.upstream import Upstream
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(app.breaker, "time", clock)
+    return clock
+
+
+def _breaker(**kwargs) -> CircuitBreaker:
+    params = dict(window=10, min_calls=4, error_rate=0.5, slow_call=1.0, slow_rate=0.8,
+                  open_seconds=5.0, half_open_calls=2)
+    params.update(kwargs)
+    return CircuitBreaker("ms2_productos", **params)
+
+
+def _call(breaker: CircuitBreaker, ok: bool, latency: float = 0.01) -> None:
+    breaker.acquire()
+    breaker.record(ok, latency)
+    breaker.release()
+
+
+def test_opens_when_error_rate_exceeded(clock):
+    breaker = _breaker()
+    for ok in (True, False, False):
+        _call(breaker, ok)
+    assert breaker.state == CircuitBreaker.CLOSED  # aún no hay min_calls
+    _call(breaker, False)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError) as exc:
+        breaker.acquire()
+    assert exc.value.retry_after == pytest.approx(5.0)
+    assert breaker.rejected == 1
+
+
+def test_opens_on_slow_calls(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        _call(breaker, True, latency=2.0)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_half_open_closes_after_successful_trials(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        _call(breaker, False)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now += 5.0
+    breaker.acquire()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.acquire()
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()  # solo half_open_calls llamadas de prueba a la vez
+    breaker.record(True, 0.01)
+    breaker.release()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record(True, 0.01)
+    breaker.release()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["window_calls"] == 0  # la ventana arranca de cero
+
+
+def test_failed_trial_reopens(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        _call(breaker, False)
+    clock.now += 5.0
+    _call(breaker, False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened_count == 2
+    clock.now += 4.9
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+
+
+def test_upstream_fails_fast_while_open(clock):
+    sent = []
+
+    def handler(request):
+        sent.append(request.url.path)
+        return httpx.Response(503)
+
+    async def main():
+        upstream = Upstream("ms2_productos", "http://ms2", coalesce=False, breaker=_breaker())
+        upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        for _ in range(4):
+            assert (await upstream.get("/productos/1")).status_code == 503
+        with pytest.raises(CircuitOpenError):
+            await upstream.get("/productos/1")
+        await upstream.aclose()
+
+    asyncio.run(main())
+    assert len(sent) == 4
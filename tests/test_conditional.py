@@ -0,0 +1,76 @@
+import asyncio
+
+import httpx
+
+from app.conditional import Revalidator, etag_matches, strong_etag
+from app.upstream import Upstream
+
+
+def _upstream(state: dict):
+    """MS1 simulado: ETag = versión del usuario; 304 si el cliente la tiene."""
+    sent = []
+
+    def handler(request):
+        sent.append(request.headers.get("If-None-Match"))
+        if state.get("gone"):
+            return httpx.Response(404)
+        etag = f'"u{state["version"]}"'
+        if request.headers.get("If-None-Match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, json={"nombre": state["nombre"]}, headers={"ETag": etag})
+
+    upstream = Upstream("ms1_usuarios", "http://ms1", coalesce=False)
+    upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return upstream, sent
+
+
+def test_304_reuses_the_parsed_value_without_parsing_again():
+    state = {"version": 1, "nombre": "Ana"}
+    parsed = []
+
+    def parse(r):
+        parsed.append(r.status_code)
+        return r.json()
+
+    async def main():
+        upstream, sent = _upstream(state)
+        revalidator = Revalidator(upstream)
+        first = await revalidator.get("/usuarios/1", parse)
+        second = await revalidator.get("/usuarios/1", parse)
+        assert first == second == (200, {"nombre": "Ana"}, '"u1"')
+        assert second[1] is first[1]  # el mismo objeto ya parseado
+        assert parsed == [200] and sent == [None, '"u1"']
+
+        state.update(version=2, nombre="Ana María")
+        assert await revalidator.get("/usuarios/1", parse) == (200, {"nombre": "Ana María"}, '"u2"')
+        assert parsed == [200, 200]
+
+        state["gone"] = True  # un 404 olvida lo guardado
+        assert await revalidator.get("/usuarios/1", parse) == (404, None, None)
+        assert revalidator.stats()["entries"] == 0
+        assert revalidator.not_modified == 1 and revalidator.modified == 2
+        await upstream.aclose()
+
+    asyncio.run(main())
+
+
+def test_disabled_revalidator_never_sends_validators():
+    state = {"version": 1, "nombre": "Ana"}
+
+    async def main():
+        upstream, sent = _upstream(state)
+        revalidator = Revalidator(upstream, enabled=False)
+        for _ in range(2):
+            assert (await revalidator.get("/usuarios/1", lambda r: r.json()))[0] == 200
+        assert sent == [None, None]
+        await upstream.aclose()
+
+    asyncio.run(main())
+
+
+def test_etag_matches_uses_weak_comparison():
+    etag = strong_etag({"id": 1})
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"otro", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag) and not etag_matches('"otro"', etag)
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import re
+
+import httpx
+import pytest
+
+from app.history import HistoryWriter
+from app.upstream import Upstream
+
+
+class FakeMS3:
+    """MS3 con una sola ruta de historial activa (solo POST; GET → 405) y un set de pedidos."""
+
+    def __init__(self, route, orders):
+        self.route = route
+        self.orders = set(orders)
+        self.posts = []
+
+    def _matches(self, path: str) -> bool:
+        return self.route is not None and re.fullmatch(self.route.replace("{order_id}", "[^/]+"), path) is not None
+
+    def __call__(self, request):
+        path = request.url.path
+        if not self._matches(path):
+            return httpx.Response(404)
+        if request.method != "POST":
+            return httpx.Response(405)
+        self.posts.append(path)
+        if "{order_id}" in self.route:
+            order_id = path.split("/")[2]
+        else:
+            order_id = json.loads(request.content).get("id_pedido")
+        if order_id not in self.orders:
+            return httpx.Response(404, json={"detail": "Pedido no encontrado"})
+        return httpx.Response(201, json={"ok": True})
+
+
+@pytest.fixture
+def ms3():
+    fake = FakeMS3("/historial", {"p1"})
+    upstream = Upstream("ms3_pedidos", "http://ms3", coalesce=False)
+    upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(fake))
+    return fake, HistoryWriter(upstream, ttl=3600, unsupported_ttl=600)
+
+
+def test_404_on_learned_route_rediscovers_when_the_route_is_gone(ms3):
+    fake, writer = ms3
+
+    async def main():
+        assert (await writer.write("p1", "CREADO", ""))[0]
+        assert writer.stats()["routes"]["http://ms3"]["path"] == "/historial"
+
+        fake.route = "/pedidos/{order_id}/historial"  # MS3 movió el historial
+        ok, msg = await writer.write("p1", "PAGADO", "")
+        assert ok and msg.endswith("/pedidos/p1/historial")
+        assert writer.rediscoveries == 1
+        assert writer.stats()["routes"]["http://ms3"]["path"] == "/pedidos/{order_id}/historial"
+
+        assert (await writer.write("p1", "ENVIADO", ""))[0]  # ya sin re-descubrir
+        assert writer.rediscoveries == 1 and writer.discoveries == 2
+
+    asyncio.run(main())
+
+
+def test_404_for_an_unknown_order_keeps_the_learned_route(ms3):
+    fake, writer = ms3
+
+    async def main():
+        await writer.write("p1", "CREADO", "")
+        ok, msg = await writer.write("p9", "PAGADO", "")  # la ruta existe (GET → 405): el 404 es del pedido
+        assert not ok and "404" in msg
+        assert writer.rediscoveries == 0 and writer.discoveries == 1
+        assert fake.posts[-1] == "/historial"
+
+    asyncio.run(main())
+
+
+def test_rediscovery_never_caches_unsupported(ms3):
+    fake, writer = ms3
+
+    async def main():
+        await writer.write("p1", "CREADO", "")
+        fake.route = None  # ninguna ruta responde
+        ok, _ = await writer.write("p1", "PAGADO", "")
+        assert not ok
+        assert writer.rediscoveries == 1
+        assert writer.stats()["routes"] == {}  # no quedó "no soportado": el próximo intento vuelve a descubrir
+
+    asyncio.run(main())
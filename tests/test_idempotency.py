@@ -0,0 +1,162 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.idempotency import IdempotencyConflict, IdempotencyStore
+
+
+def _store(**kwargs) -> IdempotencyStore:
+    params = dict(ttl=60, max_entries=100, max_bytes=1 << 20)
+    params.update(kwargs)
+    return IdempotencyStore(**params)
+
+
+def test_concurrent_requests_with_same_key_run_once():
+    async def main():
+        store = _store()
+        calls = 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return b'{"total": 1}'
+
+        results = await asyncio.gather(*(store.run("k", "fp", fn) for _ in range(5)))
+        assert calls == 1
+        assert [body for body, _ in results] == [b'{"total": 1}'] * 5
+        assert sorted(replayed for _, replayed in results) == [False, True, True, True, True]
+        assert await store.run("k", "fp", fn) == (b'{"total": 1}', True)
+        assert calls == 1
+        assert store.stats()["coalesced"] == 4
+
+    asyncio.run(main())
+
+
+def test_same_key_with_other_body_conflicts_in_flight_and_after():
+    async def main():
+        store = _store()
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return b"{}"
+
+        first = asyncio.create_task(store.run("k", "fp-a", slow))
+        await asyncio.sleep(0)
+        with pytest.raises(IdempotencyConflict):
+            await store.run("k", "fp-b", slow)  # en vuelo
+        release.set()
+        await first
+        with pytest.raises(IdempotencyConflict):
+            await store.run("k", "fp-b", slow)  # ya guardado
+        assert store.conflicts == 2
+
+    asyncio.run(main())
+
+
+def test_errors_are_shared_but_not_stored():
+    async def main():
+        store = _store()
+
+        async def boom():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("MS2 caído")
+
+        results = await asyncio.gather(store.run("k", "fp", boom), store.run("k", "fp", boom),
+                                       return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+        async def ok():
+            return b"{}"
+
+        assert await store.run("k", "fp", ok) == (b"{}", False)  # la key quedó libre
+
+    asyncio.run(main())
+
+
+def test_store_is_bounded():
+    async def main():
+        store = _store(max_entries=2)
+        for key in ("a", "b", "c"):
+            await store.run(key, "fp", _body(b"{}"))
+        assert store.stats()["entries"] == 2
+        assert store.evictions == 1
+        assert (await store.run("a", "fp", _body(b'{"otra": 1}')))[1] is False  # "a" fue expulsada
+
+    asyncio.run(main())
+
+
+# --- a través del endpoint (MS1/MS2 simulados, sin red) ---
+
+QUOTE = {"id_usuario": 7001, "id_direccion": 1, "items": [{"id_producto": 1, "cantidad": 2}]}
+
+
+@pytest.fixture
+def orq():
+    from app import main
+
+    calls = {"usuarios": 0}
+
+    async def handler(request):
+        path = request.url.path
+        if path.startswith("/usuarios/"):
+            calls["usuarios"] += 1
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"id_usuario": 7001, "nombre": "Ana"})
+        if path.startswith("/direcciones/"):
+            return httpx.Response(200, json=[{"id_direccion": 1}])
+        if path == "/productos":
+            return httpx.Response(200, json=[{"id_producto": 1, "nombre": "p1", "precio": 10.0}])
+        if path.startswith("/productos/"):
+            return httpx.Response(200, json={"id_producto": 1, "nombre": "p1", "precio": 10.0})
+        return httpx.Response(404)
+
+    for upstream in main.UPSTREAMS:
+        upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    yield main, calls
+    for upstream in main.UPSTREAMS:
+        upstream.client = None
+    main.user_cache.clear()
+    main.address_cache.clear()
+
+
+def test_price_quote_replays_concurrent_requests(orq):
+    main, calls = orq
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://orq") as client:
+            headers = {"Idempotency-Key": "test-replay"}
+            responses = await asyncio.gather(*(
+                client.post("/orq/cart/price-quote", json=QUOTE, headers=headers) for _ in range(3)))
+            return responses
+
+    responses = asyncio.run(run())
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert len({r.content for r in responses}) == 1
+    assert sorted(r.headers.get("Idempotent-Replayed", "") for r in responses) == ["", "true", "true"]
+    assert calls["usuarios"] == 1
+
+
+def test_price_quote_rejects_key_reuse_with_other_body(orq):
+    main, _ = orq
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://orq") as client:
+            headers = {"Idempotency-Key": "test-mismatch"}
+            first = await client.post("/orq/cart/price-quote", json=QUOTE, headers=headers)
+            other = {**QUOTE, "items": [{"id_producto": 1, "cantidad": 3}]}
+            second = await client.post("/orq/cart/price-quote", json=other, headers=headers)
+            return first, second
+
+    first, second = asyncio.run(run())
+    assert first.status_code == 200
+    assert second.status_code == 422
+    assert second.json()["detail"] == "Idempotency-Key ya usada con un body distinto"
+
+
+def _body(body: bytes):
+    async def fn():
+        return body
+    return fn
@@ -0,0 +1,39 @@
+import asyncio
+
+import httpx
+
+from app.loader import ProductBatchLoader
+from app.upstream import Upstream
+
+
+def test_ids_missing_from_bulk_are_confirmed_one_by_one():
+    sent = []
+
+    def handler(request):
+        sent.append(request.url.path)
+        if request.url.path == "/productos":
+            # MS2 omite el 2 y el 3 (p.ej. paginó el resultado)
+            return httpx.Response(200, json=[{"id_producto": 1, "nombre": "p1"}])
+        if request.url.path == "/productos/2":
+            return httpx.Response(200, json={"id_producto": 2, "nombre": "p2"})
+        return httpx.Response(404)
+
+    async def main():
+        upstream = Upstream("ms2_productos", "http://ms2", coalesce=False)
+        upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        async def by_id(pid):
+            r = await upstream.get(f"/productos/{pid}")
+            return r.json() if r.status_code == 200 else None
+
+        loader = ProductBatchLoader(upstream, "/productos", "ids", window=0.01, max_batch=10,
+                                    parse=lambda items: {p["id_producto"]: p for p in items}, fallback=by_id)
+        results = await asyncio.gather(*(loader.load(pid) for pid in (1, 2, 3)))
+        await upstream.aclose()
+        return loader, results
+
+    loader, results = asyncio.run(main())
+    assert [r and r["nombre"] for r in results] == ["p1", "p2", None]
+    assert loader.bulk_supported is True
+    assert loader.bulk_calls == 1 and loader.fallback_calls == 2
+    assert sorted(sent) == ["/productos", "/productos/2", "/productos/3"]
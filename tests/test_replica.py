@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+
+from app.snapshot import CatalogReplica
+from app.upstream import Upstream
+
+
+def _ms2(products: dict, changed: set):
+    """MS2 simulado: listado completo, `?desde=` con solo los modificados y GET por id."""
+    def handler(request):
+        path = request.url.path
+        if path == "/productos":
+            if "desde" in request.url.params:
+                return httpx.Response(200, json=[products[pid] for pid in sorted(changed)])
+            return httpx.Response(200, json=list(products.values()))
+        pid = int(path.rsplit("/", 1)[1])
+        if pid not in products:
+            return httpx.Response(404)
+        return httpx.Response(200, json=products[pid])
+
+    upstream = Upstream("ms2_productos", "http://ms2", coalesce=False)
+    upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return upstream
+
+
+def _fields(main, p):
+    return p and (main.PRODUCT.nombre(p), main.to_float(main.PRODUCT.precio(p)), main.extract_category_id(p))
+
+
+async def _assert_matches_upstream(main, replica, upstream, pids):
+    view = replica.view()
+    idx, unit, totals = view.price_lines(pids, [3] * len(pids))
+    for pid, i, price, total in zip(pids, idx, unit, totals):
+        r = await upstream.get(f"/productos/{pid}")
+        expected = r.json() if r.status_code == 200 else None
+        assert _fields(main, replica.get(pid)) == _fields(main, expected)
+        assert (i >= 0) == (expected is not None)
+        assert price == (_fields(main, expected)[1] if expected else 0.0)
+        assert total == round(price * 3, 2)
+
+
+def test_replica_answers_like_upstream_through_full_and_delta_refreshes():
+    from app import main
+
+    products = {
+        1: {"id": 1, "name": "Agua", "valor": 2.5, "category": {"id": 3}},
+        2: {"id": 2, "name": "Pan", "valor": "1.10", "category": {"id": 4}},
+        5: {"id": 5, "name": "Café", "valor": 9.99},
+    }
+    changed = set()
+
+    async def run():
+        upstream = _ms2(products, changed)
+        replica = CatalogReplica(upstream, "/productos", interval=30, max_age=120, parse=main.catalog_rows,
+                                 keys=lambda: main.PRODUCT.stats()["learned"], delta_param="desde")
+        assert replica.view() is None and replica.get(1) is None  # sin cargar: se sigue por MS2
+        await replica.refresh()
+        await _assert_matches_upstream(main, replica, upstream, [1, 2, 5, 7])
+
+        products[2] = {**products[2], "valor": 1.25}  # cambio de precio: se parchea en sitio
+        changed.update({2})
+        assert await replica.refresh()
+        assert replica.delta_loads == 1 and replica.rebuilds == 1
+        await _assert_matches_upstream(main, replica, upstream, [1, 2, 5])
+
+        products[7] = {"id": 7, "name": "Té", "valor": 3.0, "category": {"id": 3}}  # alta: se reconstruye
+        changed.update({7})
+        assert await replica.refresh()
+        assert replica.rebuilds == 2
+        await _assert_matches_upstream(main, replica, upstream, [1, 2, 5, 7, 8])
+        await upstream.aclose()
+
+    asyncio.run(run())
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_identical_calls_share_one_execution():
+    async def main():
+        flight = SingleFlight()
+        calls = 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        results = await asyncio.gather(*(flight.do("k", fn) for _ in range(5)))
+        assert results == ["ok"] * 5
+        assert calls == 1
+        assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4}
+
+    asyncio.run(main())
+
+
+def test_exception_is_shared_and_key_released():
+    async def main():
+        flight = SingleFlight()
+
+        async def boom():
+            await asyncio.sleep(0.01)
+            raise ValueError("MS caído")
+
+        results = await asyncio.gather(flight.do("k", boom), flight.do("k", boom), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        assert len(flight) == 0
+        assert await flight.do("k", _value("de nuevo")) == "de nuevo"
+
+    asyncio.run(main())
+
+
+def test_shared_call_survives_until_last_waiter_is_cancelled():
+    async def main():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        release = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def fn():
+            started.set()
+            try:
+                await release.wait()
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return "ok"
+
+        first = asyncio.create_task(flight.do("k", fn))
+        second = asyncio.create_task(flight.do("k", fn))
+        await started.wait()
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await asyncio.sleep(0)
+        assert not cancelled.is_set()  # queda un llamador esperando
+        assert len(flight) == 1
+
+        second.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        await asyncio.wait_for(cancelled.wait(), 1)  # el último se fue: se cancela la llamada
+        assert len(flight) == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_does_not_affect_the_others():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            return "ok"
+
+        leaver = asyncio.create_task(flight.do("k", fn))
+        stayer = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0)
+        leaver.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await stayer == "ok"
+        assert leaver.cancelled()
+
+    asyncio.run(main())
+
+
+def _value(v):
+    async def fn():
+        return v
+    return fn
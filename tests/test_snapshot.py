@@ -0,0 +1,91 @@
+import asyncio
+
+import httpx
+
+from app.snapshot import CatalogSnapshot, SnapshotPublisher
+from app.upstream import Upstream
+
+
+def _rows(items):
+    return [(p["id_producto"], p["precio"], p.get("categoria_id"), p.get("nombre")) for p in items]
+
+
+def _ms2(catalog: dict):
+    """MS2 simulado: `catalog["version"]` es el ETag; 304 si el cliente ya lo tiene."""
+    calls = []
+
+    def handler(request):
+        calls.append(request.headers.get("If-None-Match"))
+        etag = f'"v{catalog["version"]}"'
+        if request.headers.get("If-None-Match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, json=catalog["items"], headers={"ETag": etag})
+
+    upstream = Upstream("ms2_productos", "http://ms2", coalesce=False)
+    upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return upstream, calls
+
+
+def _publisher(path: str, upstream: Upstream) -> SnapshotPublisher:
+    return SnapshotPublisher(path, upstream, "/productos", interval=60, parse=_rows,
+                             categories=lambda: {1: "Bebidas"},
+                             meta=lambda: {"keys": {"precio": "price", "categoria_id": "category.id"}})
+
+
+def test_followers_reload_across_a_generation_bump(tmp_path):
+    path = str(tmp_path / "catalog.bin")
+    catalog = {"version": 1, "items": [{"id_producto": 1, "precio": 10.0, "categoria_id": 1, "nombre": "Agua"},
+                                       {"id_producto": 2, "precio": 5.0, "nombre": "Pan"}]}
+
+    async def main():
+        upstream, calls = _ms2(catalog)
+        leader, other = _publisher(path, upstream), _publisher(path, upstream)
+        assert leader.try_acquire() and leader.is_leader
+        assert not other.try_acquire()  # el flock lo tiene el líder
+
+        reader = CatalogSnapshot(path, max_age=60, check_interval=0)
+        assert reader.get(1) is None  # aún no hay snapshot
+        assert await leader.publish()
+        # dict con los nombres de campo que usa MS2 (meta["keys"])
+        assert reader.get(1) == {"id_producto": 1, "price": 10.0, "nombre": "Agua", "category": {"id": 1}}
+        first = reader.view()
+        assert first.category_map() == {1: "Bebidas"}
+
+        assert not await leader.publish()  # 304 y mismas categorías: no se re-escribe
+        assert reader.reloads == 1 and leader.not_modified == 1
+
+        catalog["version"] = 2
+        catalog["items"] = [{"id_producto": 1, "precio": 12.5, "categoria_id": 1, "nombre": "Agua"}]
+        assert await leader.publish()
+        assert calls == [None, '"v1"', '"v1"']  # GET condicional con el ETag publicado
+        assert reader.get(1)["price"] == 12.5
+        assert reader.get(2) is None
+        assert reader.reloads == 2
+        assert first.prices[first.index(1)] == 10.0  # el mapeo anterior sigue siendo legible
+
+        await leader.stop()  # el líder muere: otro worker toma el lock
+        assert other.try_acquire()
+        await other.stop()
+        await upstream.aclose()
+
+    asyncio.run(main())
+
+
+def test_stale_snapshot_is_not_served(tmp_path, monkeypatch):
+    path = str(tmp_path / "catalog.bin")
+    catalog = {"version": 1, "items": [{"id_producto": 1, "precio": 10.0}]}
+
+    async def main():
+        upstream, _ = _ms2(catalog)
+        leader = _publisher(path, upstream)
+        leader.try_acquire()
+        await leader.publish()
+        await leader.stop()
+        await upstream.aclose()
+
+    asyncio.run(main())
+    reader = CatalogSnapshot(path, max_age=30, check_interval=0)
+    assert reader.get(1) is not None
+    created = reader.view().created_at
+    monkeypatch.setattr("app.snapshot.time.time", lambda: created + 31)
+    assert reader.get(1) is None and reader.view() is None  # líder caído: no servir datos viejos